@@ -0,0 +1,59 @@
+"""
+マクロ呼び出しをまとめる効果を測る
+
+callmacroをN回呼ぶ場合と、callmacro_batchで1回にまとめる場合の所要時間を比べる。
+fakeはCOM呼び出し1回の往復時間を模擬する。xlwingsは本物のExcelでtest/vbaunit_lib/CallMacro.xlsmのBackReturnを呼ぶ。
+
+python benchmark/callmacro_batch.py [fake|xlwings] [呼び出し数 ...]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+rootdir = Path(__file__).parent.parent
+sys.path.append(str(rootdir.joinpath("src")))
+
+from vbaunit_lib.backend import getbackend  # noqa: E402
+from vbaunit_lib.fakebackend import FakeBackend  # noqa: E402
+from vbaunit_lib.testlib import VBAUnitTestLib  # noqa: E402
+
+BRIDGE = rootdir.joinpath("src", "VBAUnitCOMBridge.xlsm")
+TARGET = rootdir.joinpath("test", "vbaunit_lib", "CallMacro.xlsm")
+CALLDELAY = 0.001  # プロセス外のExcelへのCOM呼び出し1回の往復時間の目安
+
+
+def makebackend(name: str):
+    if name == "fake":
+        backend = FakeBackend(calldelay=CALLDELAY)
+        backend.registermacro(TARGET.name, "BackReturn", lambda p: f"Value is {p}")
+        return backend
+    return getbackend(name)
+
+
+def measure(testlib: VBAUnitTestLib, calls: int) -> tuple[float, float]:
+    start = time.perf_counter()
+    for i in range(calls):
+        res = testlib.callmacro(None, "BackReturn", i)
+        assert res[0] == f"Value is {i}"
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = testlib.callmacro_batch([(None, "BackReturn", (i,)) for i in range(calls)])
+    assert [res[0] for res in results] == [f"Value is {i}" for i in range(calls)]
+    batch = time.perf_counter() - start
+    return single, batch
+
+
+if __name__ == "__main__":
+    backendname = sys.argv[1] if len(sys.argv) > 1 else "fake"
+    callcounts = [int(a) for a in sys.argv[2:]] if len(sys.argv) > 2 else [10, 100, 1000]
+
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=makebackend(backendname))
+    with testlib.runapp(str(TARGET)):
+        testlib.callmacro_batch([(None, "BackReturn", (0,))])  # bridgeへのモジュール追加を計測から外す
+        print(f"backend: {backendname}")
+        print(f"{'calls':>8} {'single':>10} {'batch':>10}")
+        for calls in callcounts:
+            single, batch = measure(testlib, calls)
+            print(f"{calls:>8} {single:>9.3f}s {batch:>9.3f}s")
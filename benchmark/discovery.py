@@ -0,0 +1,74 @@
+"""
+テストケースの列挙にかかる時間を測る
+
+テストモジュールを実行して列挙する方法（exec）と、それをプロセスプールで並列にしたもの（exec -jN）、
+ソースの構文木から列挙する方法（ast）を比べる。
+execはモジュールの読み込みとimportの実行、関数毎のinspect.getsourcelinesが必要になる。
+
+python benchmark/discovery.py [モジュール数 ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+srcdir = Path(__file__).parent.parent.joinpath("src")
+sys.path.append(str(srcdir))
+
+from util.discoverypool import discover_modules  # noqa: E402
+from util.types import TestModule  # noqa: E402
+
+
+def make_module(path: Path, functions: int) -> None:
+    lines = ["from vbaunit_lib.testlib import gettestlib, expect, description, ignore", "", ""]
+    for i in range(functions):
+        if i % 3 == 0:
+            lines.append(f'@description("test {i}")')
+        elif i % 7 == 0:
+            lines.append("@ignore")
+        lines.append(f"def test_function{i:03}():")
+        lines.append("    testlib = gettestlib()")
+        lines.append('    with testlib.runapp("target.xlsm"):')
+        lines.append(f'        expect(testlib.callmacro(None, "Echo", {i})[0] == {i})')
+        lines.append("")
+        lines.append("")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def discover(paths: list[Path], discovery: str) -> int:
+    count = 0
+    for i, path in enumerate(paths):
+        m = TestModule(f"T-{i:05}", "", "GroupA", str(path), True, i + 3)
+        m.pick_testcases(discovery=discovery)
+        count += m.count
+    return count
+
+
+if __name__ == "__main__":
+    modulecounts = [int(a) for a in sys.argv[1:]] if len(sys.argv) > 1 else [50, 200, 800]
+    jobs = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tempdir:
+        print(f"{'modules':>8} {'exec':>10} {f'exec -j{jobs}':>10} {'ast':>10}")
+        for modules in modulecounts:
+            paths = []
+            for i in range(modules):
+                path = Path(tempdir).joinpath(f"set{modules}_{i:05}_test.py")
+                make_module(path, 20)
+                paths.append(path)
+
+            start = time.perf_counter()
+            byexec = discover(paths, "exec")
+            exectime = time.perf_counter() - start
+
+            start = time.perf_counter()
+            byparallel = sum(len(d.tests) for d in discover_modules([str(p) for p in paths], jobs).values())
+            paralleltime = time.perf_counter() - start
+
+            start = time.perf_counter()
+            byast = discover(paths, "ast")
+            asttime = time.perf_counter() - start
+
+            assert byexec == byparallel == byast == modules * 20
+            print(f"{modules:>8} {exectime:>9.3f}s {paralleltime:>9.3f}s {asttime:>9.3f}s")
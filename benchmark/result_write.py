@@ -0,0 +1,82 @@
+"""
+結果のブックの書き込み時間を測る
+
+シナリオのコピーをopenpyxlで丸ごと読み込んで書き直す従来の方法と、
+zipの中の書き換えるシートのXMLだけを直すpatchresultbookを比べる。
+シナリオの全ての行を1つのモジュールとして結果を書き、テストケースの結果はモジュール毎に3つ書き足す。
+
+python benchmark/result_write.py [行数 ...]
+"""
+
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from openpyxl import Workbook, load_workbook
+
+srcdir = Path(__file__).parent.parent.joinpath("src")
+sys.path.append(str(srcdir))
+
+from runner.resultbook import RESULT_COLUMN, patchresultbook, saveresultbook  # noqa: E402
+
+
+def make_scenario(path: Path, rows: int) -> None:
+    book = Workbook()
+    sheet = book.active
+    sheet.title = "GroupA"
+    for col, header in enumerate(["テストID", "説明", "モジュール", "実行", "結果"], start=2):
+        sheet.cell(2, col, header)
+    for i in range(rows):
+        sheet.cell(i + 3, 2, f"A-{i:05}")
+        sheet.cell(i + 3, 3, f"subject {i} " + "x" * 40)
+        sheet.cell(i + 3, 4, f"test/set{i:05}.py")
+        sheet.cell(i + 3, 5, "○")
+    book.save(path)
+
+
+def make_results(rows: int) -> tuple[dict[str, dict[int, str]], list[str]]:
+    marks = {"GroupA": {i + 3: "○△×"[i % 3] for i in range(rows)}}
+    results = [
+        json.dumps({"testid": f"A-{i:05}", "module": f"set{i:05}.py", "function": f"test_{j}", "line": j, "succeeded": True})
+        for i in range(rows)
+        for j in range(3)
+    ]
+    return marks, results
+
+
+def read_results(path: Path) -> tuple[list, list]:
+    book = load_workbook(path, read_only=True)
+    try:
+        marks = [row[0] for row in book["GroupA"].iter_rows(min_col=RESULT_COLUMN, max_col=RESULT_COLUMN, values_only=True)]
+        results = [row[0] for row in book["Results"].iter_rows(max_col=1, values_only=True)]
+        return marks, results
+    finally:
+        book.close()
+
+
+if __name__ == "__main__":
+    rowcounts = [int(a) for a in sys.argv[1:]] if len(sys.argv) > 1 else [1000, 5000, 10000, 50000]
+    with tempfile.TemporaryDirectory() as tempdir:
+        print(f"{'rows':>8} {'size':>8} {'openpyxl':>10} {'patch':>10}")
+        for rows in rowcounts:
+            scenario = Path(tempdir).joinpath(f"scenario_{rows}.xlsx")
+            make_scenario(scenario, rows)
+            marks, results = make_results(rows)
+
+            saved = Path(tempdir).joinpath(f"saved_{rows}.xlsx")
+            shutil.copy(scenario, saved)
+            start = time.perf_counter()
+            saveresultbook(saved, marks=marks, sheetname="Results", rows=results)
+            openpyxltime = time.perf_counter() - start
+
+            patched = Path(tempdir).joinpath(f"patched_{rows}.xlsx")
+            shutil.copy(scenario, patched)
+            start = time.perf_counter()
+            patchresultbook(patched, marks=marks, sheetname="Results", rows=results)
+            patchtime = time.perf_counter() - start
+
+            assert read_results(patched) == read_results(saved)
+            size = scenario.stat().st_size / (1024 * 1024)
+            print(f"{rows:>8} {size:>6.1f}MB {openpyxltime:>9.3f}s {patchtime:>9.3f}s")
@@ -0,0 +1,75 @@
+"""
+シナリオファイルの読み込み時間を測る
+
+read_onlyのブックにcell()で1セルずつアクセスする従来の方法と、行を1回だけ流し読みするTestScenarioを比べる。
+従来の方法は行数に対して二乗で遅くなる。
+
+python benchmark/scenario_parse.py [行数 ...]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+from openpyxl import Workbook, load_workbook
+
+srcdir = Path(__file__).parent.parent.joinpath("src")
+sys.path.append(str(srcdir))
+
+from util.types import TestScenario  # noqa: E402
+
+
+def make_scenario(path: Path, rows: int) -> None:
+    book = Workbook()
+    sheet = book.active
+    sheet.title = "GroupA"
+    for col, header in enumerate(["テストID", "説明", "モジュール", "実行", "結果"], start=2):
+        sheet.cell(2, col, header)
+    for i in range(rows):
+        sheet.cell(i + 3, 2, f"A-{i:05}")
+        sheet.cell(i + 3, 3, f"subject {i}")
+        sheet.cell(i + 3, 4, f"test/set{i:05}.py")
+        sheet.cell(i + 3, 5, "○")
+    book.save(path)
+
+
+def parse_cellwise(path: Path) -> int:
+    """従来のcell()による読み込み"""
+    book = load_workbook(path, read_only=True)
+    count = 0
+    try:
+        for sheet in book.worksheets:
+            if sheet.cell(2, 2).value != "テストID":
+                continue
+            row = 3
+            while sheet.cell(row, 2).value is not None and sheet.cell(row, 2).value != "":
+                _ = (sheet.cell(row, 2).value, sheet.cell(row, 3).value, sheet.cell(row, 4).value, sheet.cell(row, 5).value)
+                count += 1
+                row += 1
+    finally:
+        book.close()
+    return count
+
+
+def parse_streaming(path: Path) -> int:
+    scenario = TestScenario(path)
+    return sum(group.count for group in scenario)
+
+
+if __name__ == "__main__":
+    rowcounts = [int(a) for a in sys.argv[1:]] if len(sys.argv) > 1 else [100, 200, 400, 800]
+    with tempfile.TemporaryDirectory() as tempdir:
+        print(f"{'rows':>8} {'cellwise':>10} {'streaming':>10}")
+        for rows in rowcounts:
+            path = Path(tempdir).joinpath(f"scenario_{rows}.xlsx")
+            make_scenario(path, rows)
+
+            start = time.perf_counter()
+            assert parse_cellwise(path) == rows
+            cellwise = time.perf_counter() - start
+
+            start = time.perf_counter()
+            assert parse_streaming(path) == rows
+            streaming = time.perf_counter() - start
+
+            print(f"{rows:>8} {cellwise:>9.3f}s {streaming:>9.3f}s")
@@ -0,0 +1,57 @@
+"""
+Excelセッションプールの効果を測る
+
+テストケース毎にExcelを起動・終了する場合と、プールで使い回す場合の所要時間を比べる。
+偽物のバックエンドで起動時間を模擬するので、Excelが無くても動く。
+
+python benchmark/session_pool.py [テストケース数] [起動時間(秒)] [ブックを開く時間(秒)]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+srcdir = Path(__file__).parent.parent.joinpath("src")
+sys.path.append(str(srcdir))
+
+from vbaunit_lib.fakebackend import FakeBackend  # noqa: E402
+from vbaunit_lib.session import ExcelSession, ExcelSessionPool  # noqa: E402
+
+BRIDGE = Path("VBAUnitCOMBridge.xlsm")
+TARGETS = ["a.xlsm", "a.xlsm", "a.xlsm", "b.xlsm", "b.xlsm"]
+
+
+def run_perlaunch(testcount: int, backend: FakeBackend) -> float:
+    start = time.perf_counter()
+    for i in range(testcount):
+        session = ExcelSession(backend, BRIDGE)
+        session.opentarget(TARGETS[i % len(TARGETS)])
+        session.close()
+    return time.perf_counter() - start
+
+
+def run_pooled(testcount: int, backend: FakeBackend) -> float:
+    start = time.perf_counter()
+    pool = ExcelSessionPool(backend, BRIDGE)
+    try:
+        for i in range(testcount):
+            session = pool.acquire(TARGETS[i % len(TARGETS)])
+            pool.release(session)
+    finally:
+        pool.shutdown()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    testcount = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    launchdelay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    opendelay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+
+    perlaunch = FakeBackend(launchdelay=launchdelay, opendelay=opendelay)
+    elapsed_perlaunch = run_perlaunch(testcount, perlaunch)
+    pooled = FakeBackend(launchdelay=launchdelay, opendelay=opendelay)
+    elapsed_pooled = run_pooled(testcount, pooled)
+
+    print(f"tests: {testcount}, launch: {launchdelay:.3f}s, open: {opendelay:.3f}s")
+    print(f"per test launch: {elapsed_perlaunch:.3f}s ({perlaunch.launchcount} launches, {perlaunch.opencount} opens)")
+    print(f"session pool   : {elapsed_pooled:.3f}s ({pooled.launchcount} launches, {pooled.opencount} opens)")
@@ -0,0 +1,89 @@
+"""
+モジュール毎に新しいプロセスで実行する時の、待たせておいたワーカーの効果を測る
+
+モジュール毎にプロセスを起動して重いモジュールを読み込んでから実行する方法（cold）と、
+PrewarmedWorkerPoolで次のワーカーを先に起動しておく方法（prewarmed）を比べる。
+Excelの操作は偽物のバックエンドで行う。
+
+python benchmark/workerpool.py [モジュール数 ...]
+"""
+
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+srcdir = Path(__file__).parent.parent.joinpath("src")
+sys.path.append(str(srcdir))
+
+from runner.workerpool import PrewarmedWorkerPool  # noqa: E402
+from util.types import TestModule  # noqa: E402
+
+BRIDGE = Path("VBAUnitCOMBridge.xlsm")
+
+MODULE = """
+import time
+from vbaunit_lib.testlib import expect
+
+
+def test_first():
+    time.sleep(0.05)
+    expect(True)
+
+
+def test_second():
+    time.sleep(0.05)
+    expect(True)
+"""
+
+
+def make_modules(tempdir: Path, modules: int) -> list[TestModule]:
+    testmodules = []
+    for i in range(modules):
+        path = tempdir.joinpath(f"set{modules}_{i:05}_test.py")
+        path.write_text(MODULE, encoding="utf-8")
+        module = TestModule(f"T-{i:05}", "", "GroupA", str(path), True, i + 3)
+        module.pick_testcases()
+        testmodules.append(module)
+    return testmodules
+
+
+def run_cold(testmodules: list[TestModule]) -> None:
+    for module in testmodules:
+        pool = PrewarmedWorkerPool(BRIDGE, "fake")
+        try:
+            for testcase in module:
+                assert pool.execute(testcase).succeeded
+        finally:
+            pool.shutdown()
+
+
+def run_prewarmed(testmodules: list[TestModule]) -> None:
+    pool = PrewarmedWorkerPool(BRIDGE, "fake")
+    try:
+        for module in testmodules:
+            for testcase in module:
+                assert pool.execute(testcase).succeeded
+            pool.recycle()
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    modulecounts = [int(a) for a in sys.argv[1:]] if len(sys.argv) > 1 else [5, 20]
+    with tempfile.TemporaryDirectory() as tempdir:
+        print(f"{'modules':>8} {'cold':>10} {'prewarmed':>10}")
+        for modules in modulecounts:
+            testmodules = make_modules(Path(tempdir), modules)
+
+            start = time.perf_counter()
+            run_cold(testmodules)
+            cold = time.perf_counter() - start
+
+            start = time.perf_counter()
+            run_prewarmed(testmodules)
+            prewarmed = time.perf_counter() - start
+
+            print(f"{modules:>8} {cold:>9.3f}s {prewarmed:>9.3f}s")
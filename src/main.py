@@ -1,10 +1,21 @@
 import sys
 import os
+import math
+from functools import cache, partial
 from pathlib import Path
 from datetime import datetime
 from util.types import TestScenario, TestSuite, TestScope
+from util.scenariocache import ScenarioCache
+from util.discoverycache import DiscoveryCache
+from util.components import exportcomponents
+from util.resultcache import ResultCache
+from util.resulthistory import ResultHistory
+from util.snapshot import SnapshotStore
+from runner.reaper import ExcelReaper
 from runner.run import run_testsuite
-from vbaunit_lib.testlib import setglobalbridgepath
+from runner.scheduler import SCHEDULES, TestScheduler, readhistory
+from vbaunit_lib.testlib import setglobalbridgepath, setglobalbackend
+from vbaunit_lib.backend import getbackend
 
 
 def __isvalidargv(argv: list[str]) -> bool:
@@ -18,6 +29,13 @@ def __isvalidargv(argv: list[str]) -> bool:
     return False
 
 
+def __getargflag(argv: list[str], key: str) -> bool:
+    if key in argv:
+        del argv[argv.index(key)]  # keyを削除
+        return True
+    return False
+
+
 def __getargvalue(argv: list[str], key: str) -> str | None:
     if key in argv:
         keyindex = argv.index(key)
@@ -28,6 +46,15 @@ def __getargvalue(argv: list[str], key: str) -> str | None:
     return None
 
 
+def __isseconds(value: str) -> bool:
+    """0以上の秒数として読めるか。0.5のような小数も受け付ける"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        return False
+    return math.isfinite(seconds) and seconds >= 0
+
+
 def __createoutpudirectory(dir: Path) -> None:
     if str(dir) == "" or dir.exists():
         return
@@ -46,12 +73,41 @@ def initenv(argv: list[str]) -> dict[str, str | Path]:
     6th: -k 実行フィルタ（任意）
     7th: -i 無視フィルタ（任意）
     8th: -s 全部か最後に失敗したものだけか（任意）
+    9th: -b Excelの操作手段。xlwingsかfake（任意）
+    10th: -j 並列実行するワーカーの数（任意）
+    11th: --shard 並列実行でテストケースを分ける単位。moduleかgroup（任意）
+    12th: --discovery テストケースの列挙方法。astかexec（任意）
+    13th: --discovery-jobs モジュールを実行して列挙する時のプロセス数（任意）
+    14th: --isolation テストモジュールを読み直す単位。moduleかtestかprocess（任意）
+    15th: --worker-max-jobs processの時、1つのワーカーで実行するテストケースの上限（任意）
+    16th: --worker-max-memory processの時、ワーカーを入れ替えるメモリ使用量（MB）（任意）
+    17th: --timeout テストケースの既定の制限時間（秒）。0なら無制限（任意）
+    18th: --schedule テストケースを実行する順。scenario、workbook、failedfirst、longestのどれか（任意）
+    19th: --log-flush イベントをファイルに書き出す間隔（秒）。0ならイベント毎（任意）
+    値を取らないスイッチ
+    --no-scenario-cache 解析済みシナリオのキャッシュを使わない
+    --no-discovery-cache テストケースの列挙結果のキャッシュを使わない
+    --fail-on-leak 解放されないまま残ったCOMオブジェクトがあるテストケースを失敗にする
+    --incremental 入力が前に成功した時と同じテストケースを実行しない
+    --force 記録した成功を捨てて全て実行する
+    --snapshot テスト対象のブックのVBAのコードを保存する
     """
+    argv = argv.copy()
+    noscenariocache = __getargflag(argv, "--no-scenario-cache")
+    nodiscoverycache = __getargflag(argv, "--no-discovery-cache")
+    failonleak = __getargflag(argv, "--fail-on-leak")
+    incremental = __getargflag(argv, "--incremental")
+    force = __getargflag(argv, "--force")
+    snapshot = __getargflag(argv, "--snapshot")
+
     if not __isvalidargv(argv):
         print("Usage:")
         print(
             "python main.py {testsuite path} [-w {working directory}][-o {output directory}][-n {test suite name}]"
             "[-d {test suite description}][-g {group name}][-k {execution filter}][-i {ignore filter}][-s {scope}]"
+            "[-b {backend}][-j {jobs}][--shard {shard unit}][--discovery {discovery}][--discovery-jobs {jobs}][--isolation {isolation}]"
+            "[--worker-max-jobs {jobs}][--worker-max-memory {MB}][--timeout {seconds}][--schedule {schedule}][--log-flush {seconds}]"
+            "[--no-scenario-cache][--no-discovery-cache][--fail-on-leak][--incremental][--force][--snapshot]"
         )
         print()
         print("testscenario path: absolute path for scenario file (required)")
@@ -63,6 +119,32 @@ def initenv(argv: list[str]) -> dict[str, str | Path]:
         print("execution filter: filter for the tests to be executed (optional)")
         print("ignore filter: filter for the tests to be ignored (optional)")
         print("scope: all or lastfailed (optional)")
+        print("backend: xlwings or fake (optional)")
+        print("jobs: number of worker processes, each runs its own Excel (optional)")
+        print("shard unit: module or group, tests in the same unit run on the same worker (optional)")
+        print("discovery: ast (read test modules without running them) or exec (optional)")
+        print("discovery jobs: number of processes to run test modules for discovery, default is CPU count (optional)")
+        print(
+            "isolation: module (load each test module once), test (reload it for every test case) "
+            "or process (run each test module in a fresh prewarmed worker process) (optional)"
+        )
+        print("worker max jobs: recycle a worker process after this number of test cases, 0 is unlimited (optional)")
+        print("worker max memory: recycle a worker process when it uses more memory than this (MB), 0 is unlimited (optional)")
+        print("timeout: default time limit for each test case in seconds, @timeout overrides it, 0 is unlimited (optional)")
+        print(
+            "schedule: scenario (scenario order), workbook (keep tests opening the same workbook together), "
+            "failedfirst (tests failed in the last run first) or longest (slowest tests first) (optional)"
+        )
+        print("log flush: interval in seconds to flush events.jsonl, 0 flushes every event (optional)")
+        print("--no-scenario-cache: always parse the scenario file (optional)")
+        print("--no-discovery-cache: always discover test cases from test modules (optional)")
+        print("--fail-on-leak: fail test cases that leave COM objects not freed, instead of only warning (optional)")
+        print(
+            "--incremental: report a test as cached pass without running it when its module, workbooks and bridge "
+            "are unchanged since it passed (optional)"
+        )
+        print("--force: discard recorded passes and run every test (optional)")
+        print("--snapshot: save the VBA code of the workbooks under test for this run (optional)")
         print()
         sys.exit()
 
@@ -83,6 +165,22 @@ def initenv(argv: list[str]) -> dict[str, str | Path]:
         "filters": "",
         "ignores": "",
         "scope": "all",
+        "backend": "xlwings",
+        "jobs": "1",
+        "shard": "module",
+        "discovery": "ast",
+        "discoveryjobs": str(os.cpu_count() or 1),
+        "isolation": "module",
+        "workermaxjobs": "0",
+        "workermaxmemory": "0",
+        "timeout": "0",
+        "schedule": "scenario",
+        "logflush": "1",
+        "scenariocache": "off" if noscenariocache else "on",
+        "discoverycache": "off" if nodiscoverycache else "on",
+        "leakcheck": "fail" if failonleak else "warn",
+        "resultcache": "force" if force else "on" if incremental else "off",
+        "snapshot": "on" if snapshot else "off",
     }
 
     try:
@@ -98,7 +196,7 @@ def initenv(argv: list[str]) -> dict[str, str | Path]:
         if name is not None:
             args["name"] = name
 
-        subject = __getargvalue(argstack, "-j")
+        subject = __getargvalue(argstack, "-d")
         if subject is not None:
             subject = subject.strip('"')  # ダブルクオートを外す
             args["subject"] = subject
@@ -119,6 +217,61 @@ def initenv(argv: list[str]) -> dict[str, str | Path]:
         if scope is not None:
             if scope == "all" or scope == "lastfailed":
                 args["scope"] = scope
+
+        backend = __getargvalue(argstack, "-b")
+        if backend is not None:
+            if backend == "xlwings" or backend == "fake":
+                args["backend"] = backend
+
+        jobs = __getargvalue(argstack, "-j")
+        if jobs is not None:
+            if jobs.isdecimal() and int(jobs) > 0:
+                args["jobs"] = jobs
+
+        shard = __getargvalue(argstack, "--shard")
+        if shard is not None:
+            if shard == "module" or shard == "group":
+                args["shard"] = shard
+
+        discovery = __getargvalue(argstack, "--discovery")
+        if discovery is not None:
+            if discovery == "ast" or discovery == "exec":
+                args["discovery"] = discovery
+
+        discoveryjobs = __getargvalue(argstack, "--discovery-jobs")
+        if discoveryjobs is not None:
+            if discoveryjobs.isdecimal() and int(discoveryjobs) > 0:
+                args["discoveryjobs"] = discoveryjobs
+
+        isolation = __getargvalue(argstack, "--isolation")
+        if isolation is not None:
+            if isolation == "module" or isolation == "test" or isolation == "process":
+                args["isolation"] = isolation
+
+        workermaxjobs = __getargvalue(argstack, "--worker-max-jobs")
+        if workermaxjobs is not None:
+            if workermaxjobs.isdecimal():
+                args["workermaxjobs"] = workermaxjobs
+
+        workermaxmemory = __getargvalue(argstack, "--worker-max-memory")
+        if workermaxmemory is not None:
+            if workermaxmemory.isdecimal():
+                args["workermaxmemory"] = workermaxmemory
+
+        timeout = __getargvalue(argstack, "--timeout")
+        if timeout is not None:
+            if __isseconds(timeout):
+                args["timeout"] = timeout
+
+        schedule = __getargvalue(argstack, "--schedule")
+        if schedule is not None:
+            if schedule in SCHEDULES:
+                args["schedule"] = schedule
+
+        logflush = __getargvalue(argstack, "--log-flush")
+        if logflush is not None:
+            if __isseconds(logflush):
+                args["logflush"] = logflush
     except IndexError as e:
         print(f"[ERR]Invalid argument format: {e}")
         # とりあえず継続する
@@ -170,6 +323,11 @@ if __name__ == "__main__":
 
     print(f"using bridge: {bridgepath}")
 
+    backend = getbackend(str(testconfig["backend"]))
+    setglobalbackend(backend)
+
+    print(f"using backend: {backend.name}")
+
     sys.path.append(str(tooldir.joinpath("src")))  # テストコードの方でvbaunit_libが使えるようになる
 
     __createoutpudirectory(Path(testconfig["out"]))
@@ -178,8 +336,31 @@ if __name__ == "__main__":
 
     os.chdir(testconfig["work"])
 
-    scenario = TestScenario(Path(str(testconfig["scenario"])))
-
+    # 解析済みのシナリオはresultsの隣にキャッシュする
+    cachedir = Path(testconfig["out"]).parent.joinpath(".vbaunit")
+    pidmanifest = cachedir.joinpath("excel-pids.jsonl")
+    notes: list[str] = []
+    if testconfig["scenariocache"] == "on":
+        scenariocache = ScenarioCache(cachedir)
+        scenario = scenariocache.load(Path(str(testconfig["scenario"])))
+        notes.append(scenariocache.logline)
+        print(scenariocache.logline)
+    else:
+        scenario = TestScenario(Path(str(testconfig["scenario"])))
+        notes.append("Scenario cache: disabled")
+
+    discoverycache = DiscoveryCache(cachedir) if testconfig["discoverycache"] == "on" else None
+    resulthistory = ResultHistory(cachedir)
+    # 結果のキャッシュとコードの保存で同じブックを2回開かない
+    # コードを読むために起動したExcelも、落ちたら次の実行で片付けられるように記録する
+    exporter = cache(partial(exportcomponents, backend, onlaunch=ExcelReaper(pidmanifest, backend).record))
+    resultcache = None
+    if testconfig["resultcache"] != "off":
+        # 使ったVBComponentだけを比べるために、VBAが変わったブックは最初にコードを読む
+        resultcache = ResultCache(cachedir, exporter=exporter)
+        if testconfig["resultcache"] == "force":
+            resultcache.clear()
+    snapshots = SnapshotStore(cachedir, exporter=exporter) if testconfig["snapshot"] == "on" else None
     testsuite = TestSuite(
         name=str(testconfig["name"]),
         subject=str(testconfig["subject"]),
@@ -188,7 +369,19 @@ if __name__ == "__main__":
         filters=str(testconfig["filters"]),
         ignores=str(testconfig["ignores"]),
         scope=TestScope(testconfig["scope"]),
+        discovery=str(testconfig["discovery"]),
+        discoverycache=discoverycache,
+        discoveryjobs=int(str(testconfig["discoveryjobs"])),
+        resulthistory=resulthistory,
     )
+    discoverycount = testsuite.discoverycount
+    notes.append(
+        f"Discovery: {discoverycount['ast']} modules by ast, {discoverycount['exec']} by exec, {discoverycount['cache']} from cache"
+    )
+    notes.append(discoverycache.logline if discoverycache is not None else "Discovery cache: disabled")
+
+    # 前回のテストログの実行時間と成否で並べ替える
+    scheduler = TestScheduler(str(testconfig["schedule"]), readhistory(Path(testconfig["out"]).joinpath("testlog.txt")))
 
     # テスト実行
 
@@ -201,6 +394,24 @@ if __name__ == "__main__":
         Path(str(testconfig["scenario"])),
         bridgepath,
         Path(testconfig["out"]),
+        backend=backend,
+        jobs=int(str(testconfig["jobs"])),
+        shard=str(testconfig["shard"]),
+        notes=notes,
+        isolation=str(testconfig["isolation"]),
+        workermaxjobs=int(str(testconfig["workermaxjobs"])),
+        workermaxmemory=int(str(testconfig["workermaxmemory"])),
+        failonleak=testconfig["leakcheck"] == "fail",
+        timeout=float(str(testconfig["timeout"])),
+        pidmanifest=pidmanifest,
+        scheduler=scheduler,
+        resulthistory=resulthistory,
+        resultcache=resultcache,
+        snapshots=snapshots,
+        logflush=float(str(testconfig["logflush"])),
     )
+    resulthistory.close()
+    if resultcache is not None:
+        resultcache.close()
 
     os.chdir(currentdir)
@@ -0,0 +1,209 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable
+from util.snapshot import SnapshotStats, snapshotlogline
+from vbaunit_lib.comretry import RetryStats, retrylogline
+from runner.reaper import ReapStats, reaplogline
+
+
+EVENT_SUITE_START = "suite_start"
+EVENT_TEST_START = "test_start"
+EVENT_COM_RETRY = "com_retry"
+EVENT_TEST_END = "test_end"
+EVENT_SUITE_END = "suite_end"
+
+
+class EventLog:
+    """テストの実行をイベント毎に1行のJSONで書く。
+    書き込みは別スレッドで行い、テストケースを実行するスレッドはキューに入れるだけで戻る。
+    コンソールへの表示は、テストケースの出力と順序が入れ替わらないように呼んだスレッドで行う。
+    ファイルへのflushはflushinterval毎にまとめて行う
+    """
+
+    __CLOSE = None
+
+    def __init__(self, path: Path, runid: str, flushinterval: float = 1.0, maxqueue: int = 10000, echo: bool = True) -> None:
+        """path: イベントを書くファイル。前の内容は消す
+        runid: 実行のID。全てのイベントに付ける
+        flushinterval: ファイルにflushする間隔（秒）。0以下ならイベント毎
+        maxqueue: 書き込み待ちのイベントの上限。一杯の時だけ書けるまで待つ
+        echo: Trueならテストケースの開始と終了をコンソールにも出す
+        """
+        self.__path = path
+        self.__runid = runid
+        self.__flushinterval = flushinterval
+        self.__echo = echo
+        self.__queue: queue.Queue = queue.Queue(maxsize=maxqueue)
+        self.__sequence = 0
+        self.__lock = threading.Lock()
+        self.__thread = threading.Thread(target=self.__write, name="vbaunit-eventlog", daemon=True)
+        self.__thread.start()
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+
+    @property
+    def runid(self) -> str:
+        return self.__runid
+
+    def emit(self, event: str, **fields) -> None:
+        """イベントを書き込み待ちに入れる。時刻は呼んだ時のもの"""
+        with self.__lock:
+            self.__sequence += 1
+            record = {
+                "event": event,
+                "run": self.__runid,
+                "seq": self.__sequence,
+                "mono": time.monotonic(),
+                "time": datetime.now().isoformat(sep=" ", timespec="milliseconds"),
+            }
+        record.update(fields)
+        if self.__echo:
+            self.__print(record)
+        self.__queue.put(record)
+
+    def close(self) -> None:
+        """残りを書き切ってファイルを閉じる"""
+        if self.__thread.is_alive():
+            self.__queue.put(EventLog.__CLOSE)
+            self.__thread.join()
+
+    def __print(self, record: dict) -> None:
+        if record["event"] == EVENT_TEST_START:
+            print("Running test case:")
+        if record["event"] in (EVENT_TEST_START, EVENT_TEST_END):
+            for line in renderevent(record):
+                print(line)
+
+    def __write(self) -> None:
+        try:
+            f = open(self.__path, mode="w", encoding="utf-8")
+        except OSError as e:
+            print(f"[ERR]could not open event log {self.__path}: {e}")
+            f = None
+        lastflush = time.monotonic()
+        while True:
+            wait = None if self.__flushinterval <= 0 else max(0.0, lastflush + self.__flushinterval - time.monotonic())
+            try:
+                record = self.__queue.get(timeout=wait)
+            except queue.Empty:
+                record = {}
+            if record is EventLog.__CLOSE:
+                break
+            if len(record) > 0 and f is not None:
+                try:
+                    f.write(json.dumps(record) + "\n")
+                except OSError as e:
+                    print(f"[ERR]could not write event log {self.__path}: {e}")
+            if f is not None and time.monotonic() - lastflush >= max(self.__flushinterval, 0.0):
+                f.flush()
+                lastflush = time.monotonic()
+        if f is not None:
+            f.close()
+
+
+def readevents(path: Path) -> list[dict]:
+    """イベントのファイルを読む。書きかけの行は捨てる"""
+    events: list[dict] = []
+    if not path.exists():
+        return events
+    with open(path, mode="r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+
+def writetestlog(events: Iterable[dict], testlogpath: Path) -> None:
+    """イベントからテキストのテストログを書く"""
+    with open(testlogpath, mode="w", encoding="utf-8") as f:
+        startmono = None
+        for record in events:
+            if record["event"] == EVENT_SUITE_START:
+                startmono = record["mono"]
+            for line in renderevent(record, startmono):
+                f.write(line + "\n")
+
+
+def __teststart(record: dict) -> str:
+    config: dict[str, str] = {
+        "testid": record["testid"],
+        "group": record["group"],
+        "module": record["module"],
+        "function": record["function"],
+        "at": str(record["at"]),
+        "start": record["start"],
+    }
+    if record.get("worker") is not None:
+        config["worker"] = str(record["worker"])
+    return json.dumps(config)
+
+
+def __testend(record: dict) -> str:
+    outcome: dict[str, str] = {"outcome": str(record["succeeded"]), "runned": record["runned"], "elapsed": f"{record['elapsed']:.3f}"}
+    if record.get("timedout"):
+        outcome["timedout"] = str(True)
+    if record.get("cached"):
+        outcome["cached"] = str(True)
+    return json.dumps(outcome)
+
+
+def renderevent(record: dict, startmono: float | None = None) -> list[str]:
+    """イベント1つをテストログの行にする。com_retryは最後の集計にだけ出す。
+    startmono: suite_startのmono。suite_endの所要時間に使う
+    """
+    event = record["event"]
+    if event == EVENT_SUITE_START:
+        lines = [
+            f"Test log for {record['suite']}",
+            f"Run: {record['run']}",
+            f"Subject: {record['subject']}",
+            f"Scenario: {record['scenario']}",
+            f"Output: {record['output']}",
+            f"Bridge: {record['bridge']}",
+            f"Backend: {record['backend']}",
+            f"Jobs: {record['jobs']}",
+            f"Isolation: {record['isolation']}",
+            f"Leak check: {record['leakcheck']}",
+            f"Timeout: {str(record['timeout']) + ' s' if record['timeout'] > 0 else 'none'}",
+        ]
+        if record.get("schedule") is not None:
+            lines.append(record["schedule"])
+        lines.append(f"Result cache: {'enabled' if record['resultcache'] else 'disabled'}")
+        snapshot = record.get("snapshot")
+        lines.append(snapshotlogline(SnapshotStats(**snapshot)) if snapshot is not None else "Snapshot: disabled")
+        lines.extend(record.get("notes", []))
+        lines.extend([f"Started at: {record['started']}", "", "", f"Start at: {record['time']}"])
+        return lines
+    if event == EVENT_TEST_START:
+        return [__teststart(record)]
+    if event == EVENT_TEST_END:
+        return [__testend(record)]
+    if event == EVENT_SUITE_END:
+        lines = ["", f"Finished at: {record['time']}"]
+        workers = record.get("workers")
+        if workers is not None:
+            lines.append(
+                f"Workers: {workers['started']} started, {workers['recycled']} recycled, {workers['crashed']} crashed, {workers['jobs']} jobs"
+            )
+        excel = record["excel"]
+        lines.append(f"Excel sessions: {excel['launched']} launched, {excel['reused']} reused, {excel['reopened']} opened, {excel['closed']} closed")
+        lines.append(retrylogline(RetryStats(**record["retries"])))
+        reaper = record.get("reaper")
+        if reaper is not None:
+            lines.append(reaplogline(ReapStats(**reaper["atstart"]), ReapStats(**reaper["atend"])))
+        if record.get("components") is not None:
+            lines.append(f"VBA components: {record['components']} workbooks exported")
+        timeoutnote = f" ({record['timedout']} timed out)" if record["timedout"] > 0 else ""
+        cachenote = f" ({record['cached']} cached, {record['executed']} executed)" if record.get("cached") is not None else ""
+        elapsed = timedelta(seconds=record["mono"] - startmono) if startmono is not None else timedelta()
+        lines.append(f"---------- {record['failed']} failed{timeoutnote}, {record['passed']} passed{cachenote}, in {elapsed} ----------")
+        return lines
+    return []
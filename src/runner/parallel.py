@@ -0,0 +1,217 @@
+import multiprocessing
+import queue as queuemodule
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable
+from util.types import TestCase, TestModule, TestSuite
+from vbaunit_lib.backend import getbackend
+from vbaunit_lib.comretry import RetryingBackend, RetryStats
+from runner.reaper import ExcelReaper
+from vbaunit_lib.session import ExcelSessionPool, PoolStats
+from vbaunit_lib.testlib import setglobalbackend, setglobalbridgepath, setglobalsessionpool
+
+
+ShardOutcome = namedtuple("ShardOutcome", ["succeeded", "startat", "runned_at", "elapsed", "worker", "timedout", "calledmacros"])
+
+
+def shard_testsuite(
+    suite: TestSuite | Iterable[TestCase],
+    jobs: int,
+    unit: str = "module",
+    cost: Callable[[TestCase], float] | None = None,
+) -> tuple[list[list[TestCase]], list[TestCase]]:
+    """テストケースを並列実行のために分ける。
+    suite: 分けるテストスイートか、実行する順に並べたテストケース
+    jobs: ワーカーの数
+    unit: 分ける単位。moduleかgroup。同じ単位のテストケースは同じワーカーで実行する
+    cost: テストケースの重み。省略すると全て1として、テストケースの数で分ける
+    戻り値: ワーカー毎のテストケースと、並列実行できないので後から直列に実行するテストケース
+    """
+    units: dict[tuple[str, ...], list[tuple[int, TestCase]]] = {}
+    serial: list[TestCase] = []
+    for index, testcase in enumerate(suite):
+        if not testcase.module.parallelsafe:
+            serial.append(testcase)
+            continue
+        key = (testcase.group,) if unit == "group" else (testcase.testid, str(testcase.module.modulepath))
+        units.setdefault(key, []).append((index, testcase))
+
+    unitlist = list(units.values())
+    unitcosts = [sum(cost(tc) if cost is not None else 1 for _, tc in u) for u in unitlist]
+    shards: list[list[tuple[int, TestCase]]] = [[] for _ in range(max(1, min(jobs, len(unitlist))))]
+    loads = [0.0] * len(shards)
+    # 重い単位から、その時点で一番軽いワーカーに割り当てる
+    for unitindex in sorted(range(len(unitlist)), key=lambda i: (-unitcosts[i], i)):
+        target = min(range(len(shards)), key=lambda s: (loads[s], s))
+        shards[target].extend(unitlist[unitindex])
+        loads[target] += unitcosts[unitindex]
+
+    # ワーカーの中では渡された順序に戻す
+    return [[testcase for _, testcase in sorted(shard, key=lambda t: t[0])] for shard in shards if len(shard) > 0], serial
+
+
+def testcase_job(testcase: TestCase, index: int) -> dict:
+    """テストケースを別のプロセスに渡せる形にする"""
+    return {
+        "index": index,
+        "testid": testcase.testid,
+        "group": testcase.group,
+        "subject": testcase.module.subject,
+        "modulepath": str(testcase.module.modulepath),
+        "moduleline": testcase.module.line,
+        "function": testcase.testfunction,
+        "funcsubject": testcase.subject,
+        "line": testcase.start_line,
+    }
+
+
+def testcase_fromjob(job: dict, modules: dict[tuple[str, str], TestModule]) -> TestCase:
+    """testcase_jobの逆。同じテストIDとモジュールのテストケースはmodulesに貯めたTestModuleを共有する"""
+    key = (job["testid"], job["modulepath"])
+    if key not in modules:
+        modules[key] = TestModule(job["testid"], job["subject"], job["group"], job["modulepath"], True, job["moduleline"])
+    return modules[key].add_testcase(job["function"], job["funcsubject"], job["line"], False)
+
+
+def run_parallel(
+    shards: list[list[TestCase]],
+    bridge: Path,
+    backendname: str,
+    onresult: Callable[[TestCase, ShardOutcome], None],
+    isolation: str = "module",
+    failonleak: bool = False,
+    timeout: float = 0.0,
+    manifest: tuple[str, int, float | None] | None = None,
+) -> tuple[PoolStats, RetryStats]:
+    """シャード毎にワーカープロセスを起動して実行する。ワーカーはそれぞれExcelとCOMアパートメントを持つ。
+    結果は終わったものから順にonresultへ渡す。戻り値は全ワーカーのExcelセッションとCOMのやり直しの統計
+    isolation: processなら、シャードの中でもモジュール毎に新しいワーカープロセスで実行する
+    manifest: 起動したExcelを記録するマニフェストのパスとランナーのプロセスIDと起動時刻。Noneなら記録しない
+    """
+    context = multiprocessing.get_context("spawn")
+    resultqueue = context.Queue()
+    # ワーカーの中ではモジュールを1回だけ読み込む
+    innerisolation = "module" if isolation == "process" else isolation
+    batches: dict[int, list[list[dict]]] = {}
+    pending: dict[int, dict[int, TestCase]] = {}
+    for shardid, shard in enumerate(shards):
+        batches[shardid] = []
+        pending[shardid] = {}
+        currentkey = None
+        for index, testcase in enumerate(shard):
+            pending[shardid][index] = testcase
+            key = (testcase.testid, str(testcase.module.modulepath))
+            if len(batches[shardid]) == 0 or (isolation == "process" and key != currentkey):
+                batches[shardid].append([])
+            batches[shardid][-1].append(testcase_job(testcase, index))
+            currentkey = key
+
+    processes: list = []
+    current: dict[int, tuple] = {}
+
+    def startnext(shardid: int) -> bool:
+        """シャードの次のまとまりをワーカープロセスで実行する。残っていなければFalse"""
+        if len(batches[shardid]) == 0:
+            return False
+        jobs = batches[shardid].pop(0)
+        process = context.Process(
+            target=__runshard,
+            args=(shardid, jobs, str(bridge), backendname, innerisolation, failonleak, timeout, manifest, resultqueue),
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+        current[shardid] = (process, [job["index"] for job in jobs])
+        return True
+
+    running = {shardid for shardid in range(len(shards)) if startnext(shardid)}
+    launched = reused = reopened = closed = 0
+    retrystats = RetryStats(0, 0.0, 0, 0.0, 0, 0)
+    while len(running) > 0:
+        try:
+            message = resultqueue.get(timeout=1)
+        except queuemodule.Empty:
+            # 結果を返さずに落ちたワーカーの残りは失敗とする
+            for shardid in list(running):
+                process, indexes = current[shardid]
+                if not process.is_alive():
+                    print(f"[ERR]worker {shardid} exited with code {process.exitcode}")
+                    now = datetime.now().isoformat(sep=" ", timespec="milliseconds")
+                    for index in indexes:
+                        if index in pending[shardid]:
+                            onresult(pending[shardid].pop(index), ShardOutcome(False, now, now, 0.0, shardid, False, []))
+                    if not startnext(shardid):
+                        running.discard(shardid)
+            continue
+
+        if message[0] == "result":
+            _, shardid, index, succeeded, startat, runned_at, elapsed, timedout, calledmacros = message
+            testcase = pending[shardid].pop(index)
+            onresult(testcase, ShardOutcome(succeeded, startat, runned_at, elapsed, shardid, timedout, calledmacros))
+        elif message[0] == "done":
+            _, shardid, stats, retries = message
+            retrystats = RetryStats(*[a + b for a, b in zip(retrystats, retries)])
+            launched += stats[0]
+            reused += stats[1]
+            reopened += stats[2]
+            closed += stats[3]
+            if not startnext(shardid):
+                running.discard(shardid)
+
+    for process in processes:
+        process.join()
+
+    return PoolStats(launched=launched, reused=reused, reopened=reopened, closed=closed), retrystats
+
+
+def __runshard(
+    shardid: int,
+    jobs: list[dict],
+    bridge: str,
+    backendname: str,
+    isolation: str,
+    failonleak: bool,
+    timeout: float,
+    manifest: tuple[str, int, float | None] | None,
+    resultqueue,
+) -> None:
+    """ワーカープロセスの本体。自分のExcelでテストケースを順に実行して結果を返す"""
+    from runner.run import execute_testcase, switch_module  # runner.runがこのモジュールをimportするので実行時に読む
+
+    bridgepath = Path(bridge)
+    setglobalbridgepath(bridgepath)
+    backend = RetryingBackend(getbackend(backendname))
+    setglobalbackend(backend)
+    reaper = ExcelReaper(Path(manifest[0]), backend, owner=manifest[1], ownercreated=manifest[2]) if manifest is not None else None
+    pool = ExcelSessionPool(backend=backend, bridgepath=bridgepath, onlaunch=reaper.record if reaper is not None else None)
+    setglobalsessionpool(pool)
+    modules: dict[tuple[str, str], TestModule] = {}
+    currentmodule = None
+    try:
+        comerrors = backend.comerrors()
+        for job in jobs:
+            testcase = testcase_fromjob(job, modules)
+            currentmodule = switch_module(currentmodule, testcase)
+            startat = datetime.now().isoformat(sep=" ", timespec="milliseconds")
+            result, elapsed = execute_testcase(
+                testcase=testcase, comerrors=comerrors, isolation=isolation, failonleak=failonleak, timeout=timeout
+            )
+            resultqueue.put(
+                (
+                    "result",
+                    shardid,
+                    job["index"],
+                    result.succeeded,
+                    startat,
+                    result.runned_at,
+                    elapsed,
+                    result.timedout,
+                    result.calledmacros,
+                )
+            )
+    finally:
+        switch_module(currentmodule, None)
+        setglobalsessionpool(None)
+        pool.shutdown()
+        resultqueue.put(("done", shardid, tuple(pool.stats), tuple(backend.policy.stats)))
@@ -0,0 +1,130 @@
+import json
+import os
+from collections import namedtuple
+from pathlib import Path
+from vbaunit_lib.backend import ExcelBackend
+
+
+ReapStats = namedtuple("ReapStats", ["reaped", "memory"])
+
+
+class ExcelReaper:
+    """実行中に起動したExcelのプロセスIDをマニフェストに記録して、取り残されたExcelを落とす。
+    マニフェストは1行1プロセスのJSONで、ワーカープロセスからも追記する。
+    起動時には落ちた前の実行の分を、終了時には自分の実行の分で残っているものを落とす
+    """
+
+    def __init__(self, manifestpath: Path, backend: ExcelBackend, owner: int | None = None, ownercreated: float | None = None) -> None:
+        """manifestpath: マニフェストのパス
+        backend: Excelの操作手段。プロセスの確認と終了に使う
+        owner, ownercreated: 実行しているランナーのプロセスIDと起動時刻。ワーカーはランナーのものを渡す。
+            ownerを省略するとこのプロセス
+        """
+        self.__manifestpath = manifestpath
+        self.__backend = backend
+        self.__owner = owner if owner is not None else os.getpid()
+        self.__ownercreated = ownercreated if owner is not None else backend.processcreated(self.__owner)
+
+    @property
+    def owner(self) -> int:
+        return self.__owner
+
+    @property
+    def ownercreated(self) -> float | None:
+        return self.__ownercreated
+
+    def record(self, pid: int) -> None:
+        """起動したExcelをマニフェストに追記する"""
+        info = self.__backend.processinfo(pid)
+        if info is None:
+            return
+        entry = {"pid": pid, "created": info.created, "owner": self.__owner, "ownercreated": self.__ownercreated}
+        try:
+            self.__manifestpath.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.__manifestpath, mode="a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"[WARN]could not record Excel process {pid}: {e}")
+
+    def reapstale(self) -> ReapStats:
+        """前の実行が落ちて残したExcelを落とす。実行中の別のランナーの分には触らない"""
+        alive: dict[tuple, bool] = {}
+        stale: list[dict] = []
+        keep: list[dict] = []
+        for entry in self.__read():
+            owner = (entry["owner"], entry.get("ownercreated"))
+            if owner not in alive:
+                alive[owner] = entry["owner"] != self.__owner and self.__isrunning(*owner)
+            (keep if alive[owner] else stale).append(entry)
+        stats = self.__reap(stale)
+        self.__write(keep)
+        return stats
+
+    def reapown(self) -> ReapStats:
+        """この実行で起動して、終了した後も残っているExcelを落とす"""
+        own: list[dict] = []
+        keep: list[dict] = []
+        for entry in self.__read():
+            (own if entry["owner"] == self.__owner else keep).append(entry)
+        stats = self.__reap(own)
+        self.__write(keep)
+        return stats
+
+    def __reap(self, entries: list[dict]) -> ReapStats:
+        reaped = 0
+        memory = 0
+        for entry in entries:
+            info = self.__backend.processinfo(entry["pid"])
+            # プロセスIDが使い回されていたら別のプロセスなので落とさない
+            if info is None or abs(info.created - entry["created"]) > 1.0:
+                continue
+            print(f"[WARN]reap Excel process {entry['pid']} ({info.memory // (1024 * 1024)} MB)")
+            self.__backend.kill(entry["pid"])
+            reaped += 1
+            memory += info.memory
+        return ReapStats(reaped=reaped, memory=memory)
+
+    def __isrunning(self, pid: int, created: float | None) -> bool:
+        current = self.__backend.processcreated(pid)
+        if current is None:
+            return False
+        # プロセスIDが使い回されていたら、そのランナーはもう動いていない。起動時刻を残していない古い行はIDだけで見る
+        return created is None or abs(current - created) <= 1.0
+
+    def __read(self) -> list[dict]:
+        if not self.__manifestpath.exists():
+            return []
+        entries = []
+        try:
+            with open(self.__manifestpath, mode="r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 書きかけの行は捨てる
+                    if isinstance(entry, dict) and {"pid", "created", "owner"} <= entry.keys():
+                        entries.append(entry)
+        except OSError as e:
+            print(f"[WARN]could not read Excel manifest {self.__manifestpath}: {e}")
+        return entries
+
+    def __write(self, entries: list[dict]) -> None:
+        try:
+            if len(entries) == 0:
+                self.__manifestpath.unlink(missing_ok=True)
+                return
+            temppath = self.__manifestpath.with_suffix(".tmp")
+            with open(temppath, mode="w", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(temppath, self.__manifestpath)
+        except OSError as e:
+            print(f"[WARN]could not write Excel manifest {self.__manifestpath}: {e}")
+
+
+def reaplogline(atstart: ReapStats, atend: ReapStats) -> str:
+    """テストログに書く1行"""
+    return (
+        f"Excel reaper: {atstart.reaped} reaped at start ({atstart.memory / (1024 * 1024):.0f} MB), "
+        f"{atend.reaped} leaked at end ({atend.memory / (1024 * 1024):.0f} MB)"
+    )
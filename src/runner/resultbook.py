@@ -0,0 +1,252 @@
+import os
+import re
+import zipfile
+from pathlib import Path
+from typing import Iterable
+from xml.sax.saxutils import escape, quoteattr
+from openpyxl import load_workbook
+
+
+RESULT_COLUMN = 6  # シナリオのグループのシートで、モジュールの結果を書く列
+
+__RELATIONSHIPS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+__WORKSHEET_TYPE = __RELATIONSHIPS + "/worksheet"
+__WORKSHEET_CONTENTTYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+__SPREADSHEETML = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+
+__ATTRIBUTE = re.compile(r'([\w:]+)\s*=\s*"([^"]*)"')
+__SHEET = re.compile(r"<sheet\b([^>]*?)/?>")
+__RELATIONSHIP = re.compile(r"<Relationship\b([^>]*?)/?>")
+__ROW = re.compile(r"<row\b([^>]*?)(/?)>")
+__CELL = re.compile(r"<c\b([^>]*?)(?:/>|>.*?</c>)", re.DOTALL)
+__CELLREF = re.compile(r'\br="([A-Z]+)\d+"')
+__ROWNUMBER = re.compile(r'\br="(\d+)"')
+__STYLE = re.compile(r'\bs="(\d+)"')
+__FLUSHROWS = 1000  # 書き足すシートをこの行数毎にまとめてzipに書く
+
+
+def patchresultbook(bookpath: Path, marks: dict[str, dict[int, str]], sheetname: str, rows: Iterable[str]) -> None:
+    """結果のブックを、zipの中の書き換えるシートのXMLだけを直して書き直す。
+    marks: シート名毎に、行番号とRESULT_COLUMNの列に書く値
+    sheetname: テストケースの結果を1行1つ書き足すシートの名前
+    rows: 書き足すシートのA列に上から書く値
+    ブックのXMLがこの書き方で扱えない形ならValueErrorを送出する。その時はsaveresultbookを使う
+    """
+    temppath = bookpath.with_name(bookpath.name + ".tmp")
+    with zipfile.ZipFile(bookpath) as source:
+        patches: dict[str, str] = {}
+        try:
+            workbookxml = source.read("xl/workbook.xml").decode("utf-8")
+            relsxml = source.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+            contenttypesxml = source.read("[Content_Types].xml").decode("utf-8")
+            sheetparts = __sheetparts(workbookxml, relsxml)
+            for name, sheetmarks in marks.items():
+                if name not in sheetparts:
+                    raise ValueError(f"sheet not found: {name}")
+                part = sheetparts[name]
+                patches[part] = __patchsheet(source.read(part).decode("utf-8"), sheetmarks)
+        except KeyError as e:
+            # 部品の置き場所が違うなど、想定と違う形のブック
+            raise ValueError(f"unexpected workbook layout: {e}") from e
+
+        # 書き足すシートの場所と、ブックからの参照
+        names = set(source.namelist())
+        index = 1
+        while f"xl/worksheets/sheet{index}.xml" in names:
+            index += 1
+        newpart = f"xl/worksheets/sheet{index}.xml"
+        rids = {__attributes(m.group(1)).get("Id") for m in __RELATIONSHIP.finditer(relsxml)}
+        ridindex = 1
+        while f"rId{ridindex}" in rids:
+            ridindex += 1
+        rid = f"rId{ridindex}"
+        patches["xl/workbook.xml"] = __addsheet(workbookxml, sheetname, rid)
+        patches["xl/_rels/workbook.xml.rels"] = __insertbefore(
+            relsxml,
+            "</Relationships>",
+            f'<Relationship Type="{__WORKSHEET_TYPE}" Target="/{newpart}" Id="{rid}"/>',
+        )
+        patches["[Content_Types].xml"] = __insertbefore(
+            contenttypesxml, "</Types>", f'<Override PartName="/{newpart}" ContentType="{__WORKSHEET_CONTENTTYPE}"/>'
+        )
+
+        try:
+            with zipfile.ZipFile(temppath, mode="w", compression=zipfile.ZIP_DEFLATED) as target:
+                for info in source.infolist():
+                    data = patches[info.filename].encode("utf-8") if info.filename in patches else source.read(info)
+                    target.writestr(info, data, compress_type=info.compress_type)
+                # 結果のシートは行を作りながら書き、全体を文字列にしない
+                with target.open(newpart, mode="w") as f:
+                    f.write(f'<worksheet xmlns="{__SPREADSHEETML}"><sheetData>'.encode("utf-8"))
+                    buffer: list[str] = []
+                    for rownumber, value in enumerate(rows, start=1):
+                        buffer.append(f'<row r="{rownumber}"><c r="A{rownumber}" t="inlineStr"><is><t>{escape(value)}</t></is></c></row>')
+                        if len(buffer) >= __FLUSHROWS:
+                            f.write("".join(buffer).encode("utf-8"))
+                            buffer.clear()
+                    f.write(("".join(buffer) + "</sheetData></worksheet>").encode("utf-8"))
+        except BaseException:
+            temppath.unlink(missing_ok=True)
+            raise
+    os.replace(temppath, bookpath)
+
+
+def saveresultbook(bookpath: Path, marks: dict[str, dict[int, str]], sheetname: str, rows: Iterable[str]) -> None:
+    """patchresultbookと同じ内容を、openpyxlでブック全体を読み込んで書く"""
+    resultbook = None
+    try:
+        resultbook = load_workbook(bookpath)
+        for name, sheetmarks in marks.items():
+            resultsheet = resultbook[name]
+            for row, mark in sheetmarks.items():
+                resultsheet.cell(row=row, column=RESULT_COLUMN, value=mark)
+        newsheet = resultbook.create_sheet(sheetname)
+        for rownumber, value in enumerate(rows, start=1):
+            newsheet.cell(row=rownumber, column=1, value=value)
+        resultbook.save(bookpath)
+    finally:
+        if resultbook:
+            resultbook.close()
+
+
+def __attributes(text: str) -> dict[str, str]:
+    return {name: value for name, value in __ATTRIBUTE.findall(text)}
+
+
+def __sheetparts(workbookxml: str, relsxml: str) -> dict[str, str]:
+    """シート名毎のzipの中のパス"""
+    prefix = __namespaceprefix(workbookxml, __RELATIONSHIPS)
+    targets = {}
+    for m in __RELATIONSHIP.finditer(relsxml):
+        attributes = __attributes(m.group(1))
+        if attributes.get("Type") == __WORKSHEET_TYPE:
+            target = attributes["Target"]
+            targets[attributes["Id"]] = target[1:] if target.startswith("/") else "xl/" + target
+    parts = {}
+    for m in __SHEET.finditer(workbookxml):
+        attributes = __attributes(m.group(1))
+        rid = attributes.get(f"{prefix}:id")
+        if rid in targets:
+            parts[__unescape(attributes["name"])] = targets[rid]
+    return parts
+
+
+def __addsheet(workbookxml: str, sheetname: str, rid: str) -> str:
+    prefix = __namespaceprefix(workbookxml, __RELATIONSHIPS)
+    sheetids = [int(__attributes(m.group(1)).get("sheetId", "0")) for m in __SHEET.finditer(workbookxml)]
+    sheetid = max(sheetids, default=0) + 1
+    return __insertbefore(workbookxml, "</sheets>", f'<sheet name={quoteattr(sheetname)} sheetId="{sheetid}" {prefix}:id="{rid}"/>')
+
+
+def __namespaceprefix(xml: str, namespace: str) -> str:
+    m = re.search(r'xmlns:(\w+)="' + re.escape(namespace) + '"', xml)
+    if m is None:
+        raise ValueError(f"namespace not declared: {namespace}")
+    return m.group(1)
+
+
+def __insertbefore(xml: str, endtag: str, text: str) -> str:
+    position = xml.rfind(endtag)
+    if position < 0:
+        raise ValueError(f"{endtag} not found")
+    return xml[:position] + text + xml[position:]
+
+
+def __unescape(text: str) -> str:
+    return text.replace("&quot;", '"').replace("&apos;", "'").replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+
+def __columnnumber(letters: str) -> int:
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
+
+
+def __columnletters(number: int) -> str:
+    letters = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def __markcell(row: int, mark: str, style: str | None) -> str:
+    styleattr = f' s="{style}"' if style is not None else ""
+    return f'<c r="{__columnletters(RESULT_COLUMN)}{row}"{styleattr} t="inlineStr"><is><t>{escape(mark)}</t></is></c>'
+
+
+def __patchrow(content: str, row: int, mark: str) -> str:
+    """行の中のセルに、RESULT_COLUMNの列のセルを置き換えるか、列の順になる所に入れる"""
+    for m in __CELL.finditer(content):
+        ref = __CELLREF.search(m.group(1))
+        if ref is None:
+            raise ValueError(f"cell without reference in row {row}")
+        column = __columnnumber(ref.group(1))
+        if column == RESULT_COLUMN:
+            style = __STYLE.search(m.group(1))
+            return content[: m.start()] + __markcell(row, mark, style.group(1) if style is not None else None) + content[m.end() :]
+        if column > RESULT_COLUMN:
+            return content[: m.start()] + __markcell(row, mark, None) + content[m.start() :]
+    return content + __markcell(row, mark, None)
+
+
+def __patchsheet(sheetxml: str, marks: dict[int, str]) -> str:
+    """シートのXMLのうち、marksの行だけを書き換える。他の部分は読み飛ばすだけで解釈しない"""
+    if "<sheetData/>" in sheetxml:
+        sheetxml = sheetxml.replace("<sheetData/>", "<sheetData></sheetData>", 1)
+    datastart = sheetxml.find("<sheetData>")
+    dataend = sheetxml.find("</sheetData>")
+    if datastart < 0 or dataend < 0:
+        raise ValueError("sheetData not found")
+    targets = sorted(marks)
+    pieces: list[str] = []
+    position = 0
+    t = 0
+    for m in __ROW.finditer(sheetxml, datastart, dataend):
+        if t >= len(targets):
+            break
+        rownumber = __ROWNUMBER.search(m.group(1))
+        if rownumber is None:
+            raise ValueError("row without number")
+        row = int(rownumber.group(1))
+        # 無い行は、番号の順になる所に作る
+        while t < len(targets) and targets[t] < row:
+            pieces.append(sheetxml[position : m.start()])
+            pieces.append(f'<row r="{targets[t]}">{__markcell(targets[t], marks[targets[t]], None)}</row>')
+            position = m.start()
+            t += 1
+        if t < len(targets) and targets[t] == row:
+            if m.group(2) == "/":
+                content = ""
+                rowend = m.end()
+            else:
+                closing = sheetxml.find("</row>", m.end())
+                if closing < 0:
+                    raise ValueError(f"row {row} not closed")
+                content = sheetxml[m.end() : closing]
+                rowend = closing + len("</row>")
+            # spansは省略できる。列を足すと合わなくなるので外す
+            rowattributes = re.sub(r'\s+spans="[^"]*"', "", m.group(1))
+            pieces.append(sheetxml[position : m.start()])
+            pieces.append(f"<row{rowattributes}>{__patchrow(content, row, marks[row])}</row>")
+            position = rowend
+            t += 1
+    pieces.append(sheetxml[position:dataend])
+    for row in targets[t:]:
+        pieces.append(f'<row r="{row}">{__markcell(row, marks[row], None)}</row>')
+    pieces.append(sheetxml[dataend:])
+    return __widendimension("".join(pieces), targets[-1] if len(targets) > 0 else 0)
+
+
+def __widendimension(sheetxml: str, maxrow: int) -> str:
+    """使っている範囲（dimension）に、書いた結果の列と行を含める"""
+    m = re.search(r'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"', sheetxml)
+    if m is None:
+        return sheetxml
+    firstcolumn = min(__columnnumber(m.group(1)), RESULT_COLUMN)
+    firstrow = int(m.group(2))
+    lastcolumn = max(__columnnumber(m.group(3) or m.group(1)), RESULT_COLUMN)
+    lastrow = max(int(m.group(4) or m.group(2)), maxrow)
+    ref = f"{__columnletters(firstcolumn)}{firstrow}:{__columnletters(lastcolumn)}{lastrow}"
+    return sheetxml[: m.start()] + f'<dimension ref="{ref}"' + sheetxml[m.end() :]
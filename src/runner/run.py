@@ -1,41 +1,61 @@
 from pathlib import Path
+from typing import Iterable
 import shutil
 import json
 import time
+import zipfile
 from datetime import datetime
-from openpyxl import load_workbook
-from openpyxl.workbook.workbook import Workbook
-from openpyxl.worksheet.worksheet import Worksheet
-import pywintypes
 from natsort import natsort_keygen
+from util.resultcache import ResultCache
+from util.resulthistory import ResultHistory
+from util.snapshot import SnapshotStore, suiteworkbooks
 from util.types import TestSuite, TestModule, TestCase, TestResult
+from vbaunit_lib.backend import ExcelBackend, XlwingsBackend
+from vbaunit_lib.session import ExcelSessionPool, PoolStats
+from vbaunit_lib.comregistry import formatleaks
+from vbaunit_lib.comretry import ComRetryPolicy, RetryingBackend, RetryStats
+from vbaunit_lib.testlib import setglobalsessionpool, setglobalreusebook, setglobalbackend, getglobalbackend, takecomleaks, takemacrocalls
+from runner.eventlog import EVENT_COM_RETRY, EVENT_SUITE_END, EVENT_SUITE_START, EVENT_TEST_END, EVENT_TEST_START, EventLog
+from runner.eventlog import readevents, writetestlog
+from runner.parallel import ShardOutcome, shard_testsuite, run_parallel
+from runner.reaper import ExcelReaper, ReapStats
+from runner.resultbook import patchresultbook, saveresultbook
+from runner.scheduler import TestScheduler
+from runner.watchdog import TestTimeout, TestWatchdog
+from runner.workerpool import PrewarmedWorkerPool
 
 
 def __gettimestampstr(dtnow: datetime) -> str:
     return dtnow.isoformat(sep=" ", timespec="milliseconds")
 
 
-def __writestartlog(testcase: TestCase, f) -> None:
-    config: dict[str, str] = {
-        "testid": testcase.testid,
-        "group": testcase.group,
-        "module": testcase.module.modulepath.name,
-        "function": testcase.testfunction,
-        "at": str(testcase.start_line),
-        "start": __gettimestampstr(datetime.now()),
-    }
-    f.write(json.dumps(config) + "\n")
-    print("Running test case:")
-    print(json.dumps(config))
+def __writestartlog(testcase: TestCase, events: EventLog, startat: str | None = None, worker: int | None = None) -> None:
+    events.emit(
+        EVENT_TEST_START,
+        testid=testcase.testid,
+        group=testcase.group,
+        module=testcase.module.modulepath.name,
+        function=testcase.testfunction,
+        at=testcase.start_line,
+        start=startat if startat is not None else __gettimestampstr(datetime.now()),
+        worker=worker,
+    )
 
 
-def __writeendlog(result: TestResult, f, elapsed: float) -> None:
-    outcome: dict[str, str] = {"outcome": str(result.succeeded), "runned": result.runned_at, "elapsed": f"{elapsed:.3f}"}
-    f.write(json.dumps(outcome) + "\n")
-    print(json.dumps(outcome))
+def __writeendlog(result: TestResult, events: EventLog, elapsed: float) -> None:
+    events.emit(
+        EVENT_TEST_END,
+        testid=result.testid,
+        function=result.testfunction,
+        succeeded=result.succeeded,
+        runned=result.runned_at,
+        elapsed=elapsed,
+        timedout=result.timedout,
+        cached=result.cached,
+    )
 
 
-def __createresult(testcase: TestCase, succeeded: bool) -> TestResult:
+def __createresult(testcase: TestCase, succeeded: bool, timedout: bool = False) -> TestResult:
     result = TestResult(
         testid=testcase.testid,
         group=testcase.group,
@@ -44,15 +64,18 @@ def __createresult(testcase: TestCase, succeeded: bool) -> TestResult:
         start_line=testcase.start_line,
         succeeded=succeeded,
         runned_at=__gettimestampstr(datetime.now()),
+        timedout=timedout,
     )
     return result
 
 
-def __runtestcase(testcase: TestCase, f) -> TestResult:
+def __runtestcase(testcase: TestCase, isolation: str, failonleak: bool, timeout: float) -> TestResult:
     succeeded = True
 
     try:
-        testcase.module.load_module()
+        # モジュールは最初のテストケースで読み込み、同じモジュールのテストケースの間は使い回す
+        if testcase.module.testmodule is None:
+            testcase.module.load_module()
         realmodule = testcase.module.testmodule
 
         # 関数を取得
@@ -62,14 +85,34 @@ def __runtestcase(testcase: TestCase, f) -> TestResult:
         func = getattr(realmodule, testcase.testfunction)
 
         # 実行 -> 失敗時はAssertionErrorが出る想定
-        func()
+        takecomleaks()  # 前のテストケースの分は捨てる
+        takemacrocalls()
+        setglobalreusebook(testcase.module.reusebook)
+        # @timeoutが付いていればそちらを優先する
+        watchdog = TestWatchdog(float(getattr(func, "_timeout", timeout)))
+        try:
+            with watchdog:
+                func()
+        except (Exception, KeyboardInterrupt) as e:
+            if watchdog.fired:
+                raise TestTimeout(f"{testcase.testfunction} did not finish in {watchdog.timeout} s") from e
+            raise
+        if watchdog.fired:
+            raise TestTimeout(f"{testcase.testfunction} did not finish in {watchdog.timeout} s")
+        leaks = takecomleaks()
+        if failonleak and len(leaks) > 0:
+            raise AssertionError(formatleaks(leaks))
     except AssertionError as ae:
         succeeded = False
         raise ae
     finally:
-        testcase.module.unload_module()
+        setglobalreusebook(False)
+        if isolation == "test" or testcase.module.isolation == "test":
+            testcase.module.unload_module()
 
-    return __createresult(testcase=testcase, succeeded=succeeded)
+    result = __createresult(testcase=testcase, succeeded=succeeded)
+    result.calledmacros = takemacrocalls()
+    return result
 
 
 def __setmoduleresults(
@@ -90,53 +133,82 @@ def __setmoduleresults(
         modulesummary_failure[modulename] += 1
 
 
+def switch_module(previous: TestModule | None, testcase: TestCase | None) -> TestModule | None:
+    """次に実行するテストケースのモジュールが変わるなら、前のモジュールを解放する。戻り値は次のモジュール"""
+    nextmodule = testcase.module if testcase is not None else None
+    if previous is not None and previous is not nextmodule:
+        previous.unload_module()
+    return nextmodule
+
+
+def execute_testcase(
+    testcase: TestCase,
+    comerrors: tuple[type[BaseException], ...],
+    isolation: str = "module",
+    failonleak: bool = False,
+    timeout: float = 0.0,
+) -> tuple[TestResult, float]:
+    """テストケースを1つ実行する。戻り値は結果と所要時間（秒）
+    COMエラーのやり直しはRetryingBackendがCOM呼び出し毎に行うので、ここまで来たCOMエラーは失敗とする
+    isolation: moduleならモジュールを読み込んだまま次のテストケースに使う。testならテストケース毎に読み直す
+    failonleak: Trueなら解放されないまま残ったCOMオブジェクトがあるテストケースを失敗にする
+    timeout: テストケースの制限時間（秒）。0なら無制限。超えたらExcelを落として、時間切れの失敗とする
+    """
+    starttime = time.time()
+
+    try:
+        result = __runtestcase(testcase=testcase, isolation=isolation, failonleak=failonleak, timeout=timeout)
+    except TestTimeout as te:
+        print(f"Timeout: {te}")
+        result = __createresult(testcase=testcase, succeeded=False, timedout=True)
+    except comerrors as ce:
+        print(type(ce))
+        print(f"COM error: {ce}")
+        result = __createresult(testcase=testcase, succeeded=False)
+    except AssertionError as e:
+        print(f"AssertionError: {e}")
+        result = __createresult(testcase=testcase, succeeded=False)
+    except Exception as e:
+        print(type(e))
+        print(f"Runtime error: {e}")
+        result = __createresult(testcase=testcase, succeeded=False)
+
+    return result, time.time() - starttime
+
+
 def __runtestsuite(
-    suite: TestSuite,
+    testcases: Iterable[TestCase],
     results: list[TestResult],
     modulelist: list[TestModule],
-    fout,
+    events: EventLog,
     modulesummary_success: dict[str, int],
     modulesummary_failure: dict[str, int],
-) -> TestResult:
-    for testcase in suite:
-        __writestartlog(testcase=testcase, f=fout)
-        starttime = time.time()
-
-        result = None
-        comerror_retrycount = 0
-        while comerror_retrycount < 3:
-            try:
-                result = __runtestcase(testcase=testcase, f=fout)
-                break
-            except pywintypes.com_error as ce:
-                print(type(ce))
-                print(f"COM error: {ce}")
-                if str(ce).find("-2147352567, '例外が発生しました。'") >= 0:
-                    result = __createresult(testcase=testcase, succeeded=False)
-                    break
-                comerror_retrycount += 1
-                if comerror_retrycount <= 2:
-                    print(f"Retrying... ({comerror_retrycount} / 2)")
-                    time.sleep(1)  # Wait for a second before retrying
-                    starttime = time.time()
-                else:
-                    result = __createresult(testcase=testcase, succeeded=False)
-            except AssertionError as e:
-                print(f"AssertionError: {e}")
-                result = __createresult(testcase=testcase, succeeded=False)
-                break
-            except Exception as e:
-                print(type(e))
-                print(f"Runtime error: {e}")
-                result = __createresult(testcase=testcase, succeeded=False)
-                break
-
-        if result is None:
-            result = __createresult(testcase=testcase, succeeded=False)
-
-        elapsed = time.time() - starttime
-        __writeendlog(result=result, f=fout, elapsed=elapsed)
-        fout.flush()
+    comerrors: tuple[type[BaseException], ...],
+    isolation: str,
+    failonleak: bool,
+    timeout: float,
+    workerpool: PrewarmedWorkerPool | None = None,
+) -> None:
+    currentmodule = None
+    for testcase in testcases:
+        if workerpool is None:
+            currentmodule = switch_module(currentmodule, testcase)
+            __writestartlog(testcase=testcase, events=events)
+            result, elapsed = execute_testcase(
+                testcase=testcase, comerrors=comerrors, isolation=isolation, failonleak=failonleak, timeout=timeout
+            )
+        else:
+            if currentmodule is not None and currentmodule is not testcase.module:
+                workerpool.recycle()  # モジュール毎に新しいワーカーで実行する
+            currentmodule = testcase.module
+            __writestartlog(testcase=testcase, events=events, worker=workerpool.activeworker)
+            outcome = workerpool.execute(testcase)
+            result = __createresult(testcase=testcase, succeeded=outcome.succeeded, timedout=outcome.timedout)
+            result.runned_at = outcome.runned_at
+            result.calledmacros = outcome.calledmacros
+            elapsed = outcome.elapsed
+
+        __writeendlog(result=result, events=events, elapsed=elapsed)
 
         results.append(result)
         __setmoduleresults(
@@ -146,24 +218,66 @@ def __runtestsuite(
             modulesummary_success=modulesummary_success,
             modulesummary_failure=modulesummary_failure,
         )
+    if workerpool is None:
+        switch_module(currentmodule, None)
 
 
-def __writemoduleresults(
-    resultbook: Workbook, modulelist: list[TestModule], modulesummary_success: dict[str, int], modulesummary_failure: dict[str, int]
-) -> None:
+def __reportcached(
+    testcases: Iterable[TestCase],
+    resultcache: ResultCache,
+    bridge: Path,
+    cachekeys: dict[tuple[str, str], str],
+    results: list[TestResult],
+    modulelist: list[TestModule],
+    events: EventLog,
+    modulesummary_success: dict[str, int],
+    modulesummary_failure: dict[str, int],
+) -> list[TestCase]:
+    """入力が前に成功した時と同じテストケースを、実行せずに成功として記録する。
+    戻り値は実行しなければならないテストケース。そのキーはcachekeysに入れる
+    """
+    toexecute: list[TestCase] = []
+    for testcase in testcases:
+        key = resultcache.key(testcase, bridge)
+        if key is None or not resultcache.passed(key):
+            if key is not None:
+                cachekeys[(testcase.testid, testcase.testfunction)] = key
+            toexecute.append(testcase)
+            continue
+        __writestartlog(testcase=testcase, events=events)
+        result = __createresult(testcase=testcase, succeeded=True)
+        result.cached = True
+        __writeendlog(result=result, events=events, elapsed=0.0)
+        results.append(result)
+        __setmoduleresults(
+            testcase=testcase,
+            result=result,
+            modulelist=modulelist,
+            modulesummary_success=modulesummary_success,
+            modulesummary_failure=modulesummary_failure,
+        )
+    return toexecute
+
+
+def __moduleresultmarks(
+    modulelist: list[TestModule], modulesummary_success: dict[str, int], modulesummary_failure: dict[str, int]
+) -> dict[str, dict[int, str]]:
+    """シート毎に、モジュールの行と○△×"""
+    marks: dict[str, dict[int, str]] = {}
     for module in modulelist:
         modulename = module.modulepath.name
-        resultsheet = resultbook[module.group]
         if modulesummary_success[modulename] >= 0 and modulesummary_failure[modulename] == 0:
-            resultsheet.cell(row=module.line, column=6, value="○")
+            mark = "○"
         elif modulesummary_success[modulename] > 0 and modulesummary_failure[modulename] > 0:
-            resultsheet.cell(row=module.line, column=6, value="△")
+            mark = "△"
         else:
-            resultsheet.cell(row=module.line, column=6, value="×")
+            mark = "×"
+        marks.setdefault(module.group, {})[module.line] = mark
+    return marks
 
 
-def __writeresults(resultsheet: Worksheet, results: list[TestResult]) -> None:
-    max_row = 1
+def __resultrows(results: list[TestResult]) -> list[str]:
+    rows = []
     rkey = natsort_keygen()
     for result in sorted(results, key=lambda r: (rkey(r.testid), r.testfunction)):
         resultdump = {
@@ -174,22 +288,61 @@ def __writeresults(resultsheet: Worksheet, results: list[TestResult]) -> None:
             "succeeded": result.succeeded,
             "runned_at": result.runned_at,
         }
-        resultsheet.cell(row=max_row, column=1, value=json.dumps(resultdump))
-        max_row += 1
+        if result.timedout:
+            resultdump["timedout"] = True
+        if result.cached:
+            resultdump["cached"] = True
+        rows.append(json.dumps(resultdump))
+    return rows
 
 
-def run_testsuite(suite: TestSuite, scenario: Path, bridge: Path, out: Path) -> None:
+def run_testsuite(
+    suite: TestSuite,
+    scenario: Path,
+    bridge: Path,
+    out: Path,
+    backend: ExcelBackend | None = None,
+    jobs: int = 1,
+    shard: str = "module",
+    notes: list[str] | None = None,
+    isolation: str = "module",
+    workermaxjobs: int = 0,
+    workermaxmemory: int = 0,
+    failonleak: bool = False,
+    timeout: float = 0.0,
+    pidmanifest: Path | None = None,
+    scheduler: TestScheduler | None = None,
+    resulthistory: ResultHistory | None = None,
+    resultcache: ResultCache | None = None,
+    snapshots: SnapshotStore | None = None,
+    logflush: float = 1.0,
+) -> None:
+    """テストスイートを実行して、テストログと結果のブックを出力する。
+    jobs: 2以上なら、shardの単位（moduleかgroup）でテストケースを分けてワーカープロセスで並列に実行する
+    notes: テストログの冒頭に書き足す行
+    isolation: moduleならモジュールを1回だけ読み込んで全てのテストケースを実行する。testならテストケース毎に読み直す。
+        processならモジュール毎に読み込み済みの新しいワーカープロセスで実行する。jobsが2以上なら並列実行のワーカーもモジュール毎に起動し直す
+    workermaxjobs: processの時、1つのワーカーで実行するテストケースの上限。0なら無制限
+    workermaxmemory: processの時、ワーカーを入れ替えるメモリ使用量（MB）。0なら無制限
+    failonleak: Trueなら解放されないまま残ったCOMオブジェクトがあるテストケースを失敗にする。Falseなら警告だけ
+    timeout: テストケースの既定の制限時間（秒）。0なら無制限。@timeoutを付けたテストケースはそちらを使う
+    pidmanifest: 起動したExcelのプロセスIDを記録するファイル。指定すると、前の実行が残したExcelを最初に落とし、
+        この実行で残ったExcelを最後に落とす。Noneなら記録しない
+    scheduler: テストケースを実行する順に並べ、並列実行では重さで分ける。Noneならシナリオの順
+    resulthistory: テストケース毎の結果を記録する。次に前回失敗したものだけを実行する時に使う
+    resultcache: 指定すると、入力が前に成功した時と同じテストケースはExcelを起動せずに成功とする
+    snapshots: 指定すると、テストケースが開くブックのVBAのコードを、前の実行が残したExcelを落とした後に保存する
+    logflush: イベント（events.jsonl）をファイルにflushする間隔（秒）。テストログは最後にイベントから作る
+    """
     outputpath = out.joinpath(scenario.name)
     testlogpath = out.joinpath("testlog.txt")
+    eventspath = out.joinpath("events.jsonl")
+    if backend is None:
+        backend = XlwingsBackend()
+    # 実行毎のID。コードの保存もイベントもこのIDで刻む
+    runid = f"{datetime.now():%Y%m%d%H%M%S%f}"
 
-    with open(testlogpath, mode="w", encoding="utf-8") as fout:
-        fout.write(f"Test log for {suite.name}\n")
-        fout.write(f"Subject: {suite.subject}\n")
-        fout.write(f"Scenario: {scenario}\n")
-        fout.write(f"Output: {out}\n")
-        fout.write(f"Bridge: {bridge}\n")
-        fout.write(f"Started at: {__gettimestampstr(datetime.now())}\n")
-        fout.write("\n")
+    startedat = __gettimestampstr(datetime.now())
     print(f"Running test suite for scenario: {suite.name}")
     print(f"{suite.subject}")
     print(f"{scenario}")
@@ -203,49 +356,183 @@ def run_testsuite(suite: TestSuite, scenario: Path, bridge: Path, out: Path) ->
     modulelist = list[TestModule]()
     modulesummary_success: dict[str, int] = {}
     modulesummary_failure: dict[str, int] = {}
-    with open(testlogpath, mode="a", encoding="utf-8") as fout:
-        startat = datetime.now()
-        fout.write(f"\nStart at: {__gettimestampstr(startat)}\n")
-        __runtestsuite(
-            suite=suite,
-            results=results,
-            modulelist=modulelist,
-            fout=fout,
-            modulesummary_success=modulesummary_success,
-            modulesummary_failure=modulesummary_failure,
+    # テストログはイベントから作る。書き込みはテストケースの実行を待たせない
+    events = EventLog(eventspath, runid, flushinterval=logflush)
+
+    def onretry(outcome: str, errorclass: str, hresult: int | None, attempt: int, delay: float) -> None:
+        events.emit(EVENT_COM_RETRY, outcome=outcome, errorclass=errorclass, hresult=hresult, attempt=attempt, delay=delay)
+
+    # テストケースをまたいでExcelを使い回す
+    # COMの呼び出しは1回毎にHRESULTで分けてやり直す
+    retryingbackend = RetryingBackend(backend, ComRetryPolicy(backend.comerrors(), onretry=onretry))
+    # 前の実行が落ちて残したExcelを片付けてから始める
+    reaper = ExcelReaper(pidmanifest, retryingbackend) if pidmanifest is not None else None
+    reapedatstart = reaper.reapstale() if reaper is not None else ReapStats(reaped=0, memory=0)
+    # テストケースがブックを書き換える前に保存する。読むために起動したExcelは片付けの後に記録させる
+    snapshotstats = snapshots.snapshot(runid, suiteworkbooks(suite)) if snapshots is not None else None
+    manifest = (str(pidmanifest), reaper.owner, reaper.ownercreated) if reaper is not None else None
+    previousbackend = getglobalbackend()
+    setglobalbackend(retryingbackend)
+    pool = ExcelSessionPool(backend=retryingbackend, bridgepath=bridge, onlaunch=reaper.record if reaper is not None else None)
+    setglobalsessionpool(pool)
+    # ワーカーの中ではモジュールを1回だけ読み込む
+    innerisolation = "module" if isolation == "process" else isolation
+    workerpool = None
+    if isolation == "process":
+        workerpool = PrewarmedWorkerPool(
+            bridge, backend.name, maxjobs=workermaxjobs, maxmemory=workermaxmemory, isolation=innerisolation,
+            failonleak=failonleak,
+            timeout=timeout,
+            manifest=manifest,
+        )
+    try:
+        events.emit(
+            EVENT_SUITE_START,
+            suite=suite.name,
+            subject=suite.subject,
+            scenario=str(scenario),
+            output=str(out),
+            bridge=str(bridge),
+            backend=backend.name,
+            jobs=jobs,
+            isolation=isolation,
+            leakcheck="fail" if failonleak else "warn",
+            timeout=timeout,
+            schedule=scheduler.logline if scheduler is not None else None,
+            resultcache=resultcache is not None,
+            snapshot=snapshotstats._asdict() if snapshotstats is not None else None,
+            notes=notes or [],
+            started=startedat,
         )
-        endat = datetime.now()
-        fout.write(f"\nFinished at: {__gettimestampstr(endat)}\n")
+        workerstats = None
+        workerretries = None
+        cachekeys: dict[tuple[str, str], str] = {}
+        try:
+            serialtests: list[TestCase] = scheduler.schedule(suite) if scheduler is not None else list(suite)
+            if resultcache is not None:
+                serialtests = __reportcached(
+                    testcases=serialtests,
+                    resultcache=resultcache,
+                    bridge=bridge,
+                    cachekeys=cachekeys,
+                    results=results,
+                    modulelist=modulelist,
+                    events=events,
+                    modulesummary_success=modulesummary_success,
+                    modulesummary_failure=modulesummary_failure,
+                )
+            if jobs > 1:
+                shards, serialtests = shard_testsuite(
+                    suite=serialtests, jobs=jobs, unit=shard, cost=scheduler.cost if scheduler is not None else None
+                )
+                print(f"{len(shards)} workers run {sum(len(s) for s in shards)} tests, then {len(serialtests)} tests run serially.")
+
+                def onresult(testcase: TestCase, outcome: ShardOutcome) -> None:
+                    result = __createresult(testcase=testcase, succeeded=outcome.succeeded, timedout=outcome.timedout)
+                    result.runned_at = outcome.runned_at
+                    result.calledmacros = outcome.calledmacros
+                    __writestartlog(testcase=testcase, events=events, startat=outcome.startat, worker=outcome.worker)
+                    __writeendlog(result=result, events=events, elapsed=outcome.elapsed)
+                    results.append(result)
+                    __setmoduleresults(
+                        testcase=testcase,
+                        result=result,
+                        modulelist=modulelist,
+                        modulesummary_success=modulesummary_success,
+                        modulesummary_failure=modulesummary_failure,
+                    )
+
+                workerstats, workerretries = run_parallel(
+                    shards=shards,
+                    bridge=bridge,
+                    backendname=backend.name,
+                    onresult=onresult,
+                    isolation=isolation,
+                    failonleak=failonleak,
+                    timeout=timeout,
+                    manifest=manifest,
+                )
+
+            # 並列実行できないものは最後に直列で実行する
+            __runtestsuite(
+                testcases=serialtests,
+                results=results,
+                modulelist=modulelist,
+                events=events,
+                modulesummary_success=modulesummary_success,
+                modulesummary_failure=modulesummary_failure,
+                comerrors=retryingbackend.comerrors(),
+                isolation=isolation,
+                failonleak=failonleak,
+                timeout=timeout,
+                workerpool=workerpool,
+            )
+        finally:
+            if workerpool is not None:
+                workerpool.shutdown()
+            setglobalsessionpool(None)
+            pool.shutdown()
+            setglobalbackend(previousbackend)
+        leakedatend = reaper.reapown() if reaper is not None else ReapStats(reaped=0, memory=0)
+        stats = pool.stats
+        if workerstats is not None:
+            stats = PoolStats(*[a + b for a, b in zip(stats, workerstats)])
+        wstats = None
+        if workerpool is not None:
+            stats = PoolStats(*[a + b for a, b in zip(stats, workerpool.excelstats)])
+            wstats = workerpool.stats
+        retries = retryingbackend.policy.stats
+        for other in (workerretries, workerpool.retrystats if workerpool is not None else None):
+            if other is not None:
+                retries = RetryStats(*[a + b for a, b in zip(retries, other)])
 
         testcount_pass = 0
         testcount_fail = 0
+        testcount_timeout = 0
+        testcount_cached = 0
         for result in results:
             if result.succeeded:
                 testcount_pass += 1
             else:
                 testcount_fail += 1
-        fout.write(f"---------- {testcount_fail} failed, {testcount_pass} passed, in {endat - startat} ----------\n")
+            if result.timedout:
+                testcount_timeout += 1
+            if result.cached:
+                testcount_cached += 1
+        events.emit(
+            EVENT_SUITE_END,
+            workers=wstats._asdict() if wstats is not None else None,
+            excel=stats._asdict(),
+            retries=retries._asdict(),
+            reaper={"atstart": reapedatstart._asdict(), "atend": leakedatend._asdict()} if reaper is not None else None,
+            components=resultcache.exported if resultcache is not None else None,
+            failed=testcount_fail,
+            timedout=testcount_timeout,
+            passed=testcount_pass,
+            cached=testcount_cached if resultcache is not None else None,
+            executed=len(results) - testcount_cached,
+        )
+    finally:
+        events.close()
+        writetestlog(readevents(eventspath), testlogpath)
 
     # 結果の書込
 
-    resultbook = None
-    try:
-        resultbook = load_workbook(outputpath)
-
-        # モジュールの結果
-        __writemoduleresults(
-            resultbook=resultbook,
-            modulelist=modulelist,
-            modulesummary_success=modulesummary_success,
-            modulesummary_failure=modulesummary_failure,
-        )
-
-        # テストケースの結果
-        newsheetname = f"Results_{datetime.now():%Y%m%d_%H%M%S}"
-        newsheet = resultbook.create_sheet(newsheetname)
-        __writeresults(resultsheet=newsheet, results=results)
+    if resulthistory is not None:
+        resulthistory.record(scenario, results)
+    if resultcache is not None:
+        # 実行したものだけがcachekeysに入っている
+        resultcache.record([(cachekeys[(r.testid, r.testfunction)], r) for r in results if (r.testid, r.testfunction) in cachekeys])
 
-        resultbook.save(outputpath)
-    finally:
-        if resultbook:
-            resultbook.close()
+    # モジュールの結果と、テストケースの結果のシート
+    marks = __moduleresultmarks(
+        modulelist=modulelist, modulesummary_success=modulesummary_success, modulesummary_failure=modulesummary_failure
+    )
+    newsheetname = f"Results_{datetime.now():%Y%m%d_%H%M%S}"
+    rows = __resultrows(results)
+    try:
+        # 書き換えるシートのXMLだけを直す。ブック全体を読み込んで書き直すより速い
+        patchresultbook(outputpath, marks=marks, sheetname=newsheetname, rows=rows)
+    except (ValueError, zipfile.BadZipFile) as e:
+        print(f"[WARN]could not patch result book {outputpath}, save it with openpyxl: {e}")
+        saveresultbook(outputpath, marks=marks, sheetname=newsheetname, rows=rows)
@@ -0,0 +1,130 @@
+import json
+from collections import namedtuple
+from pathlib import Path
+from typing import Iterable
+from util.discovery import discover_workbooks
+from util.types import TestCase, TestSuite
+
+
+TestHistory = namedtuple("TestHistory", ["elapsed", "failed"])
+
+SCHEDULE_SCENARIO = "scenario"  # シナリオの順
+SCHEDULE_WORKBOOK = "workbook"  # 同じブックを開くものを続けて、Excelとブックを使い回す
+SCHEDULE_FAILEDFIRST = "failedfirst"  # 前回失敗したものを先に
+SCHEDULE_LONGEST = "longest"  # 時間の掛かるものを先に。並列実行の偏りを減らす
+SCHEDULES = (SCHEDULE_SCENARIO, SCHEDULE_WORKBOOK, SCHEDULE_FAILEDFIRST, SCHEDULE_LONGEST)
+
+
+def historykey(testid: str, testfunction: str) -> str:
+    return testfunction + "@" + testid
+
+
+def readhistory(testlogpath: Path) -> dict[str, TestHistory]:
+    """前回のテストログから、テストケース毎の実行時間と成否を読む。
+    テストログは開始の行と結果の行が続けて書かれている。
+    キャッシュで成功にしたテストケースは実行していないので、その時間は履歴にしない
+    """
+    history: dict[str, TestHistory] = {}
+    if not testlogpath.exists():
+        return history
+    key = None
+    try:
+        with open(testlogpath, mode="r", encoding="utf-8") as f:
+            for line in f:
+                if not line.startswith("{"):
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    key = None
+                    continue
+                if "testid" in entry and "function" in entry:
+                    key = historykey(entry["testid"], entry["function"])
+                elif "outcome" in entry and key is not None:
+                    if entry.get("cached"):
+                        key = None
+                        continue
+                    history[key] = TestHistory(elapsed=float(entry.get("elapsed", 0.0)), failed=entry["outcome"] != "True")
+                    key = None
+    except (OSError, ValueError) as e:
+        print(f"[WARN]could not read test history {testlogpath}: {e}")
+    return history
+
+
+class TestScheduler:
+    """テストスイートのテストケースを実行する順に並べ替える。
+    同じモジュールのテストケースは続けて実行するので、並べ替えはモジュール単位で行い、モジュールの中でも並べ替える。
+    同じ履歴なら必ず同じ順になるように、決まらない所はシナリオの順にする
+    """
+
+    def __init__(self, strategy: str = SCHEDULE_SCENARIO, history: dict[str, TestHistory] | None = None) -> None:
+        """strategy: 並べ方。SCHEDULESのどれか
+        history: readhistoryで読んだ前回の結果。無ければ履歴の要らない並べ方しかできない
+        """
+        if strategy not in SCHEDULES:
+            raise ValueError(f"unknown schedule: {strategy}")
+        self.__strategy = strategy
+        self.__history = history or {}
+        self.__workbooks: dict[Path, dict[str, str]] = {}
+        known = [entry.elapsed for entry in self.__history.values()]
+        # 履歴の無いテストケースは、履歴のあるものの平均くらい掛かるとみなす
+        self.__defaultcost = sum(known) / len(known) if len(known) > 0 else 1.0
+
+    @property
+    def strategy(self) -> str:
+        return self.__strategy
+
+    @property
+    def logline(self) -> str:
+        return f"Schedule: {self.__strategy} ({len(self.__history)} tests in history)"
+
+    def cost(self, testcase: TestCase) -> float:
+        """テストケースの実行に掛かりそうな時間（秒）"""
+        entry = self.__history.get(historykey(testcase.testid, testcase.testfunction))
+        return entry.elapsed if entry is not None else self.__defaultcost
+
+    def failed(self, testcase: TestCase) -> bool:
+        """前回失敗したかどうか"""
+        entry = self.__history.get(historykey(testcase.testid, testcase.testfunction))
+        return entry is not None and entry.failed
+
+    def workbook(self, testcase: TestCase) -> str:
+        """テストケースがrunappで開くブックの名前。ソースから決められなければ空文字列"""
+        modulepath = testcase.module.modulepath
+        if modulepath not in self.__workbooks:
+            self.__workbooks[modulepath] = self.__firstworkbooks(modulepath)
+        workbooks = self.__workbooks[modulepath]
+        return workbooks.get(testcase.testfunction, workbooks.get("", ""))
+
+    def schedule(self, suite: TestSuite | Iterable[TestCase]) -> list[TestCase]:
+        """テストケースを実行する順に並べて返す"""
+        units: dict[tuple[str, Path], list[TestCase]] = {}
+        for testcase in suite:
+            units.setdefault((testcase.testid, testcase.module.modulepath), []).append(testcase)
+        unitlist = list(units.values())
+        if self.__strategy == SCHEDULE_SCENARIO:
+            return [testcase for unit in unitlist for testcase in unit]
+
+        # sortedは安定なので、同じ重みならシナリオの順のまま
+        if self.__strategy == SCHEDULE_WORKBOOK:
+            firstseen: dict[str, int] = {}
+            for unit in unitlist:
+                for testcase in unit:
+                    firstseen.setdefault(self.workbook(testcase), len(firstseen))
+            unitlist = [sorted(unit, key=lambda tc: firstseen[self.workbook(tc)]) for unit in unitlist]
+            unitlist = sorted(unitlist, key=lambda unit: firstseen[self.workbook(unit[0])])
+        elif self.__strategy == SCHEDULE_FAILEDFIRST:
+            unitlist = [sorted(unit, key=lambda tc: not self.failed(tc)) for unit in unitlist]
+            unitlist = sorted(unitlist, key=lambda unit: not self.failed(unit[0]))
+        elif self.__strategy == SCHEDULE_LONGEST:
+            unitlist = sorted(unitlist, key=lambda unit: -sum(self.cost(tc) for tc in unit))
+        return [testcase for unit in unitlist for testcase in unit]
+
+    def __firstworkbooks(self, modulepath: Path) -> dict[str, str]:
+        """test_で始まる関数毎に、最初に開くブックの名前。""はモジュール全体で最初のもの"""
+        workbooks: dict[str, str] = {}
+        for function, paths in (discover_workbooks(modulepath) or {}).items():
+            if function != "":
+                workbooks[function] = Path(paths[0]).name.lower()
+                workbooks.setdefault("", workbooks[function])
+        return workbooks
@@ -0,0 +1,56 @@
+import _thread
+import threading
+from vbaunit_lib.testlib import getactivetestlib
+
+
+class TestTimeout(Exception):
+    """テストケースが制限時間内に終わらなかった"""
+
+
+class TestWatchdog:
+    """テストケース1つの実行時間を見張る。
+    時間切れになったら実行中のExcelのプロセスを落として、止まっているCOM呼び出しを戻らせる。
+    それでも戻らなければ（Pythonの中で止まっている時など）メインスレッドに割り込む
+    """
+
+    def __init__(self, timeout: float, grace: float = 5.0) -> None:
+        """timeout: 制限時間（秒）。0以下なら見張らない
+        grace: Excelを落としてから、メインスレッドに割り込むまでに待つ時間（秒）
+        """
+        self.__timeout = timeout
+        self.__grace = grace
+        self.__finished = threading.Event()
+        self.__thread: threading.Thread | None = None
+        self.__fired = False
+
+    @property
+    def timeout(self) -> float:
+        return self.__timeout
+
+    @property
+    def fired(self) -> bool:
+        """時間切れになったかどうか"""
+        return self.__fired
+
+    def __enter__(self) -> "TestWatchdog":
+        if self.__timeout > 0:
+            self.__thread = threading.Thread(target=self.__watch, name="vbaunit-watchdog", daemon=True)
+            self.__thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.__finished.set()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def __watch(self) -> None:
+        if self.__finished.wait(self.__timeout):
+            return
+        self.__fired = True
+        print(f"[ERR]test case timed out after {self.__timeout} s")
+        testlib = getactivetestlib()
+        if testlib is not None:
+            testlib.abort()
+        if self.__finished.wait(self.__grace):
+            return
+        _thread.interrupt_main()
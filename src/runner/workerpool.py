@@ -0,0 +1,260 @@
+import importlib
+import multiprocessing
+import queue as queuemodule
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+from util.types import TestCase, TestModule
+from vbaunit_lib.backend import getbackend
+from vbaunit_lib.comretry import RetryingBackend, RetryStats
+from runner.reaper import ExcelReaper
+from vbaunit_lib.session import ExcelSessionPool, PoolStats
+from vbaunit_lib.testlib import setglobalbackend, setglobalbridgepath, setglobalsessionpool
+from runner.parallel import testcase_fromjob, testcase_job
+
+
+WorkerOutcome = namedtuple("WorkerOutcome", ["succeeded", "startat", "runned_at", "elapsed", "worker", "timedout", "calledmacros"])
+WorkerStats = namedtuple("WorkerStats", ["started", "recycled", "crashed", "jobs"])
+WorkerHandle = namedtuple("WorkerHandle", ["workerid", "process", "jobqueue"])
+
+# ワーカーが起動した時に読み込んでおくモジュール。Windows以外で無いものは飛ばす
+PRELOAD_MODULES = ("pythoncom", "pywintypes", "win32com.client", "xlwings", "psutil", "openpyxl", "vbaunit_lib.testlib", "runner.run")
+
+
+class PrewarmedWorkerPool:
+    """重いモジュールを読み込み済みのワーカープロセスでテストケースを1つずつ実行する。
+    実行中のワーカーとは別に、次のワーカーを1つ起動して待たせておくので、入れ替えの時に読み込みを待たない。
+    ワーカーが落ちてもそのテストケースが失敗になるだけで、次のワーカーで続きを実行する。
+    """
+
+    def __init__(
+        self,
+        bridge: Path,
+        backendname: str,
+        maxjobs: int = 0,
+        maxmemory: int = 0,
+        isolation: str = "module",
+        failonleak: bool = False,
+        timeout: float = 0.0,
+        manifest: tuple[str, int, float | None] | None = None,
+    ) -> None:
+        """bridge: Bridgeブックのパス
+        backendname: ワーカーで使うExcelの操作手段の名前
+        maxjobs: 1つのワーカーで実行するテストケースの上限。0なら無制限
+        maxmemory: ワーカーのメモリ使用量の上限（MB）。超えたらそのテストケースの後で入れ替える。0なら無制限
+        isolation: ワーカーの中でのモジュールの読み直しの単位。moduleかtest
+        failonleak: Trueなら解放されないまま残ったCOMオブジェクトがあるテストケースを失敗にする
+        timeout: テストケースの既定の制限時間（秒）。0なら無制限
+        manifest: 起動したExcelを記録するマニフェストのパスとランナーのプロセスIDと起動時刻。Noneなら記録しない
+        """
+        self.__bridge = str(bridge)
+        self.__backendname = backendname
+        self.__maxjobs = maxjobs
+        self.__maxmemory = maxmemory
+        self.__isolation = isolation
+        self.__failonleak = failonleak
+        self.__timeout = timeout
+        self.__manifest = manifest
+        self.__context = multiprocessing.get_context("spawn")
+        self.__resultqueue = self.__context.Queue()
+        self.__active: WorkerHandle | None = None
+        self.__standby: WorkerHandle | None = None
+        self.__running: dict[int, WorkerHandle] = {}
+        self.__jobcount = 0
+        self.__activejobs = 0
+        self.__started = 0
+        self.__recycled = 0
+        self.__crashed = 0
+        self.__excelstats = PoolStats(launched=0, reused=0, reopened=0, closed=0)
+        self.__retrystats = RetryStats(0, 0.0, 0, 0.0, 0, 0)
+
+    @property
+    def stats(self) -> WorkerStats:
+        return WorkerStats(started=self.__started, recycled=self.__recycled, crashed=self.__crashed, jobs=self.__jobcount)
+
+    @property
+    def excelstats(self) -> PoolStats:
+        """終了したワーカーのExcelセッションの統計"""
+        return self.__excelstats
+
+    @property
+    def retrystats(self) -> RetryStats:
+        """終了したワーカーのCOMのやり直しの統計"""
+        return self.__retrystats
+
+    @property
+    def activeworker(self) -> int:
+        """次のテストケースを実行するワーカーの番号"""
+        return self.__getactive().workerid
+
+    def execute(self, testcase: TestCase) -> WorkerOutcome:
+        """テストケースをワーカーで実行して結果を待つ"""
+        worker = self.__getactive()
+        self.__jobcount += 1
+        self.__activejobs += 1
+        worker.jobqueue.put(testcase_job(testcase, self.__jobcount))
+        while True:
+            try:
+                message = self.__resultqueue.get(timeout=1)
+            except queuemodule.Empty:
+                if not worker.process.is_alive():
+                    print(f"[ERR]worker {worker.workerid} exited with code {worker.process.exitcode}")
+                    self.__crashed += 1
+                    self.__running.pop(worker.workerid, None)
+                    self.__promote()
+                    now = datetime.now().isoformat(sep=" ", timespec="milliseconds")
+                    return WorkerOutcome(False, now, now, 0.0, worker.workerid, False, [])
+                continue
+
+            if message[0] == "done":
+                self.__collect(message)
+            elif message[0] == "result" and message[1] == worker.workerid:
+                _, workerid, succeeded, startat, runned_at, elapsed, timedout, calledmacros, recycle = message
+                if recycle:
+                    # ワーカーは上限に達したので自分で終了する
+                    self.__recycled += 1
+                    self.__promote()
+                return WorkerOutcome(succeeded, startat, runned_at, elapsed, workerid, timedout, calledmacros)
+
+    def recycle(self) -> None:
+        """実行中のワーカーを終了させて、待たせていたワーカーに入れ替える。まだ何も実行していなければ何もしない"""
+        if self.__active is None or self.__activejobs == 0:
+            return
+        self.__active.jobqueue.put(None)
+        self.__recycled += 1
+        self.__promote()
+
+    def shutdown(self) -> None:
+        """全てのワーカーを終了させて、終わるのを待つ"""
+        for worker in (self.__active, self.__standby):
+            if worker is not None:
+                worker.jobqueue.put(None)
+        self.__active = None
+        self.__standby = None
+        while len(self.__running) > 0:
+            try:
+                message = self.__resultqueue.get(timeout=1)
+            except queuemodule.Empty:
+                for workerid, worker in list(self.__running.items()):
+                    if not worker.process.is_alive():
+                        del self.__running[workerid]
+                continue
+            if message[0] == "done":
+                self.__collect(message)
+
+    def __getactive(self) -> WorkerHandle:
+        if self.__active is None:
+            self.__active = self.__spawn()
+            self.__activejobs = 0
+        if self.__standby is None:
+            self.__standby = self.__spawn()
+        return self.__active
+
+    def __promote(self) -> None:
+        self.__active = self.__standby if self.__standby is not None and self.__standby.process.is_alive() else None
+        self.__standby = None
+        self.__activejobs = 0
+        self.__getactive()
+
+    def __spawn(self) -> WorkerHandle:
+        workerid = self.__started
+        self.__started += 1
+        jobqueue = self.__context.Queue()
+        process = self.__context.Process(
+            target=serve_worker,
+            args=(
+                workerid,
+                self.__bridge,
+                self.__backendname,
+                self.__isolation,
+                self.__failonleak,
+                self.__timeout,
+                self.__manifest,
+                self.__maxjobs,
+                self.__maxmemory,
+                jobqueue,
+                self.__resultqueue,
+            ),
+            daemon=True,
+        )
+        process.start()
+        worker = WorkerHandle(workerid=workerid, process=process, jobqueue=jobqueue)
+        self.__running[workerid] = worker
+        return worker
+
+    def __collect(self, message: tuple) -> None:
+        _, workerid, stats, retries = message
+        self.__excelstats = PoolStats(*[a + b for a, b in zip(self.__excelstats, stats)])
+        self.__retrystats = RetryStats(*[a + b for a, b in zip(self.__retrystats, retries)])
+        worker = self.__running.pop(workerid, None)
+        if worker is not None:
+            worker.process.join()
+
+
+def serve_worker(
+    workerid: int,
+    bridge: str,
+    backendname: str,
+    isolation: str,
+    failonleak: bool,
+    timeout: float,
+    manifest: tuple[str, int, float | None] | None,
+    maxjobs: int,
+    maxmemory: int,
+    jobqueue,
+    resultqueue,
+) -> None:
+    """ワーカープロセスの本体。重いモジュールを先に読み込んでから、渡されたテストケースを順に実行する"""
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    import psutil
+    from runner.run import execute_testcase, switch_module  # runner.runがこのモジュールをimportするので実行時に読む
+
+    bridgepath = Path(bridge)
+    setglobalbridgepath(bridgepath)
+    backend = RetryingBackend(getbackend(backendname))
+    setglobalbackend(backend)
+    reaper = ExcelReaper(Path(manifest[0]), backend, owner=manifest[1], ownercreated=manifest[2]) if manifest is not None else None
+    pool = ExcelSessionPool(backend=backend, bridgepath=bridgepath, onlaunch=reaper.record if reaper is not None else None)
+    setglobalsessionpool(pool)
+    process = psutil.Process()
+    modules: dict[tuple[str, str], TestModule] = {}
+    currentmodule = None
+    jobs = 0
+    try:
+        comerrors = backend.comerrors()
+        while True:
+            job = jobqueue.get()
+            if job is None:
+                break
+            testcase = testcase_fromjob(job, modules)
+            currentmodule = switch_module(currentmodule, testcase)
+            startat = datetime.now().isoformat(sep=" ", timespec="milliseconds")
+            result, elapsed = execute_testcase(
+                testcase=testcase, comerrors=comerrors, isolation=isolation, failonleak=failonleak, timeout=timeout
+            )
+            jobs += 1
+            recycle = (maxjobs > 0 and jobs >= maxjobs) or (maxmemory > 0 and process.memory_info().rss > maxmemory * 1024 * 1024)
+            resultqueue.put(
+                (
+                    "result",
+                    workerid,
+                    result.succeeded,
+                    startat,
+                    result.runned_at,
+                    elapsed,
+                    result.timedout,
+                    result.calledmacros,
+                    recycle,
+                )
+            )
+            if recycle:
+                break
+    finally:
+        switch_module(currentmodule, None)
+        setglobalsessionpool(None)
+        pool.shutdown()
+        resultqueue.put(("done", workerid, tuple(pool.stats), tuple(backend.policy.stats)))
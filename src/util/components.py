@@ -0,0 +1,115 @@
+import re
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable
+from vbaunit_lib.backend import ExcelBackend
+
+
+ComponentSource = namedtuple("ComponentSource", ["name", "type", "code"])
+
+__PROCEDURE = re.compile(
+    r"^[ \t]*(?:(?:Public|Private|Friend)[ \t]+)?(?:Static[ \t]+)?(?:Sub|Function|Property[ \t]+(?:Get|Let|Set))[ \t]+(\w+)",
+    re.IGNORECASE | re.MULTILINE,
+)
+__IDENTIFIER = re.compile(r"\b[^\W\d]\w*")
+
+
+def exportcomponents(backend: ExcelBackend, workbookpath: Path, onlaunch: Callable[[int], None] | None = None) -> list[ComponentSource]:
+    """ブックを開いてVBComponent毎のコードを読む。ファイルには書き出さず、ブックは保存せずに閉じる
+    onlaunch: Excelを起動した時にプロセスIDを渡して呼ぶ関数
+    """
+    backend.initialize()
+    app = backend.launch(False)
+    pid = backend.getpid(app)
+    if onlaunch is not None:
+        onlaunch(pid)
+    try:
+        book = backend.openbook(app, workbookpath)
+        try:
+            sources = []
+            for component in backend.vbcomponents(book):
+                codemodule = component.CodeModule
+                count = codemodule.CountOfLines
+                code = codemodule.Lines(1, count) if count > 0 else ""
+                sources.append(ComponentSource(name=component.Name, type=component.Type, code=code.replace("\r\n", "\n")))
+            return sources
+        finally:
+            backend.closebook(book)
+    finally:
+        try:
+            backend.quit(app)
+        finally:
+            backend.kill(pid)
+            backend.uninitialize()
+
+
+def procedures(code: str) -> list[str]:
+    """モジュールに定義されたSub、Function、Propertyの名前"""
+    return sorted({name for name in __PROCEDURE.findall(code)})
+
+
+def callgraph(codes: dict[str, str]) -> dict[str, list[str]]:
+    """VBComponent毎に、コードから呼んでいるかもしれない他のVBComponentの名前。
+    コードに、他のVBComponentの名前かそのプロシージャ名と同じ識別子があれば呼ぶとみなす。
+    Application.Runの文字列も拾えるように、文字列とコメントも含めて見る。名前だけで見るので実際より多くなることはあっても、少なくはならない
+    """
+    owners: dict[str, set[str]] = {}
+    for name, code in codes.items():
+        owners.setdefault(name.lower(), set()).add(name)
+        for proc in procedures(code):
+            owners.setdefault(proc.lower(), set()).add(name)
+
+    graph: dict[str, list[str]] = {}
+    for name, code in codes.items():
+        callees: set[str] = set()
+        for identifier in {i.lower() for i in __IDENTIFIER.findall(code)}:
+            callees.update(owners.get(identifier, ()))
+        callees.discard(name)
+        graph[name] = sorted(callees)
+    return graph
+
+
+def resolvecomponents(
+    calledmacros: list[str], bookname: str, components: dict[str, list[str]], callees: dict[str, list[str]]
+) -> set[str] | None:
+    """ブックで使ったマクロから、使ったVBComponentの名前を求める。呼んだVBComponentから呼ばれるものも含める。
+    calledmacros: "ブック名!マクロ名"のリスト。他のブックの分は無視する
+    components: VBComponent毎の定義されたプロシージャ名
+    callees: VBComponent毎の呼んでいるかもしれないVBComponent（callgraphの結果）
+    どのVBComponentのものか決められないマクロや、呼び先が分からないVBComponentがあればNone
+    """
+    names = {name.lower(): name for name in components}
+    owners: dict[str, list[str]] = {}
+    for name, procs in components.items():
+        for proc in procs:
+            owners.setdefault(proc.lower(), []).append(name)
+
+    touched: set[str] = set()
+    for call in calledmacros:
+        book, _, macro = call.partition("!")
+        if book.lower() != bookname.lower():
+            continue
+        if macro.startswith("New "):
+            # create_newinstanceで作ったクラス
+            candidates = [names[macro[4:].lower()]] if macro[4:].lower() in names else []
+        elif "." in macro:
+            # "モジュール名.マクロ名"とバックドアの"モジュール名.*"
+            modulename = macro.split(".")[0]
+            candidates = [names[modulename.lower()]] if modulename.lower() in names else []
+        else:
+            # オブジェクトのメソッドもここに来るので、同じ名前を定義したものを全て使ったとみなす
+            candidates = owners.get(macro.lower(), [])
+        if len(candidates) == 0:
+            return None
+        touched.update(candidates)
+
+    pending = list(touched)
+    while len(pending) > 0:
+        name = pending.pop()
+        if name not in callees:
+            return None
+        for callee in callees[name]:
+            if callee not in touched:
+                touched.add(callee)
+                pending.append(callee)
+    return touched
@@ -0,0 +1,186 @@
+import ast
+from collections import namedtuple
+from pathlib import Path
+
+
+DiscoveredTest = namedtuple("DiscoveredTest", ["name", "subject", "start_line", "ignore"])
+DiscoveredModule = namedtuple("DiscoveredModule", ["tests", "parallelsafe"])
+
+__DECORATOR_DESCRIPTION = "description"
+__DECORATOR_IGNORE = "ignore"
+__DECORATOR_TIMEOUT = "timeout"  # 制限時間は実行時に関数から読むので、列挙では読み飛ばす
+__OPEN_FUNCTIONS = ("runapp", "openexcel")  # テスト対象のブックを開く関数
+
+
+def discover_source(modulepath: Path) -> DiscoveredModule | None:
+    """テストモジュールを実行せずに、ソースの構文木からテストケースを列挙する。
+    test_で始まるモジュール直下の関数と、@description(...)と@ignoreを読む。
+    静的に決められない書き方（未知のデコレーター、test_への代入、*のimportなど）があればNoneを返すので、
+    その時はモジュールを実行して列挙すること
+    """
+    try:
+        source = modulepath.read_bytes()
+        tree = ast.parse(source, filename=str(modulepath))
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    tests: dict[str, DiscoveredTest] = {}
+    parallelsafe = True
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and __callsglobals(node):
+            # globals()などで名前を作られると分からない
+            return None
+        if isinstance(node, ast.FunctionDef):
+            if not node.name.startswith("test_"):
+                continue
+            test = __discoverfunction(node)
+            if test is None:
+                return None
+            tests[node.name] = test  # 同じ名前で定義し直したら後のものが有効
+        elif isinstance(node, (ast.AsyncFunctionDef, ast.ClassDef)):
+            if node.name.startswith("test_"):
+                return None
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets: list[ast.expr] = list(node.targets) if isinstance(node, ast.Assign) else [node.target]
+            for name in __assignednames(targets):
+                if name.startswith("test_") or name == "__getattr__":
+                    return None
+                if name == "VBAUNIT_PARALLEL_SAFE":
+                    # 注釈だけで値の無いAnnAssignも、実行しないと分からないものとして扱う
+                    if isinstance(node, ast.AugAssign) or node.value is None or not isinstance(node.value, ast.Constant):
+                        return None
+                    parallelsafe = bool(node.value.value)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                name = alias.asname or alias.name
+                if name == "*" or name.startswith("test_") or name == "VBAUNIT_PARALLEL_SAFE":
+                    return None
+        elif isinstance(node, ast.Delete):
+            return None
+        elif isinstance(node, (ast.If, ast.Try, ast.For, ast.While, ast.With)):
+            # 条件付きで定義されるものは実行しないと分からない
+            for inner in ast.walk(node):
+                if isinstance(inner, (ast.FunctionDef, ast.AsyncFunctionDef)) and inner.name.startswith("test_"):
+                    return None
+                if isinstance(inner, ast.Name) and isinstance(inner.ctx, ast.Store):
+                    if inner.id.startswith("test_") or inner.id == "VBAUNIT_PARALLEL_SAFE":
+                        return None
+
+    # inspect.getmembersと同じく名前順に並べる
+    return DiscoveredModule(tests=[tests[name] for name in sorted(tests)], parallelsafe=parallelsafe)
+
+
+def discover_workbooks(modulepath: Path) -> dict[str, list[str]] | None:
+    """テストモジュールがrunappとopenexcelで開くブックのパスを、ソースに書かれた順に関数毎に返す。
+    test_で始まる関数の外で開くものは""にまとめる。
+    文字列の定数でないパスを渡している所があれば、どのブックを開くか決められないのでNoneを返す
+    """
+    try:
+        tree = ast.parse(modulepath.read_bytes(), filename=str(modulepath))
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    workbooks: dict[str, list[str]] = {}
+    for node in tree.body:
+        owner = node.name if isinstance(node, ast.FunctionDef) and node.name.startswith("test_") else ""
+        calls = [inner for inner in ast.walk(node) if isinstance(inner, ast.Call) and __decoratorname(inner.func) in __OPEN_FUNCTIONS]
+        for call in sorted(calls, key=lambda c: (c.lineno, c.col_offset)):
+            if len(call.args) != 1 or not isinstance(call.args[0], ast.Constant) or not isinstance(call.args[0].value, str):
+                return None
+            workbooks.setdefault(owner, []).append(call.args[0].value)
+    return workbooks
+
+
+def discover_localimports(modulepath: Path) -> list[Path]:
+    """テストモジュールがimportする、テストモジュールのフォルダかカレントフォルダにある.pyのパス。
+    importされたモジュールがさらにimportするものも辿る。見つからないもの（標準ライブラリなど）は含めない
+    """
+    found: dict[Path, None] = {}
+    pending = [modulepath.resolve()]
+    while len(pending) > 0:
+        current = pending.pop()
+        try:
+            tree = ast.parse(current.read_bytes(), filename=str(current))
+        except (OSError, SyntaxError, ValueError):
+            continue
+        for node in ast.walk(tree):
+            for candidate in __importcandidates(node, current):
+                if candidate.is_file() and candidate != modulepath.resolve() and candidate not in found:
+                    found[candidate] = None
+                    pending.append(candidate)
+    return sorted(found)
+
+
+def __importcandidates(node: ast.AST, modulepath: Path) -> list[Path]:
+    if isinstance(node, ast.Import):
+        names = [alias.name for alias in node.names]
+        bases = [modulepath.parent, Path.cwd()]
+    elif isinstance(node, ast.ImportFrom):
+        # from a import bのbはモジュールかもしれない
+        prefix = node.module.split(".") if node.module else []
+        names = [".".join(prefix + [alias.name]) for alias in node.names if alias.name != "*"]
+        if node.module:
+            names.append(node.module)
+        if node.level > 0:
+            bases = [modulepath.parents[node.level - 1]] if node.level <= len(modulepath.parents) else []
+        else:
+            bases = [modulepath.parent, Path.cwd()]
+    else:
+        return []
+    candidates = []
+    for base in bases:
+        for name in names:
+            parts = name.split(".")
+            candidates.append(base.joinpath(*parts[:-1], parts[-1] + ".py").resolve())
+            candidates.append(base.joinpath(*parts, "__init__.py").resolve())
+    return candidates
+
+
+def __discoverfunction(node: ast.FunctionDef) -> DiscoveredTest | None:
+    subject = ""
+    ignore = False
+    for decorator in node.decorator_list:
+        if __decoratorname(decorator) == __DECORATOR_IGNORE:
+            ignore = True
+            continue
+        if isinstance(decorator, ast.Call) and __decoratorname(decorator.func) == __DECORATOR_DESCRIPTION:
+            if len(decorator.args) != 1 or len(decorator.keywords) != 0:
+                return None
+            arg = decorator.args[0]
+            if not isinstance(arg, ast.Constant) or not isinstance(arg.value, str):
+                return None
+            # 複数付いていたら一番外側（上）のものが見える
+            if subject == "":
+                subject = arg.value
+            continue
+        if isinstance(decorator, ast.Call) and __decoratorname(decorator.func) == __DECORATOR_TIMEOUT:
+            continue
+        return None
+
+    # デコレーターがあればinspect.getsourcelinesと同じく先頭のデコレーターの行
+    start_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+    return DiscoveredTest(name=node.name, subject=subject, start_line=start_line, ignore=ignore)
+
+
+def __decoratorname(node: ast.expr) -> str:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return ""
+
+
+def __assignednames(targets: list[ast.expr]) -> list[str]:
+    names = []
+    for target in targets:
+        for inner in ast.walk(target):
+            if isinstance(inner, ast.Name):
+                names.append(inner.id)
+    return names
+
+
+def __callsglobals(node: ast.stmt) -> bool:
+    for inner in ast.walk(node):
+        if isinstance(inner, ast.Call) and __decoratorname(inner.func) in ("globals", "setattr", "exec"):
+            return True
+    return False
@@ -0,0 +1,101 @@
+import json
+import os
+from pathlib import Path
+from util.discovery import DiscoveredTest
+from util.filehash import sha256file
+
+
+class DiscoveryCache:
+    """列挙したテストケースをモジュール毎にファイルに保存して、変わっていないモジュールの列挙を省く。
+    キーはモジュールの絶対パスと内容のハッシュ。同じモジュールが複数のテストIDで使われていても列挙は1回で済む。
+    """
+
+    __VERSION = 1
+    __FILENAME = "discovery.json"
+
+    def __init__(self, cachedir: Path) -> None:
+        """cachedir: キャッシュを置くフォルダ。無ければ作る"""
+        self.__cachedir = cachedir
+        self.__cachepath = cachedir.joinpath(DiscoveryCache.__FILENAME)
+        self.__entries: dict[str, dict] = self.__read()
+        self.__dirty = False
+        self.__hits = 0
+        self.__misses = 0
+        self.__hashes: dict[Path, str] = {}
+
+    @property
+    def hits(self) -> int:
+        return self.__hits
+
+    @property
+    def misses(self) -> int:
+        return self.__misses
+
+    @property
+    def logline(self) -> str:
+        total = self.__hits + self.__misses
+        rate = self.__hits * 100 / total if total > 0 else 0.0
+        return f"Discovery cache: {self.__hits} hit, {self.__misses} miss ({rate:.0f}%)"
+
+    def lookup(self, module) -> bool:
+        """キャッシュが有効ならmoduleにテストケースを登録してTrueを返す。無効ならmoduleには触らない"""
+        modulepath = module.modulepath
+        if not modulepath.exists():
+            self.__misses += 1
+            return False
+        entry = self.__entries.get(str(modulepath))
+        if entry is not None and entry.get("sha256") == self.__filehash(modulepath):
+            self.__hits += 1
+            tests = [DiscoveredTest(*test) for test in entry["tests"]]
+            module.set_discovered(tests, entry["parallelsafe"], "cache")
+            return True
+        self.__misses += 1
+        return False
+
+    def store(self, module) -> None:
+        """列挙し終わったmoduleの結果をキャッシュに入れる"""
+        modulepath = module.modulepath
+        if not modulepath.exists():
+            return
+        self.__entries[str(modulepath)] = {
+            "sha256": self.__filehash(modulepath),
+            "parallelsafe": module.parallelsafe,
+            "tests": [list(test) for test in module.discovered],
+        }
+        self.__dirty = True
+
+    def save(self) -> None:
+        """変更があればキャッシュを書き出す。無くなったモジュールの分は捨てる"""
+        stale = [key for key in self.__entries if not Path(key).exists()]
+        for key in stale:
+            del self.__entries[key]
+        if not self.__dirty and len(stale) == 0:
+            return
+        try:
+            self.__cachedir.mkdir(parents=True, exist_ok=True)
+            temppath = self.__cachepath.with_suffix(".tmp")
+            with open(temppath, mode="w", encoding="utf-8") as f:
+                json.dump({"version": DiscoveryCache.__VERSION, "modules": self.__entries}, f, ensure_ascii=False)
+            os.replace(temppath, self.__cachepath)
+            self.__dirty = False
+        except OSError as e:
+            print(f"[WARN]could not write discovery cache {self.__cachepath}: {e}")
+
+    def __filehash(self, modulepath: Path) -> str:
+        # 同じ実行の中では同じモジュールを何度もハッシュしない
+        if modulepath not in self.__hashes:
+            self.__hashes[modulepath] = sha256file(modulepath)
+        return self.__hashes[modulepath]
+
+    def __read(self) -> dict[str, dict]:
+        if not self.__cachepath.exists():
+            return {}
+        try:
+            with open(self.__cachepath, mode="r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN]broken discovery cache {self.__cachepath}: {e}")
+            return {}
+        if data.get("version") != DiscoveryCache.__VERSION:
+            return {}
+        return data.get("modules", {})
@@ -0,0 +1,29 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from util.discovery import DiscoveredModule, DiscoveredTest
+
+
+def discover_module(modulepath: str) -> DiscoveredModule:
+    """モジュールを実行してテストケースを列挙する。ワーカープロセスからも呼ぶので、結果はモジュールに依らない形で返す"""
+    from util.types import TestModule  # util.typesがこのモジュールをimportするので実行時に読む
+
+    module = TestModule("", "", "", modulepath, True, 0)
+    module.pick_testcases(discovery="exec")
+    return DiscoveredModule(tests=[DiscoveredTest(*test) for test in module.discovered], parallelsafe=module.parallelsafe)
+
+
+def discover_modules(modulepaths: list[str], jobs: int) -> dict[str, DiscoveredModule]:
+    """モジュールを実行してテストケースを列挙する。jobsが2以上ならプロセスプールで並列に実行する。
+    戻り値はモジュールのパスから列挙結果への辞書。並べる順序は呼び出し元が決める
+    """
+    uniquepaths = list(dict.fromkeys(modulepaths))
+    workers = min(jobs, len(uniquepaths))
+    if workers < 2:
+        return {modulepath: discover_module(modulepath) for modulepath in uniquepaths}
+
+    print(f"discover {len(uniquepaths)} modules with {workers} processes")
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        chunksize = max(1, len(uniquepaths) // (workers * 4))
+        results = executor.map(discover_module, uniquepaths, chunksize=chunksize)
+        return dict(zip(uniquepaths, results))
@@ -0,0 +1,43 @@
+import hashlib
+import zipfile
+from collections import namedtuple
+from pathlib import Path
+
+
+def sha256file(path: Path) -> str:
+    """ファイルの内容のSHA-256を16進数で返す"""
+    digest = hashlib.sha256()
+    with open(path, mode="rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sha256text(text: str) -> str:
+    """文字列のSHA-256を16進数で返す"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+WorkbookHash = namedtuple("WorkbookHash", ["data", "project"])
+
+__VBA_PROJECT = "xl/vbaproject.bin"
+__IGNORED_PARTS = ("docprops/",)  # 保存する度に日時が変わるだけのもの
+
+
+def sha256workbook(path: Path) -> WorkbookHash:
+    """マクロ有効ブックを、VBAのプロジェクトとそれ以外（シートなど）に分けてハッシュする。
+    それ以外の部分はzipに記録されたCRCとサイズで比べ、展開しない。zipでなければどちらもファイル全体のハッシュ
+    """
+    if not zipfile.is_zipfile(path):
+        filehash = sha256file(path)
+        return WorkbookHash(data=filehash, project=filehash)
+    data = hashlib.sha256()
+    project = hashlib.sha256()
+    with zipfile.ZipFile(path) as book:
+        for info in sorted(book.infolist(), key=lambda i: i.filename):
+            partname = info.filename.lower()
+            if partname == __VBA_PROJECT:
+                project.update(book.read(info))
+            elif not partname.startswith(__IGNORED_PARTS):
+                data.update(f"{info.filename}:{info.CRC}:{info.file_size}\n".encode("utf-8"))
+    return WorkbookHash(data=data.hexdigest(), project=project.hexdigest())
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable
+from util.components import ComponentSource, callgraph, procedures, resolvecomponents
+from util.discovery import discover_localimports, discover_workbooks
+from util.filehash import WorkbookHash, sha256file, sha256text, sha256workbook
+from util.types import TestCase, TestResult
+
+
+ComponentHash = namedtuple("ComponentHash", ["hash", "procedures", "callees"])
+
+
+class ResultCache:
+    """成功したテストケースを、入力の内容のハッシュをキーにしてSQLiteに記録する。
+    キーはテストモジュールとそれがimportするローカルの.py、それらが開くブックのシートなど、bridgeのハッシュから作り、どれかが変われば実行し直す。
+    ブックのVBAは、exporterがあればテストケースが使ったVBComponentとそこから呼ばれるものだけを、無ければプロジェクト全体を比べる。
+    開くブックがソースから決められないモジュールと、1つも見つけられないモジュールはキャッシュしない
+    """
+
+    __VERSION = 3
+    __FILENAME = "resultcache.sqlite"
+
+    def __init__(self, cachedir: Path, exporter: Callable[[Path], list[ComponentSource]] | None = None) -> None:
+        """cachedir: データベースを置くフォルダ。無ければ作る
+        exporter: ブックのVBComponent毎のコードを読む関数。VBAのプロジェクトが変わったブックだけ、実行の最初に呼ぶ
+        """
+        self.__dbpath = cachedir.joinpath(ResultCache.__FILENAME)
+        self.__exporter = exporter
+        self.__connection: sqlite3.Connection | None = None
+        self.__hashes: dict[Path, str | None] = {}
+        self.__workbookhashes: dict[Path, WorkbookHash | None] = {}
+        self.__workbooks: dict[Path, list[Path] | None] = {}
+        self.__imports: dict[Path, list[Path]] = {}
+        self.__components: dict[Path, dict[str, ComponentHash] | None] = {}
+        self.__exported = 0
+        try:
+            cachedir.mkdir(parents=True, exist_ok=True)
+            self.__connection = self.__open()
+        except sqlite3.Error as e:
+            print(f"[WARN]could not open result cache {self.__dbpath}: {e}")
+
+    @property
+    def path(self) -> Path:
+        return self.__dbpath
+
+    @property
+    def exported(self) -> int:
+        """この実行でVBComponentを読み直したブックの数"""
+        return self.__exported
+
+    def key(self, testcase: TestCase, bridge: Path) -> str | None:
+        """テストケースの入力から作ったキー。入力が決められなければNone。
+        ブックのハッシュはここで計算して覚えておくので、テストケースを実行する前に呼ぶこと
+        """
+        modulepath = testcase.module.modulepath
+        workbooks = self.__moduleworkbooks(modulepath)
+        if workbooks is None:
+            return None
+        inputs = [self.__filehash(modulepath), self.__filehash(bridge)]
+        inputs.extend(self.__filehash(path) for path in self.__localimports(modulepath))
+        for workbook in workbooks:
+            workbookhash = self.__workbookhash(workbook)
+            inputs.append(workbookhash.data if workbookhash is not None else None)
+        if None in inputs:
+            return None
+        return sha256text(json.dumps([ResultCache.__VERSION, testcase.testid, testcase.testfunction, inputs]))
+
+    def passed(self, key: str) -> bool:
+        """同じキーで成功したことがあり、その時に使ったVBAが変わっていないかどうか"""
+        if self.__connection is None:
+            return False
+        try:
+            row = self.__connection.execute("SELECT vba FROM passes WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"[WARN]could not read result cache {self.__dbpath}: {e}")
+            return False
+        if row is None:
+            return False
+        for workbook, recorded in json.loads(row[0]).items():
+            workbookhash = self.__workbookhash(Path(workbook))
+            if workbookhash is None:
+                return False
+            if workbookhash.project == recorded["project"]:
+                continue
+            if recorded["components"] is None:
+                return False
+            # プロジェクトが変わっていても、使ったVBComponentが同じなら実行しなくていい
+            components = self.__componenthashes(Path(workbook))
+            if components is None:
+                return False
+            for name, componenthash in recorded["components"].items():
+                if name not in components or components[name].hash != componenthash:
+                    return False
+        return True
+
+    def record(self, outcomes: list[tuple[str, TestResult]]) -> None:
+        """実行したテストケースの結果をキーと一緒に記録する。成功したら古いキーと置き換え、失敗したら消す。
+        成功したものは、使ったマクロからVBComponentを求めて、そのハッシュも記録する
+        """
+        if self.__connection is None:
+            return
+        try:
+            with self.__connection:
+                for key, result in outcomes:
+                    if result.succeeded:
+                        self.__connection.execute(
+                            "INSERT OR REPLACE INTO passes (testid, function, key, vba) VALUES (?, ?, ?, ?)",
+                            (result.testid, result.testfunction, key, json.dumps(self.__usedvba(result))),
+                        )
+                    else:
+                        self.__connection.execute(
+                            "DELETE FROM passes WHERE testid = ? AND function = ?", (result.testid, result.testfunction)
+                        )
+        except sqlite3.Error as e:
+            print(f"[WARN]could not write result cache {self.__dbpath}: {e}")
+
+    def clear(self) -> None:
+        """記録を全て捨てる"""
+        if self.__connection is None:
+            return
+        try:
+            with self.__connection:
+                self.__connection.execute("DELETE FROM passes")
+                self.__connection.execute("DELETE FROM components")
+        except sqlite3.Error as e:
+            print(f"[WARN]could not clear result cache {self.__dbpath}: {e}")
+
+    def close(self) -> None:
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+    def __usedvba(self, result: TestResult) -> dict[str, dict]:
+        used: dict[str, dict] = {}
+        for workbook in self.__moduleworkbooks(result.module.modulepath) or []:
+            workbookhash = self.__workbookhash(workbook)
+            if workbookhash is None:
+                continue
+            touched = None
+            components = self.__componenthashes(workbook)
+            if components is not None:
+                names = resolvecomponents(
+                    result.calledmacros,
+                    workbook.name,
+                    {name: entry.procedures for name, entry in components.items()},
+                    {name: entry.callees for name, entry in components.items()},
+                )
+                if names is not None:
+                    touched = {name: components[name].hash for name in sorted(names)}
+            used[str(workbook)] = {"project": workbookhash.project, "components": touched}
+        return used
+
+    def __componenthashes(self, workbook: Path) -> dict[str, ComponentHash] | None:
+        """VBComponent毎のハッシュ。VBAのプロジェクトが前と同じならデータベースから、変わっていれば読み直す"""
+        if workbook in self.__components:
+            return self.__components[workbook]
+        components = None
+        workbookhash = self.__workbookhash(workbook)
+        exporter = self.__exporter
+        connection = self.__connection
+        if exporter is not None and workbookhash is not None and connection is not None:
+            try:
+                components = self.__readcomponents(connection, workbook, workbookhash.project)
+                if components is None:
+                    components = self.__exportcomponents(connection, exporter, workbook, workbookhash.project)
+            except sqlite3.Error as e:
+                print(f"[WARN]could not use VBA components in result cache {self.__dbpath}: {e}")
+        self.__components[workbook] = components
+        return components
+
+    def __readcomponents(self, connection: sqlite3.Connection, workbook: Path, project: str) -> dict[str, ComponentHash] | None:
+        rows = connection.execute(
+            "SELECT name, hash, procedures, callees FROM components WHERE workbook = ? AND project = ?", (str(workbook), project)
+        ).fetchall()
+        if len(rows) == 0:
+            return None
+        # 空の名前は、VBComponentが1つも無いブックでも読んだことを残すための行
+        return {
+            name: ComponentHash(componenthash, json.loads(procs), json.loads(callees))
+            for name, componenthash, procs, callees in rows
+            if name != ""
+        }
+
+    def __exportcomponents(
+        self,
+        connection: sqlite3.Connection,
+        exporter: Callable[[Path], list[ComponentSource]],
+        workbook: Path,
+        project: str,
+    ) -> dict[str, ComponentHash] | None:
+        try:
+            sources = exporter(workbook)
+        except Exception as e:
+            print(f"[WARN]could not export VBA components of {workbook}: {e}")
+            return None
+        self.__exported += 1
+        graph = callgraph({source.name: source.code for source in sources})
+        components = {
+            source.name: ComponentHash(
+                hashlib.sha256(source.code.encode("utf-8")).hexdigest(), procedures(source.code), graph[source.name]
+            )
+            for source in sources
+        }
+        rows = [
+            (str(workbook), project, name, entry.hash, json.dumps(entry.procedures), json.dumps(entry.callees))
+            for name, entry in components.items()
+        ]
+        rows.append((str(workbook), project, "", "", "[]", "[]"))
+        with connection:
+            # 古いプロジェクトの分は要らない。成功の記録にはその時のハッシュが残っている
+            connection.execute("DELETE FROM components WHERE workbook = ?", (str(workbook),))
+            connection.executemany(
+                "INSERT OR REPLACE INTO components (workbook, project, name, hash, procedures, callees) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return components
+
+    def __moduleworkbooks(self, modulepath: Path) -> list[Path] | None:
+        # どのテストケースがどのブックを使うかは分けずに、モジュールとimportしたものが開くものを全て入力にする
+        if modulepath not in self.__workbooks:
+            workbooks: set[Path] = set()
+            resolved = True
+            for path in [modulepath] + self.__localimports(modulepath):
+                discovered = discover_workbooks(path)
+                if discovered is None:
+                    resolved = False
+                    break
+                workbooks.update(Path(p).resolve() for ps in discovered.values() for p in ps)
+            # 見つからないのは、ソースから辿れない所でブックを開いているのかもしれない
+            self.__workbooks[modulepath] = sorted(workbooks) if resolved and workbooks else None
+        return self.__workbooks[modulepath]
+
+    def __localimports(self, modulepath: Path) -> list[Path]:
+        if modulepath not in self.__imports:
+            self.__imports[modulepath] = discover_localimports(modulepath)
+        return self.__imports[modulepath]
+
+    def __workbookhash(self, workbook: Path) -> WorkbookHash | None:
+        # テストケースがブックを書き換えることがあるので、実行の最初に計算したものを使い続ける
+        if workbook not in self.__workbookhashes:
+            try:
+                self.__workbookhashes[workbook] = sha256workbook(workbook)
+            except (OSError, ValueError):
+                self.__workbookhashes[workbook] = None
+            if self.__workbookhashes[workbook] is not None:
+                self.__componenthashes(workbook)
+        return self.__workbookhashes[workbook]
+
+    def __filehash(self, path: Path) -> str | None:
+        # 同じ実行の中では同じファイルを何度もハッシュしない
+        if path not in self.__hashes:
+            try:
+                self.__hashes[path] = sha256file(path)
+            except OSError:
+                self.__hashes[path] = None
+        return self.__hashes[path]
+
+    def __open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.__dbpath)
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != ResultCache.__VERSION:
+            connection.execute("DROP TABLE IF EXISTS passes")
+            connection.execute("DROP TABLE IF EXISTS components")
+            # テストケース毎に最新の成功だけを残す。キーで引くので索引を付ける
+            # vbaは、ブック毎のプロジェクトのハッシュと、使ったVBComponentのハッシュ（決められなければnull）
+            # calleesは、VBComponentのコードから呼んでいるかもしれない他のVBComponent
+            connection.execute(
+                "CREATE TABLE passes (testid TEXT NOT NULL, function TEXT NOT NULL, key TEXT NOT NULL, vba TEXT NOT NULL, "
+                "PRIMARY KEY (testid, function)) WITHOUT ROWID"
+            )
+            connection.execute("CREATE UNIQUE INDEX passes_key ON passes (key)")
+            connection.execute(
+                "CREATE TABLE components (workbook TEXT NOT NULL, project TEXT NOT NULL, name TEXT NOT NULL, "
+                "hash TEXT NOT NULL, procedures TEXT NOT NULL, callees TEXT NOT NULL, PRIMARY KEY (workbook, project, name)) WITHOUT ROWID"
+            )
+            connection.execute(f"PRAGMA user_version = {ResultCache.__VERSION}")
+            connection.commit()
+        return connection
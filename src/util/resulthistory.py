@@ -0,0 +1,86 @@
+import sqlite3
+from pathlib import Path
+from typing import Iterable
+
+
+class ResultHistory:
+    """テストケース毎の最新の結果を、シナリオ、テストID、関数名をキーにしてSQLiteに保存する。
+    前回失敗したものだけを実行する時に、モジュールを読み込む前に絞り込むために使う
+    """
+
+    __VERSION = 1
+    __FILENAME = "results.sqlite"
+
+    def __init__(self, cachedir: Path) -> None:
+        """cachedir: データベースを置くフォルダ。無ければ作る"""
+        self.__dbpath = cachedir.joinpath(ResultHistory.__FILENAME)
+        self.__connection: sqlite3.Connection | None = None
+        try:
+            cachedir.mkdir(parents=True, exist_ok=True)
+            self.__connection = self.__open()
+        except sqlite3.Error as e:
+            print(f"[WARN]could not open result history {self.__dbpath}: {e}")
+
+    @property
+    def path(self) -> Path:
+        return self.__dbpath
+
+    def lastfailed(self, scenariopath: Path) -> dict[str, set[str]] | None:
+        """シナリオで前回失敗したテストケースを、テストID毎の関数名で返す。
+        このシナリオの結果が1つも無ければNone
+        """
+        if self.__connection is None:
+            return None
+        scenario = str(scenariopath.resolve())
+        try:
+            if self.__connection.execute("SELECT 1 FROM results WHERE scenario = ? LIMIT 1", (scenario,)).fetchone() is None:
+                return None
+            failed: dict[str, set[str]] = {}
+            rows = self.__connection.execute("SELECT testid, function FROM results WHERE scenario = ? AND succeeded = 0", (scenario,))
+            for testid, function in rows:
+                failed.setdefault(testid, set()).add(function)
+            return failed
+        except sqlite3.Error as e:
+            print(f"[WARN]could not read result history {self.__dbpath}: {e}")
+            return None
+
+    def record(self, scenariopath: Path, results: Iterable) -> None:
+        """TestResultのリストを記録する。同じテストケースの前の結果は上書きする"""
+        if self.__connection is None:
+            return
+        scenario = str(scenariopath.resolve())
+        rows = [
+            (scenario, result.testid, result.testfunction, result.module.modulepath.name, int(result.succeeded), result.runned_at)
+            for result in results
+        ]
+        try:
+            with self.__connection:
+                self.__connection.executemany(
+                    "INSERT OR REPLACE INTO results (scenario, testid, function, module, succeeded, runned_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            print(f"[WARN]could not write result history {self.__dbpath}: {e}")
+
+    def close(self) -> None:
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+    def __open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.__dbpath)
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != ResultHistory.__VERSION:
+            # 形式が変わったら作り直す。履歴が消えるだけで実行には困らない
+            connection.execute("DROP TABLE IF EXISTS results")
+            connection.execute(
+                "CREATE TABLE results ("
+                "scenario TEXT NOT NULL, testid TEXT NOT NULL, function TEXT NOT NULL, "
+                "module TEXT NOT NULL, succeeded INTEGER NOT NULL, runned_at TEXT NOT NULL, "
+                "PRIMARY KEY (scenario, testid, function)) WITHOUT ROWID"
+            )
+            # 失敗したものだけを引く時に全件を読まない
+            connection.execute("CREATE INDEX results_failed ON results (scenario, succeeded)")
+            connection.execute(f"PRAGMA user_version = {ResultHistory.__VERSION}")
+            connection.commit()
+        return connection
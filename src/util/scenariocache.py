@@ -0,0 +1,95 @@
+import json
+import os
+import time
+from pathlib import Path
+from util.filehash import sha256file, sha256text
+from util.types import TestScenario
+
+
+class ScenarioCache:
+    """解析済みのシナリオをファイルに保存して、シナリオファイルが変わっていなければ読み込みを省く。
+    キーはシナリオファイルのパス、サイズ、更新日時、内容のハッシュ。サイズと更新日時が同じならハッシュの計算も省く。
+    """
+
+    __VERSION = 1
+
+    def __init__(self, cachedir: Path) -> None:
+        """cachedir: キャッシュを置くフォルダ。無ければ作る"""
+        self.__cachedir = cachedir
+        self.__hit = False
+        self.__elapsed = 0.0
+
+    @property
+    def hit(self) -> bool:
+        """直前のloadでキャッシュを使えたかどうか"""
+        return self.__hit
+
+    @property
+    def elapsed(self) -> float:
+        """直前のloadにかかった時間（秒）"""
+        return self.__elapsed
+
+    @property
+    def logline(self) -> str:
+        return f"Scenario cache: {'hit' if self.__hit else 'miss'} ({self.__elapsed * 1000:.0f} ms)"
+
+    def load(self, scenariopath: Path) -> TestScenario:
+        """シナリオを返す。キャッシュが有効ならそこから、そうでなければシナリオファイルを解析してキャッシュを作り直す"""
+        starttime = time.perf_counter()
+        scenariopath = scenariopath.resolve()
+        cachepath = self.__cachepath(scenariopath)
+        stat = os.stat(scenariopath)
+
+        cached = self.__read(cachepath)
+        filehash = None
+        if cached is not None and cached.get("path") == str(scenariopath):
+            if cached.get("size") != stat.st_size or cached.get("mtime_ns") != stat.st_mtime_ns:
+                filehash = sha256file(scenariopath)
+            if filehash is None or filehash == cached.get("sha256"):
+                if filehash is not None:
+                    # 内容は同じなので次からハッシュを計算しなくて済むようにする
+                    cached["size"] = stat.st_size
+                    cached["mtime_ns"] = stat.st_mtime_ns
+                    self.__write(cachepath, cached)
+                self.__hit = True
+                self.__elapsed = time.perf_counter() - starttime
+                return TestScenario.fromdict(scenariopath, cached)
+
+        scenario = TestScenario(scenariopath)
+        if scenario.valid:
+            data = scenario.todict()
+            data["version"] = ScenarioCache.__VERSION
+            data["path"] = str(scenariopath)
+            data["size"] = stat.st_size
+            data["mtime_ns"] = stat.st_mtime_ns
+            data["sha256"] = filehash if filehash is not None else sha256file(scenariopath)
+            self.__write(cachepath, data)
+        self.__hit = False
+        self.__elapsed = time.perf_counter() - starttime
+        return scenario
+
+    def __cachepath(self, scenariopath: Path) -> Path:
+        return self.__cachedir.joinpath(f"scenario_{sha256text(str(scenariopath))[:16]}.json")
+
+    def __read(self, cachepath: Path) -> dict | None:
+        if not cachepath.exists():
+            return None
+        try:
+            with open(cachepath, mode="r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN]broken scenario cache {cachepath}: {e}")
+            return None
+        if data.get("version") != ScenarioCache.__VERSION:
+            return None
+        return data
+
+    def __write(self, cachepath: Path, data: dict) -> None:
+        try:
+            self.__cachedir.mkdir(parents=True, exist_ok=True)
+            temppath = cachepath.with_suffix(".tmp")
+            with open(temppath, mode="w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temppath, cachepath)
+        except OSError as e:
+            print(f"[WARN]could not write scenario cache {cachepath}: {e}")
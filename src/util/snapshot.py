@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable, Iterable
+from util.components import ComponentSource
+from util.discovery import discover_workbooks
+from util.filehash import sha256file
+
+
+SnapshotStats = namedtuple("SnapshotStats", ["workbooks", "exported", "components", "stored", "storedbytes", "elapsed"])
+
+
+class SnapshotStore:
+    """テスト対象のブックのVBAのコードを、実行毎に保存する。
+    コードはVBComponent毎に内容のハッシュを名前にして圧縮して1回だけ保存し、実行毎にはVBComponentとハッシュの一覧だけを書く。
+    ブックのファイルが前の保存の時と同じなら、ブックを開かずに前の一覧を使う
+    """
+
+    __VERSION = 1
+
+    def __init__(self, cachedir: Path, exporter: Callable[[Path], list[ComponentSource]]) -> None:
+        """cachedir: 保存するフォルダ。この下のsnapshotsに置く
+        exporter: ブックのVBComponent毎のコードを読む関数
+        """
+        self.__rootdir = cachedir.joinpath("snapshots")
+        self.__objectsdir = self.__rootdir.joinpath("objects")
+        self.__manifestsdir = self.__rootdir.joinpath("manifests")
+        self.__latestpath = self.__rootdir.joinpath("latest.json")
+        self.__exporter = exporter
+
+    def snapshot(self, runid: str, workbooks: Iterable[Path]) -> SnapshotStats:
+        """ブックのコードを保存して、runidの一覧を書く"""
+        starttime = time.perf_counter()
+        latest = self.__readjson(self.__latestpath) or {}
+        manifest: dict[str, dict] = {}
+        exported = components = stored = storedbytes = 0
+        for workbook in workbooks:
+            workbook = workbook.resolve()
+            try:
+                filehash = sha256file(workbook)
+            except OSError as e:
+                print(f"[WARN]could not read workbook for snapshot {workbook}: {e}")
+                continue
+            previous = latest.get(str(workbook))
+            if previous is not None and previous["sha256"] == filehash:
+                entry = previous
+            else:
+                try:
+                    sources = self.__exporter(workbook)
+                except Exception as e:
+                    print(f"[WARN]could not export VBA components of {workbook}: {e}")
+                    continue
+                exported += 1
+                entry = {"sha256": filehash, "components": {}}
+                for source in sources:
+                    objecthash, written = self.__store(source.code)
+                    entry["components"][source.name] = {"type": source.type, "sha256": objecthash}
+                    if written > 0:
+                        stored += 1
+                        storedbytes += written
+                latest[str(workbook)] = entry
+            manifest[str(workbook)] = entry
+            components += len(entry["components"])
+
+        self.__writejson(
+            self.__manifestsdir.joinpath(f"{runid}.json"), {"version": SnapshotStore.__VERSION, "run": runid, "workbooks": manifest}
+        )
+        if exported > 0:
+            self.__writejson(self.__latestpath, latest)
+        return SnapshotStats(
+            workbooks=len(manifest),
+            exported=exported,
+            components=components,
+            stored=stored,
+            storedbytes=storedbytes,
+            elapsed=time.perf_counter() - starttime,
+        )
+
+    def manifest(self, runid: str) -> dict[str, dict] | None:
+        """runidで保存したブック毎のVBComponentとハッシュの一覧"""
+        data = self.__readjson(self.__manifestsdir.joinpath(f"{runid}.json"))
+        return data["workbooks"] if data is not None else None
+
+    def readcode(self, objecthash: str) -> str:
+        """保存したコードを読む"""
+        return zlib.decompress(self.__objectpath(objecthash).read_bytes()).decode("utf-8")
+
+    def __store(self, code: str) -> tuple[str, int]:
+        """コードを保存してハッシュと書いた大きさを返す。もうあれば書かずに0"""
+        data = code.encode("utf-8")
+        objecthash = hashlib.sha256(data).hexdigest()
+        objectpath = self.__objectpath(objecthash)
+        if objectpath.exists():
+            return objecthash, 0
+        compressed = zlib.compress(data, 9)
+        try:
+            objectpath.parent.mkdir(parents=True, exist_ok=True)
+            temppath = objectpath.with_suffix(".tmp")
+            temppath.write_bytes(compressed)
+            os.replace(temppath, objectpath)
+        except OSError as e:
+            print(f"[WARN]could not write snapshot object {objectpath}: {e}")
+            return objecthash, 0
+        return objecthash, len(compressed)
+
+    def __objectpath(self, objecthash: str) -> Path:
+        # 1つのフォルダにファイルが増えすぎないように、先頭2文字で分ける
+        return self.__objectsdir.joinpath(objecthash[:2], objecthash[2:])
+
+    def __readjson(self, path: Path) -> dict | None:
+        if not path.exists():
+            return None
+        try:
+            with open(path, mode="r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN]broken snapshot file {path}: {e}")
+            return None
+
+    def __writejson(self, path: Path, data: dict) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temppath = path.with_suffix(".tmp")
+            with open(temppath, mode="w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temppath, path)
+        except OSError as e:
+            print(f"[WARN]could not write snapshot file {path}: {e}")
+
+
+def suiteworkbooks(testcases: Iterable) -> list[Path]:
+    """テストケースのモジュールがrunappとopenexcelで開くブック。カレントフォルダからのパスで返す"""
+    modulepaths: dict[Path, None] = {}
+    for testcase in testcases:
+        modulepaths.setdefault(testcase.module.modulepath, None)
+    workbooks: dict[Path, None] = {}
+    for modulepath in modulepaths:
+        for paths in (discover_workbooks(modulepath) or {}).values():
+            for path in paths:
+                workbooks.setdefault(Path(path).resolve(), None)
+    return list(workbooks)
+
+
+def snapshotlogline(stats: SnapshotStats) -> str:
+    """テストログに書く1行"""
+    return (
+        f"Snapshot: {stats.workbooks} workbooks ({stats.exported} exported), {stats.components} components, "
+        f"{stats.stored} new ({stats.storedbytes / 1024:.1f} KB), in {stats.elapsed * 1000:.0f} ms"
+    )
@@ -5,12 +5,16 @@ from importlib.util import spec_from_file_location, module_from_spec
 from pathlib import Path
 from datetime import datetime
 from collections import namedtuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import sys
 from typing import Iterator
 from pprint import pprint
 from openpyxl import load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
+from util.discovery import DiscoveredTest, discover_source
+from util.discoverycache import DiscoveryCache
+from util.discoverypool import discover_modules
+from util.resulthistory import ResultHistory
 
 
 ResultCount = namedtuple("ResultCount", ["succeeded", "failed"])
@@ -50,6 +54,9 @@ class TestResult:
     testfunction: テストケースとして実行する関数名
     succeeded: テストケースが成功したかどうか
     runned_at: テストケースが実行された日時
+    timedout: 制限時間を超えて止められたかどうか。止められたテストケースは失敗になる
+    cached: 入力が前に成功した時と同じなので、実行せずに成功としたかどうか
+    calledmacros: テスト対象のブックで使ったマクロ。"ブック名!マクロ名"
     """
 
     testid: str
@@ -59,6 +66,9 @@ class TestResult:
     start_line: int
     succeeded: bool
     runned_at: str
+    timedout: bool = False
+    cached: bool = False
+    calledmacros: list[str] = field(default_factory=list)
 
 
 class TestModule:
@@ -96,6 +106,8 @@ class TestModule:
 
         self.__testmodule = None
         self.__testmodulekey = "testee"
+        self.__parallelsafe = True
+        self.__discoveredby = ""
 
     def load_module(self, key=datetime.now()) -> None:
         if self.__testmodulekey != "testee":
@@ -126,6 +138,11 @@ class TestModule:
     def modulepath(self) -> Path:
         return Path(self.__modulepath).resolve()
 
+    @property
+    def definedpath(self) -> str:
+        """シナリオに書かれたままのモジュールのパス"""
+        return self.__modulepath
+
     @property
     def run(self) -> bool:
         return self.__run
@@ -134,6 +151,28 @@ class TestModule:
     def line(self) -> int:
         return self.__line
 
+    @property
+    def parallelsafe(self) -> bool:
+        """他のテストと同時に実行してよいか。モジュールに VBAUNIT_PARALLEL_SAFE = False と書くと直列に実行する"""
+        return self.__parallelsafe
+
+    @property
+    def isolation(self) -> str:
+        """ロード済みのモジュールが宣言した分離レベル。VBAUNIT_ISOLATION = "test" と書くとテストケース毎に読み直す"""
+        return str(getattr(self.__testmodule, "VBAUNIT_ISOLATION", "module"))
+
+    @property
+    def reusebook(self) -> bool:
+        """ロード済みのモジュールが、テスト対象ブックの使い回しを許すか。VBAUNIT_REUSE_BOOK = True と書くと、
+        変更されていないブックを開き直さずに次のテストケースで使う。既定ではrunapp毎に開き直す
+        """
+        return bool(getattr(self.__testmodule, "VBAUNIT_REUSE_BOOK", False))
+
+    @property
+    def discoveredby(self) -> str:
+        """テストケースをどう列挙したか。astかexec。列挙前は空文字列"""
+        return self.__discoveredby
+
     def unload_module(self) -> None:
         if self.__testmodule:
             del self.__testmodule
@@ -156,8 +195,13 @@ class TestModule:
         self.__testfunctions.append(testfunction)
         return tc
 
-    def pick_testcases(self) -> None:
-        """テストモジュール内の全てのテストケースを列挙する"""
+    def pick_testcases(self, discovery: str = "ast") -> None:
+        """テストモジュール内の全てのテストケースを列挙する
+        discovery: astならモジュールを実行せずにソースから列挙する。静的に決められなければexecと同じ
+        """
+        if discovery == "ast" and self.pick_testcases_from_source():
+            return
+
         self.load_module()
         testfunctions = [(name, f) for name, f in inspect.getmembers(self.__testmodule, inspect.isfunction) if name.startswith("test_")]
         for name, f in testfunctions:
@@ -168,8 +212,35 @@ class TestModule:
                 start_line=start_line,
                 ignore=getattr(f, "_is_ignored", False),
             )
+        self.__parallelsafe = bool(getattr(self.__testmodule, "VBAUNIT_PARALLEL_SAFE", True))
+        self.__discoveredby = "exec"
         self.unload_module()
 
+    def pick_testcases_from_source(self) -> bool:
+        """モジュールを実行せずにソースからテストケースを列挙する。静的に決められなければ何もせずFalseを返す"""
+        discovered = discover_source(self.modulepath)
+        if discovered is None:
+            return False
+        self.set_discovered(discovered.tests, discovered.parallelsafe, "ast")
+        return True
+
+    def set_discovered(self, tests: list[DiscoveredTest], parallelsafe: bool, discoveredby: str) -> None:
+        """別の手段で列挙したテストケースを登録する。モジュールは読み込まない"""
+        for test in tests:
+            self.add_testcase(
+                testfunction=test.name,
+                subject=test.subject,
+                start_line=test.start_line,
+                ignore=test.ignore,
+            )
+        self.__parallelsafe = parallelsafe
+        self.__discoveredby = discoveredby
+
+    @property
+    def discovered(self) -> list[DiscoveredTest]:
+        """列挙したテストケースを、モジュールに依らない形で返す"""
+        return [DiscoveredTest(tc.testfunction, tc.subject, tc.start_line, tc.ignore) for tc in self.__testcases]
+
     def set_result(self, testfunction: str, start_line: int, succeeded: bool, runned_at: datetime) -> TestResult | None:
         if testfunction in self.__testfunctions:
             succeeded = TestResult(
@@ -281,6 +352,8 @@ class TestGroup:
 class TestScenario:
     """テストシナリオの定義。シナリオファイルに対応する"""
 
+    __HEADER = ("テストID", "説明", "モジュール", "実行", "結果")
+
     def __init__(self, scenariopath: Path) -> None:
         """テストシナリオの初期化
         scenariopath: シナリオファイルの絶対パス
@@ -326,6 +399,49 @@ class TestScenario:
                 print("close scenario file.")
                 sbook.close()
 
+    @classmethod
+    def fromdict(cls, scenariopath: Path, data: dict) -> TestScenario:
+        """todict()で書き出した内容からシナリオを復元する。シナリオファイルは読まない"""
+        scenario = cls.__new__(cls)
+        scenario.__valid = True
+        scenario.__scenario = scenariopath
+        scenario.__groups = []
+        scenario.__groupsindex = {}
+        for groupdata in data["groups"]:
+            group = TestGroup(groupdata["name"])
+            for moduledata in groupdata["modules"]:
+                group.add_test_module(
+                    testid=moduledata["testid"],
+                    subject=moduledata["subject"],
+                    module=moduledata["module"],
+                    run=moduledata["run"],
+                    line=moduledata["line"],
+                )
+            scenario.__groups.append(group)
+            scenario.__groupsindex[group.groupname] = group
+        return scenario
+
+    def todict(self) -> dict:
+        """グループとモジュールの定義をJSONに書ける形で返す"""
+        return {
+            "groups": [
+                {
+                    "name": group.groupname,
+                    "modules": [
+                        {
+                            "testid": module.testid,
+                            "subject": module.subject,
+                            "module": module.definedpath,
+                            "run": module.run,
+                            "line": module.line,
+                        }
+                        for module in group
+                    ],
+                }
+                for group in self.__groups
+            ]
+        }
+
     def __iter__(self) -> Iterator[TestGroup]:
         return iter(self.__groups)
 
@@ -353,28 +469,24 @@ class TestScenario:
         return self.__groupsindex[groupname]
 
     def __analyzegroup(self, gsheet: Worksheet) -> TestGroup | None:
-        if gsheet.cell(2, 2).value != "テストID":
-            return None
-        if gsheet.cell(2, 3).value is None or gsheet.cell(2, 3).value != "説明":
-            return None
-        if gsheet.cell(2, 4).value is None or gsheet.cell(2, 4).value != "モジュール":
-            return None
-        if gsheet.cell(2, 5).value is None or gsheet.cell(2, 5).value != "実行":
-            return None
-        if gsheet.cell(2, 6).value is None or gsheet.cell(2, 6).value != "結果":
+        # read_onlyのシートはcell()の度にXMLを読み直すので、B～F列を1行ずつ1回だけ読む
+        rows = gsheet.iter_rows(min_row=2, min_col=2, max_col=6, values_only=True)
+        header = next(rows, None)
+        if header is None or tuple(header[:5]) != TestScenario.__HEADER:
             return None
 
         group = TestGroup(gsheet.title)
-        row = 3
-        while gsheet.cell(row, 2).value is not None and gsheet.cell(row, 2).value != "":
+        for row, values in enumerate(rows, start=3):
+            testid = values[0] if len(values) > 0 else None
+            if testid is None or testid == "":
+                break
             group.add_test_module(
-                testid=gsheet.cell(row, 2).value,
-                subject=gsheet.cell(row, 3).value,
-                module=gsheet.cell(row, 4).value,
-                run=self.__getrequired(gsheet.cell(row, 5).value),
+                testid=testid,
+                subject=values[1] if len(values) > 1 else None,
+                module=values[2] if len(values) > 2 else None,
+                run=self.__getrequired(values[3] if len(values) > 3 else None),
                 line=row,
             )
-            row += 1
 
         return group
 
@@ -400,6 +512,10 @@ class TestSuite:
         filters: str = "",
         ignores: str = "",
         scope: TestScope = TestScope.ALL,
+        discovery: str = "ast",
+        discoverycache: DiscoveryCache | None = None,
+        discoveryjobs: int = 1,
+        resulthistory: ResultHistory | None = None,
     ):
         """テストセットを作成する。
         name: テストスイートを識別する名称（この名前でログを出力する）
@@ -409,6 +525,10 @@ class TestSuite:
         filters: 実行するべきテストケースの関数名に含まれる識別子（任意の文字列）。"|"区切り。省略した場合はフィルタリングしない
         ignores: 無視するテストケースの関数名に含まれる識別子（任意の文字列）。"|"区切り。省略した場合は無視しない
         scope: 実行する範囲。全部か前回の失敗のみ
+        discovery: テストケースの列挙方法。astかexec
+        discoverycache: 列挙結果のキャッシュ。省略した場合は毎回列挙する
+        discoveryjobs: モジュールを実行して列挙する時のプロセス数
+        resulthistory: 前回までの結果。scopeがlastfailedの時に、前回失敗したものに絞るために使う
         """
         self.__name = name
         self.__subject = subject
@@ -418,6 +538,7 @@ class TestSuite:
         self.__scope = scope
         self.__tests = list[TestCase]()
         self.__testset = dict[str, list[TestCase]]()
+        self.__modules = list[TestModule]()
 
         if len(self.__groups) == 0:
             # 絞り込みが無ければ全グループを実行する
@@ -429,16 +550,51 @@ class TestSuite:
             for module in group:
                 if not module.run:
                     continue
-                self.__testset[module.testid] = list[TestCase]()
-                module.pick_testcases()
-                for testcase in module:
-                    if self.__torun(
-                        testcase=testcase,
-                        filters=self.__filters,
-                        ignores=self.__ignores,
-                    ):
-                        self.__tests.append(testcase)
-                        self.__testset[module.testid].append(testcase)
+                self.__modules.append(module)
+
+        # 前回失敗したものだけなら、列挙の前に失敗したテストケースのあるモジュールに絞る
+        self.__lastfailed: dict[str, set[str]] | None = None
+        if self.lastfailedscope:
+            if resulthistory is not None:
+                self.__lastfailed = resulthistory.lastfailed(scenario.path)
+            if self.__lastfailed is None:
+                print("[WARN]no result history for this scenario, run all test cases.")
+            else:
+                if len(self.__lastfailed) == 0:
+                    print("[WARN]no failed test cases in the last run.")
+                self.__modules = [module for module in self.__modules if module.testid in self.__lastfailed]
+
+        # キャッシュとソースで列挙できなかったモジュールだけ、まとめて実行して列挙する
+        execmodules = list[TestModule]()
+        for module in self.__modules:
+            if discoverycache is not None and discoverycache.lookup(module):
+                continue
+            if discovery == "ast" and module.pick_testcases_from_source():
+                if discoverycache is not None:
+                    discoverycache.store(module)
+                continue
+            execmodules.append(module)
+        if len(execmodules) > 0:
+            discovered = discover_modules([str(module.modulepath) for module in execmodules], discoveryjobs)
+            for module in execmodules:
+                result = discovered[str(module.modulepath)]
+                module.set_discovered(result.tests, result.parallelsafe, "exec")
+                if discoverycache is not None:
+                    discoverycache.store(module)
+        if discoverycache is not None:
+            discoverycache.save()
+
+        # シナリオの順に並べる
+        for module in self.__modules:
+            self.__testset[module.testid] = list[TestCase]()
+            for testcase in module:
+                if self.__torun(
+                    testcase=testcase,
+                    filters=self.__filters,
+                    ignores=self.__ignores,
+                ):
+                    self.__tests.append(testcase)
+                    self.__testset[module.testid].append(testcase)
 
     @property
     def name(self) -> str:
@@ -460,12 +616,22 @@ class TestSuite:
     def count(self) -> int:
         return len(self.__tests)
 
+    @property
+    def discoverycount(self) -> dict[str, int]:
+        """列挙方法ごとのモジュール数"""
+        counts = {"ast": 0, "exec": 0, "cache": 0}
+        for module in self.__modules:
+            counts[module.discoveredby] = counts.get(module.discoveredby, 0) + 1
+        return counts
+
     def __getconditionlist(self, conditions: str) -> list[str]:
         return [f.strip() for f in conditions.split("|") if len(f.strip()) > 0]
 
     def __torun(self, testcase: TestCase, filters: list[str], ignores: list[str]) -> bool:
         if testcase.ignore:
             return False
+        if self.__lastfailed is not None and testcase.testfunction not in self.__lastfailed.get(testcase.testid, set()):
+            return False
         if self.__includestest(testcase.testfunction, ignores):
             return False
         if len(filters) == 0 or self.__includestest(testcase.testfunction, filters):
@@ -0,0 +1,196 @@
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Callable, Protocol
+
+
+ProcessInfo = namedtuple("ProcessInfo", ["created", "memory"])
+
+
+class ExcelBackend(Protocol):
+    """Excelを操作する手段。xlwingsによる本物の実装と、プロセス内で完結する偽物の実装を差し替えられるようにする。"""
+
+    name: str
+
+    def initialize(self) -> None:
+        """呼び出し元スレッドのCOMアパートメントを初期化する"""
+        ...
+
+    def uninitialize(self) -> None:
+        """initializeと対になる後始末"""
+        ...
+
+    def launch(self, visible: bool) -> Any:
+        """Excelアプリケーションを起動して返す"""
+        ...
+
+    def getpid(self, app: Any) -> int:
+        """ExcelアプリケーションのプロセスIDを返す"""
+        ...
+
+    def isalive(self, pid: int) -> bool:
+        """プロセスが生きているかどうか"""
+        ...
+
+    def openbook(self, app: Any, path: Path, bridge: bool = False) -> Any:
+        """ブックを開く。bridgeがTrueならBridgeブックとして開く"""
+        ...
+
+    def closebook(self, book: Any) -> None:
+        """ブックを保存せずに閉じる"""
+        ...
+
+    def isdirty(self, book: Any) -> bool:
+        """ブックが開いた後に変更されているかどうか"""
+        ...
+
+    def quit(self, app: Any) -> None:
+        """Excelアプリケーションを終了する"""
+        ...
+
+    def kill(self, pid: int) -> None:
+        """終了しきれなかったExcelのプロセスを落とす"""
+        ...
+
+    def processinfo(self, pid: int) -> ProcessInfo | None:
+        """Excelのプロセスの起動時刻とメモリ使用量（バイト）。Excelのプロセスでなければ、または無ければNone"""
+        ...
+
+    def processcreated(self, pid: int) -> float | None:
+        """Excelに限らないプロセスの起動時刻。無ければ、または読めなければNone。ランナーが動いているかを見るのに使う"""
+        ...
+
+    def run(self, app: Any, macro: str, *args) -> Any:
+        """Application.Runでマクロを実行する。macroは"ブック名!マクロ名"の形式"""
+        ...
+
+    def macro(self, book: Any, name: str) -> Callable[..., Any]:
+        """ブックのマクロを呼び出せる関数を返す"""
+        ...
+
+    def vbcomponents(self, book: Any) -> Any:
+        """ブックのVBProject.VBComponentsを返す"""
+        ...
+
+    def bstr(self, value: str) -> Any:
+        """文字列をVBAのString型として渡すための値に変換する"""
+        ...
+
+    def comerrors(self) -> tuple[type[BaseException], ...]:
+        """COM呼び出しの失敗として送出される例外の型"""
+        ...
+
+
+class XlwingsBackend:
+    """xlwingsとpywin32でExcelを操作する実装。Windowsでしか動かない。
+    importはWindows以外でもこのモジュールを読み込めるように使う時まで遅らせる。
+    """
+
+    name = "xlwings"
+
+    def initialize(self) -> None:
+        import pythoncom
+
+        pythoncom.CoInitialize()
+
+    def uninitialize(self) -> None:
+        import pythoncom
+
+        pythoncom.CoUninitialize()
+
+    def launch(self, visible: bool) -> Any:
+        import xlwings as xl
+
+        app = xl.App(visible=visible)
+        app.display_alerts = False
+        return app
+
+    def getpid(self, app: Any) -> int:
+        return app.pid
+
+    def isalive(self, pid: int) -> bool:
+        import psutil
+
+        return pid > 0 and psutil.pid_exists(pid)
+
+    def openbook(self, app: Any, path: Path, bridge: bool = False) -> Any:
+        if bridge:
+            return app.books.open(path, update_links=True, ignore_read_only_recommended=True)
+        return app.books.open(path)
+
+    def closebook(self, book: Any) -> None:
+        book.close()
+
+    def isdirty(self, book: Any) -> bool:
+        return not book.api.Saved
+
+    def quit(self, app: Any) -> None:
+        app.quit()
+
+    def kill(self, pid: int) -> None:
+        import psutil
+
+        if pid <= 0:
+            return
+        try:
+            p = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            return
+        try:
+            p.terminate()
+            p.wait(3)
+        except Exception as e:
+            print(f"Could not kill Excel process {pid}: {e}")
+
+    def processinfo(self, pid: int) -> ProcessInfo | None:
+        import psutil
+
+        if pid <= 0:
+            return None
+        try:
+            p = psutil.Process(pid)
+            if "excel" not in p.name().lower():
+                return None
+            return ProcessInfo(created=p.create_time(), memory=p.memory_info().rss)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+
+    def processcreated(self, pid: int) -> float | None:
+        import psutil
+
+        if pid <= 0:
+            return None
+        try:
+            return psutil.Process(pid).create_time()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+
+    def run(self, app: Any, macro: str, *args) -> Any:
+        return app.api.Run(macro, *args)
+
+    def macro(self, book: Any, name: str) -> Callable[..., Any]:
+        return book.macro(name)
+
+    def vbcomponents(self, book: Any) -> Any:
+        return book.api.VBProject.VBComponents
+
+    def bstr(self, value: str) -> Any:
+        import pythoncom
+        from win32com.client import VARIANT
+
+        return VARIANT(pythoncom.VT_BSTR, value)
+
+    def comerrors(self) -> tuple[type[BaseException], ...]:
+        import pywintypes
+
+        return (pywintypes.com_error,)
+
+
+def getbackend(name: str) -> ExcelBackend:
+    """名前からバックエンドを作成する。xlwingsかfake"""
+    if name == "xlwings":
+        return XlwingsBackend()
+    if name == "fake":
+        from vbaunit_lib.fakebackend import FakeBackend
+
+        return FakeBackend()
+    raise ValueError(f"[ERR]Unknown backend '{name}'.")
@@ -0,0 +1,24 @@
+Attribute VB_Name = "BridgeBatch"
+Option Explicit
+
+'' Runs several CallMacro calls in one round trip.
+'' calls: array of (callobj, creation, macroname, params)
+'' returns: array of CallMacro results, one per call
+Public Function CallMacroBatch(ByVal workbookname As String, ByVal calls As Variant) As Variant
+    Dim results() As Variant
+    Dim params() As Variant
+    Dim i As Long
+
+    If UBound(calls) < LBound(calls) Then
+        CallMacroBatch = Empty
+        Exit Function
+    End If
+
+    ReDim results(LBound(calls) To UBound(calls))
+    For i = LBound(calls) To UBound(calls)
+        params = calls(i)(3)
+        results(i) = CallMacro(calls(i)(0), calls(i)(1), workbookname, calls(i)(2), params)
+    Next
+
+    CallMacroBatch = results
+End Function
@@ -0,0 +1,74 @@
+Attribute VB_Name = "BridgeExport"
+Option Explicit
+
+'' Returns all items of the collection as a (count, 1) array, or Empty.
+Public Function ExportCollection(ByVal coll As Collection) As Variant
+    Dim values() As Variant
+    Dim i As Long
+
+    If coll.Count = 0 Then
+        ExportCollection = Empty
+        Exit Function
+    End If
+
+    ReDim values(1 To coll.Count, 1 To 1)
+    For i = 1 To coll.Count
+        If IsObject(coll.Item(i)) Then
+            Set values(i, 1) = coll.Item(i)
+        Else
+            values(i, 1) = coll.Item(i)
+        End If
+    Next
+
+    ExportCollection = values
+End Function
+
+'' Returns (found, value) per key as a (keys, 2) array.
+Public Function ExportCollectionItems(ByVal coll As Collection, ByVal keys As Variant) As Variant
+    Dim values() As Variant
+    Dim i As Long
+    Dim row As Long
+
+    ReDim values(1 To UBound(keys) - LBound(keys) + 1, 1 To 2)
+    For i = LBound(keys) To UBound(keys)
+        row = i - LBound(keys) + 1
+        values(row, 1) = False
+        values(row, 2) = Empty
+        On Error Resume Next
+        If IsObject(coll.Item(CStr(keys(i)))) Then
+            Set values(row, 2) = coll.Item(CStr(keys(i)))
+        Else
+            values(row, 2) = coll.Item(CStr(keys(i)))
+        End If
+        values(row, 1) = (Err.Number = 0)
+        Err.Clear
+        On Error GoTo 0
+    Next
+
+    ExportCollectionItems = values
+End Function
+
+'' Returns all keys and items of the dictionary as a (count, 2) array, or Empty.
+Public Function ExportDictionary(ByVal dict As Object) As Variant
+    Dim values() As Variant
+    Dim keys As Variant
+    Dim i As Long
+
+    If dict.Count = 0 Then
+        ExportDictionary = Empty
+        Exit Function
+    End If
+
+    keys = dict.keys
+    ReDim values(1 To dict.Count, 1 To 2)
+    For i = 0 To dict.Count - 1
+        values(i + 1, 1) = keys(i)
+        If IsObject(dict.Item(keys(i))) Then
+            Set values(i + 1, 2) = dict.Item(keys(i))
+        Else
+            values(i + 1, 2) = dict.Item(keys(i))
+        End If
+    Next
+
+    ExportDictionary = values
+End Function
@@ -0,0 +1,17 @@
+Attribute VB_Name = "BridgeRelease"
+Option Explicit
+
+'' Releases all objects passed from Python in one round trip.
+Public Sub FreeObjects(ByRef objs As Variant)
+    Dim i As Long
+
+    If Not IsArray(objs) Then
+        Exit Sub
+    End If
+    For i = LBound(objs) To UBound(objs)
+        If IsObject(objs(i)) Then
+            Set objs(i) = Nothing
+        End If
+    Next
+    Erase objs
+End Sub
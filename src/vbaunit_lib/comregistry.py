@@ -0,0 +1,67 @@
+import sys
+from collections import namedtuple
+from pathlib import Path
+from types import FrameType
+
+
+ComObjectEntry = namedtuple("ComObjectEntry", ["obj", "macro", "callsite"])
+ComObjectLeak = namedtuple("ComObjectLeak", ["count", "macro", "callsite"])
+
+# 呼び出し元を探す時に飛ばすファイル
+__LIBRARY_FILES = (str(Path(__file__).parent.joinpath("testlib.py")), __file__)
+
+
+class ComObjectRegistry:
+    """bridgeから取得したCOMオブジェクトを、オブジェクトの同一性をキーにして登録しておく。
+    登録と削除は一定時間で済み、作ったマクロとテストの呼び出し元も覚えておく
+    """
+
+    def __init__(self) -> None:
+        self.__entries: dict[int, ComObjectEntry] = {}
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __contains__(self, obj: object) -> bool:
+        return id(obj) in self.__entries
+
+    def register(self, obj: object, macro: str = "") -> None:
+        """オブジェクトを登録する。同じオブジェクトは1回だけ"""
+        if id(obj) not in self.__entries:
+            self.__entries[id(obj)] = ComObjectEntry(obj=obj, macro=macro, callsite=findcallsite())
+
+    def unregister(self, obj: object) -> bool:
+        """オブジェクトの登録を消す。登録されていたらTrue"""
+        return self.__entries.pop(id(obj), None) is not None
+
+    def objects(self) -> list[object]:
+        """登録されているオブジェクトを登録順に返す"""
+        return [entry.obj for entry in self.__entries.values()]
+
+    def leaks(self) -> list[ComObjectLeak]:
+        """登録されたまま残っているオブジェクトを、作ったマクロと呼び出し元毎に数える"""
+        counts: dict[tuple[str, str], int] = {}
+        for entry in self.__entries.values():
+            key = (entry.macro, entry.callsite)
+            counts[key] = counts.get(key, 0) + 1
+        return [ComObjectLeak(count=count, macro=macro, callsite=callsite) for (macro, callsite), count in counts.items()]
+
+    def clear(self) -> None:
+        self.__entries.clear()
+
+
+def findcallsite() -> str:
+    """testlibの外で一番近い呼び出し元を"ファイル名:行"で返す"""
+    frame: FrameType | None = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename in __LIBRARY_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return ""
+    return f"{Path(frame.f_code.co_filename).name}:{frame.f_lineno}"
+
+
+def formatleaks(leaks: list[ComObjectLeak]) -> str:
+    """リークの一覧を1行にまとめる"""
+    total = sum(leak.count for leak in leaks)
+    details = ", ".join(f"{leak.count} by {leak.macro or '?'} at {leak.callsite or '?'}" for leak in leaks)
+    return f"{total} COM objects not freed: {details}"
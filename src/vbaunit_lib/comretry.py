@@ -0,0 +1,198 @@
+import random
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Callable
+from vbaunit_lib.backend import ExcelBackend, ProcessInfo
+
+
+RetryStats = namedtuple("RetryStats", ["fast", "fastseconds", "backoff", "backoffseconds", "failed", "exhausted"])
+
+RETRY_FAST = "fast"  # すぐにやり直せば通るもの
+RETRY_BACKOFF = "backoff"  # Excelが忙しいので間隔を空けてやり直すもの
+RETRY_FAIL = "fail"  # やり直しても変わらないもの
+
+DISP_E_EXCEPTION = -2147352567  # VBAの実行時エラーなど。excepinfoのscodeで分ける
+
+# HRESULTの分類。ここに無いものはやり直さない
+HRESULT_CLASSES: dict[int, str] = {
+    -2147418110: RETRY_FAST,  # RPC_E_CALL_CANCELED
+    -2147417847: RETRY_FAST,  # RPC_E_RETRY
+    -2147418111: RETRY_BACKOFF,  # RPC_E_CALL_REJECTED
+    -2147417846: RETRY_BACKOFF,  # RPC_E_SERVERCALL_RETRYLATER
+    -2146777998: RETRY_BACKOFF,  # VBA_E_IGNORE（セルの編集中などでExcelが応答しない）
+    -2147023174: RETRY_FAIL,  # RPC_S_SERVER_UNAVAILABLE（Excelが落ちている）
+    -2147417848: RETRY_FAIL,  # RPC_E_DISCONNECTED
+}
+
+
+def gethresult(error: BaseException) -> int | None:
+    """COMのエラーからHRESULTを取り出す。DISP_E_EXCEPTIONでscodeがあればscodeを返す"""
+    hresult = getattr(error, "hresult", None)
+    if hresult is None and len(error.args) > 0 and isinstance(error.args[0], int):
+        hresult = error.args[0]
+    if hresult == DISP_E_EXCEPTION:
+        excepinfo = getattr(error, "excepinfo", None)
+        if excepinfo is None and len(error.args) > 2:
+            excepinfo = error.args[2]
+        if isinstance(excepinfo, tuple) and len(excepinfo) > 5 and excepinfo[5] in HRESULT_CLASSES:
+            return excepinfo[5]
+    return hresult
+
+
+def classify(error: BaseException) -> str:
+    """COMのエラーをfast、backoff、failのどれかに分ける"""
+    return HRESULT_CLASSES.get(gethresult(error) or 0, RETRY_FAIL)
+
+
+class ComRetryPolicy:
+    """COM呼び出し1回ごとに、HRESULTの分類に従ってやり直す。
+    fastは短い間隔で、backoffは間隔を倍々に延ばし揺らぎを加えてやり直す。failはすぐに諦める
+    """
+
+    def __init__(
+        self,
+        comerrors: tuple[type[BaseException], ...],
+        fastretries: int = 5,
+        fastdelay: float = 0.05,
+        backoffretries: int = 8,
+        backoffdelay: float = 0.2,
+        maxdelay: float = 5.0,
+        sleep: Callable[[float], None] = time.sleep,
+        onretry: Callable[[str, str, int | None, int, float], None] | None = None,
+    ) -> None:
+        """comerrors: やり直しの対象にする例外の型
+        fastretries, fastdelay: fastの回数の上限と間隔（秒）
+        backoffretries, backoffdelay, maxdelay: backoffの回数の上限、最初の間隔と最大の間隔（秒）
+        sleep: 待つための関数。テストで差し替える
+        onretry: やり直す時、やり直さずに送出する時と諦めた時に、結果（retryかfailedかexhausted）、分類、HRESULT、何回目か、待つ時間（秒）で呼ぶ
+        """
+        self.__comerrors = comerrors
+        self.__fastretries = fastretries
+        self.__fastdelay = fastdelay
+        self.__backoffretries = backoffretries
+        self.__backoffdelay = backoffdelay
+        self.__maxdelay = maxdelay
+        self.__sleep = sleep
+        self.__onretry = onretry
+        self.__stats = RetryStats(0, 0.0, 0, 0.0, 0, 0)
+
+    @property
+    def stats(self) -> RetryStats:
+        return self.__stats
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """funcを呼び出す。やり直せるCOMのエラーならやり直し、やり直せなければそのまま送出する"""
+        attempt = 0
+        while True:
+            starttime = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except self.__comerrors as e:
+                errorclass = classify(e)
+                limit = self.__fastretries if errorclass == RETRY_FAST else self.__backoffretries
+                if errorclass == RETRY_FAIL:
+                    self.__add(failed=1)
+                    self.__notify("failed", errorclass, e, attempt, 0.0)
+                    raise
+                if attempt >= limit:
+                    self.__add(exhausted=1)
+                    self.__notify("exhausted", errorclass, e, attempt, 0.0)
+                    raise
+                if errorclass == RETRY_FAST:
+                    delay = self.__fastdelay
+                else:
+                    # 間隔は倍々にして、複数のワーカーが同時にやり直さないように揺らす
+                    delay = min(self.__maxdelay, self.__backoffdelay * (2**attempt)) * random.uniform(0.5, 1.0)
+                self.__notify("retry", errorclass, e, attempt, delay)
+                self.__sleep(delay)
+                attempt += 1
+                spent = time.perf_counter() - starttime
+                if errorclass == RETRY_FAST:
+                    self.__add(fast=1, fastseconds=spent)
+                else:
+                    self.__add(backoff=1, backoffseconds=spent)
+
+    def __notify(self, outcome: str, errorclass: str, error: BaseException, attempt: int, delay: float) -> None:
+        if self.__onretry is not None:
+            self.__onretry(outcome, errorclass, gethresult(error), attempt + 1, delay)
+
+    def __add(self, **counts) -> None:
+        self.__stats = self.__stats._replace(**{key: getattr(self.__stats, key) + value for key, value in counts.items()})
+
+
+def retrylogline(stats: RetryStats) -> str:
+    """テストログに書く1行"""
+    return (
+        f"COM retries: {stats.fast} fast ({stats.fastseconds:.3f} s), {stats.backoff} backoff ({stats.backoffseconds:.3f} s), "
+        f"{stats.failed} not retried, {stats.exhausted} gave up"
+    )
+
+
+class RetryingBackend:
+    """別のExcelBackendのCOM呼び出しをComRetryPolicyでやり直す。名前は元のバックエンドと同じ"""
+
+    def __init__(self, backend: ExcelBackend, policy: ComRetryPolicy | None = None) -> None:
+        self.__backend = backend
+        self.__policy = policy if policy is not None else ComRetryPolicy(backend.comerrors())
+        self.name = backend.name
+
+    @property
+    def inner(self) -> ExcelBackend:
+        return self.__backend
+
+    @property
+    def policy(self) -> ComRetryPolicy:
+        return self.__policy
+
+    def initialize(self) -> None:
+        self.__backend.initialize()
+
+    def uninitialize(self) -> None:
+        self.__backend.uninitialize()
+
+    def launch(self, visible: bool) -> Any:
+        return self.__policy.call(self.__backend.launch, visible)
+
+    def getpid(self, app: Any) -> int:
+        return self.__policy.call(self.__backend.getpid, app)
+
+    def isalive(self, pid: int) -> bool:
+        return self.__backend.isalive(pid)
+
+    def openbook(self, app: Any, path: Path, bridge: bool = False) -> Any:
+        return self.__policy.call(self.__backend.openbook, app, path, bridge=bridge)
+
+    def closebook(self, book: Any) -> None:
+        self.__policy.call(self.__backend.closebook, book)
+
+    def isdirty(self, book: Any) -> bool:
+        return self.__policy.call(self.__backend.isdirty, book)
+
+    def quit(self, app: Any) -> None:
+        self.__policy.call(self.__backend.quit, app)
+
+    def kill(self, pid: int) -> None:
+        self.__backend.kill(pid)
+
+    def processinfo(self, pid: int) -> ProcessInfo | None:
+        return self.__backend.processinfo(pid)
+
+    def processcreated(self, pid: int) -> float | None:
+        return self.__backend.processcreated(pid)
+
+    def run(self, app: Any, macro: str, *args) -> Any:
+        return self.__policy.call(self.__backend.run, app, macro, *args)
+
+    def macro(self, book: Any, name: str) -> Callable[..., Any]:
+        func = self.__backend.macro(book, name)
+        return lambda *args: self.__policy.call(func, *args)
+
+    def vbcomponents(self, book: Any) -> Any:
+        return self.__policy.call(self.__backend.vbcomponents, book)
+
+    def bstr(self, value: str) -> Any:
+        return self.__backend.bstr(value)
+
+    def comerrors(self) -> tuple[type[BaseException], ...]:
+        return self.__backend.comerrors()
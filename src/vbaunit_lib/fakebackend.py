@@ -0,0 +1,612 @@
+import os
+import re
+import time
+from pathlib import Path
+from typing import Any, Callable
+from vbaunit_lib.backend import ProcessInfo
+
+
+DISP_E_EXCEPTION = -2147352567  # 例外が発生しました。
+RPC_E_CALL_REJECTED = -2147418111  # 呼び出し先が呼び出しを拒否しました。
+RPC_S_SERVER_UNAVAILABLE = -2147023174  # RPC サーバーを利用できません。
+VBEXT_CT_STDMODULE = 1
+VBEXT_CT_CLASSMODULE = 2
+
+
+class FakeComError(Exception):
+    """pywintypes.com_errorの代役。argsの並びも合わせる"""
+
+    def __init__(self, hresult: int, message: str, excepinfo: object = None, argerror: object = None) -> None:
+        super().__init__(hresult, message, excepinfo, argerror)
+        self.hresult = hresult
+        self.strerror = message
+        self.excepinfo = excepinfo
+        self.argerror = argerror
+
+
+class FakeVBAError(Exception):
+    """VBAの実行時エラーの代役。Err.NumberとErr.Descriptionを持つ"""
+
+    def __init__(self, number: int, description: str) -> None:
+        super().__init__(number, description)
+        self.number = number
+        self.description = description
+
+
+class FakeCollection:
+    """VBAのCollectionの代役。インデックスは1始まり"""
+
+    def __init__(self) -> None:
+        self.__items: list[object] = []
+        self.__keys: list[str | None] = []
+
+    def Add(self, item: object, key: str | None = None) -> None:  # noqa: N802
+        if key is not None and key in self.__keys:
+            raise FakeVBAError(457, "This key is already associated with an element of this collection")
+        self.__items.append(item)
+        self.__keys.append(key)
+
+    def Count(self) -> int:  # noqa: N802
+        return len(self.__items)
+
+    def Item(self, index: int | str) -> object:  # noqa: N802
+        return self.__items[self.__position(index)]
+
+    def Remove(self, index: int | str) -> None:  # noqa: N802
+        position = self.__position(index)
+        del self.__items[position]
+        del self.__keys[position]
+
+    def __iter__(self):
+        """VBAのFor Each。bridgeのマクロから使い、COMの呼び出しには数えない"""
+        return iter(list(self.__items))
+
+    def keyeditems(self) -> dict[str, object]:
+        """キー付きの要素。bridgeのマクロから使い、COMの呼び出しには数えない"""
+        return {key: item for key, item in zip(self.__keys, self.__items) if key is not None}
+
+    def __position(self, index: int | str) -> int:
+        if isinstance(index, str):
+            if index not in self.__keys:
+                raise FakeVBAError(5, "Invalid procedure call or argument")
+            return self.__keys.index(index)
+        if index < 1 or len(self.__items) < index:
+            raise FakeVBAError(9, "Subscript out of range")
+        return index - 1
+
+
+class FakeDictionary:
+    """Scripting.Dictionaryの代役"""
+
+    def __init__(self) -> None:
+        self.__items: dict[object, object] = {}
+
+    @property
+    def Count(self) -> int:  # noqa: N802
+        return len(self.__items)
+
+    def Add(self, key: object, item: object) -> None:  # noqa: N802
+        if key in self.__items:
+            raise FakeVBAError(457, "This key is already associated with an element of this collection")
+        self.__items[key] = item
+
+    def Item(self, key: object) -> object:  # noqa: N802
+        return self.__items.get(key)
+
+    def Exists(self, key: object) -> bool:  # noqa: N802
+        return key in self.__items
+
+    def Keys(self) -> tuple[object, ...]:  # noqa: N802
+        return tuple(self.__items.keys())
+
+    def Items(self) -> tuple[object, ...]:  # noqa: N802
+        return tuple(self.__items.values())
+
+    def Remove(self, key: object) -> None:  # noqa: N802
+        del self.__items[key]
+
+
+class FakeRegExp:
+    """VBScript.RegExpの代役"""
+
+    def __init__(self) -> None:
+        self.Pattern = ""
+        self.Global = False
+        self.IgnoreCase = False
+
+    def Test(self, text: str) -> bool:  # noqa: N802
+        return re.search(self.Pattern, text, self.__flags()) is not None
+
+    def Replace(self, text: str, replacement: str) -> str:  # noqa: N802
+        return re.sub(self.Pattern, replacement, text, count=0 if self.Global else 1, flags=self.__flags())
+
+    def __flags(self) -> int:
+        return re.IGNORECASE if self.IgnoreCase else 0
+
+
+class FakeCodeModule:
+    """VBIDE.CodeModuleの代役"""
+
+    def __init__(self, component: "FakeVBComponent", code: str = "") -> None:
+        self.__component = component
+        self.__lines: list[str] = code.splitlines()
+
+    @property
+    def CountOfLines(self) -> int:  # noqa: N802
+        return len(self.__lines)
+
+    def Lines(self, startline: int, count: int) -> str:  # noqa: N802
+        return "\r\n".join(self.__lines[startline - 1 : startline - 1 + count])
+
+    def InsertLines(self, line: int, code: str) -> None:  # noqa: N802
+        self.__lines[line - 1 : line - 1] = code.splitlines()
+        self.__component.changed()
+
+    def AddFromString(self, code: str) -> None:  # noqa: N802
+        self.InsertLines(len(self.__lines) + 1, code)
+
+    def DeleteLines(self, startline: int, count: int = 1) -> None:  # noqa: N802
+        del self.__lines[startline - 1 : startline - 1 + count]
+        self.__component.changed()
+
+    @property
+    def code(self) -> str:
+        return "\n".join(self.__lines)
+
+
+class FakeVBComponent:
+    """VBIDE.VBComponentの代役"""
+
+    def __init__(self, components: "FakeVBComponents", name: str, comptype: int, code: str = "") -> None:
+        self.__components = components
+        self.Name = name
+        self.Type = comptype
+        self.CodeModule = FakeCodeModule(self, code)
+
+    def changed(self) -> None:
+        self.__components.changed()
+
+
+class FakeVBComponents:
+    """VBIDE.VBComponentsの代役"""
+
+    def __init__(self, book: "FakeBook") -> None:
+        self.__book = book
+        self.__components: list[FakeVBComponent] = []
+
+    @property
+    def Count(self) -> int:  # noqa: N802
+        return len(self.__components)
+
+    def __iter__(self):
+        return iter(list(self.__components))
+
+    def Item(self, index: int | str) -> FakeVBComponent:  # noqa: N802
+        if isinstance(index, int):
+            return self.__components[index - 1]
+        for component in self.__components:
+            if component.Name == index:
+                return component
+        raise FakeComError(-2147352565, "Subscript out of range")
+
+    def Add(self, comptype: int) -> FakeVBComponent:  # noqa: N802
+        prefix = "Class" if comptype == VBEXT_CT_CLASSMODULE else "Module"
+        number = 1
+        names = {c.Name for c in self.__components}
+        while f"{prefix}{number}" in names:
+            number += 1
+        return self.append(f"{prefix}{number}", comptype)
+
+    def Remove(self, component: FakeVBComponent) -> None:  # noqa: N802
+        self.__components.remove(component)
+        self.changed()
+
+    def Import(self, path: str) -> FakeVBComponent:  # noqa: N802
+        code = Path(path).read_text(encoding="utf-8")
+        matched = re.search(r'^Attribute VB_Name = "(\w+)"', code, re.M)
+        name = matched.group(1) if matched else Path(path).stem
+        body = "\n".join(line for line in code.splitlines() if not line.startswith("Attribute "))
+        return self.append(name, VBEXT_CT_STDMODULE, body)
+
+    def append(self, name: str, comptype: int, code: str = "") -> FakeVBComponent:
+        component = FakeVBComponent(self, name, comptype, code)
+        self.__components.append(component)
+        self.changed()
+        return component
+
+    def changed(self) -> None:
+        self.__book.touch()
+
+
+class FakeVBProject:
+    def __init__(self, book: "FakeBook") -> None:
+        self.VBComponents = FakeVBComponents(book)
+
+
+class FakeBookApi:
+    """xlwingsのBook.apiの代役"""
+
+    def __init__(self, book: "FakeBook") -> None:
+        self.__book = book
+        self.VBProject = FakeVBProject(book)
+
+    @property
+    def Saved(self) -> bool:  # noqa: N802
+        return self.__book.saved
+
+
+class FakeRange:
+    def __init__(self, sheet: "FakeSheet", address: str) -> None:
+        self.__sheet = sheet
+        self.__address = address
+
+    @property
+    def value(self) -> object:
+        return self.__sheet.values.get(self.__address)
+
+    @value.setter
+    def value(self, value: object) -> None:
+        self.__sheet.values[self.__address] = value
+        self.__sheet.book.touch()
+
+
+class FakeSheet:
+    def __init__(self, book: "FakeBook", name: str) -> None:
+        self.book = book
+        self.name = name
+        self.values: dict[str, object] = {}
+
+    def range(self, address: str) -> FakeRange:
+        return FakeRange(self, address)
+
+
+class FakeSheets:
+    def __init__(self, book: "FakeBook") -> None:
+        self.__sheets = [FakeSheet(book, "Sheet1")]
+
+    @property
+    def count(self) -> int:
+        return len(self.__sheets)
+
+    def __getitem__(self, index: int | str) -> FakeSheet:
+        if isinstance(index, int):
+            return self.__sheets[index]
+        for sheet in self.__sheets:
+            if sheet.name == index:
+                return sheet
+        raise KeyError(index)
+
+    def __len__(self) -> int:
+        return len(self.__sheets)
+
+
+class FakeBook:
+    """プロセス内で完結するブックの代役"""
+
+    def __init__(self, app: "FakeApp", path: Path, macros: dict[str, Callable[..., Any]]) -> None:
+        self.app = app
+        self.fullname = str(path)
+        self.name = path.name
+        self.saved = True
+        self.closed = False
+        self.macros = macros
+        self.modulemacros: dict[str, dict[str, Callable[..., Any]]] = {}
+        self.api = FakeBookApi(self)
+        self.sheets = FakeSheets(self)
+
+    def touch(self) -> None:
+        """ブックを変更したことにする"""
+        self.saved = False
+
+    def close(self) -> None:
+        self.closed = True
+        if self in self.app.books:
+            self.app.books.remove(self)
+
+    def macro(self, name: str) -> Callable[..., Any]:
+        return lambda *args: self.app.backend.call(self, name, list(args))
+
+    def findmacro(self, name: str) -> Callable[..., Any] | None:
+        """マクロを探す。"モジュール名.マクロ名"でもマクロ名だけでもいい"""
+        macroname = name.split(".")[-1]
+        if macroname in self.macros:
+            return self.macros[macroname]
+        # 実行時に追加されたコードからインスタンス生成の関数を探す
+        for component in self.api.VBProject.VBComponents:
+            if macroname in self.modulemacros.get(component.Name, {}):
+                return self.modulemacros[component.Name][macroname]
+            factory = self.app.backend.findfactory(self, component.CodeModule.code, macroname)
+            if factory is not None:
+                return factory
+        return None
+
+
+class FakeApp:
+    """プロセス内で完結するExcelアプリケーションの代役"""
+
+    def __init__(self, backend: "FakeBackend", pid: int, visible: bool) -> None:
+        self.backend = backend
+        self.pid = pid
+        self.visible = visible
+        self.display_alerts = True
+        self.books: list[FakeBook] = []
+        self.alive = True
+        self.created = time.time()
+        self.memory = 64 * 1024 * 1024  # 起動直後のExcelくらい
+
+    def findbook(self, name: str) -> FakeBook | None:
+        for book in self.books:
+            if book.name.lower() == name.lower():
+                return book
+        return None
+
+
+class FakeBackend:
+    """Excelを起動せずに動くExcelBackendの実装。Linuxでのテストと計測に使う。
+    マクロとクラスはブック名に対してPythonの関数として登録しておく。Bridgeブックのマクロは組み込みで用意する。
+    launchdelay: Excel起動にかかる時間の模擬（秒）
+    opendelay: ブックを開くのにかかる時間の模擬（秒）
+    calldelay: COM呼び出し1回にかかる時間の模擬（秒）
+    """
+
+    name = "fake"
+    __STARTED = time.time()  # このプロセスの起動時刻の代わり。同じプロセスのFakeBackendでは同じ値にする
+
+    def __init__(self, launchdelay: float = 0.0, opendelay: float = 0.0, calldelay: float = 0.0) -> None:
+        self.launchdelay = launchdelay
+        self.opendelay = opendelay
+        self.calldelay = calldelay
+        self.apps: dict[int, FakeApp] = {}
+        # Excel以外で動いているプロセスと起動時刻。ランナーのプロセスを模擬する
+        self.processes: dict[int, float] = {os.getpid(): FakeBackend.__STARTED}
+        self.launchcount = 0
+        self.opencount = 0
+        self.callcount = 0
+        self.__rejects: list[int] = []
+        self.__nextpid = 10000
+        self.__macros: dict[str, dict[str, Callable[..., Any]]] = {}
+        self.__byref: set[Callable[..., Any]] = set()
+        self.__classes: dict[str, dict[str, Callable[[], object]]] = {}
+        self.__components: dict[str, list[tuple[str, int, str]]] = {}
+
+    def registermacro(self, bookname: str, name: str, func: Callable[..., Any], byref: bool = False) -> None:
+        """ブックのマクロを登録する。byrefがTrueなら引数のリストを受け取り、書き換えた値がByRefとして戻る"""
+        self.__macros.setdefault(bookname.lower(), {})[name] = func
+        if byref:
+            self.__byref.add(func)
+
+    def registerhang(self, bookname: str, name: str) -> None:
+        """呼ぶと戻ってこないマクロを登録する。モーダルなダイアログや無限ループの模擬。
+        Excelのプロセスが落とされると、本物と同じくRPCサーバーを利用できないCOMのエラーで戻る
+        """
+
+        def hang(*args) -> None:
+            apps = [app for app in self.apps.values() if app.findbook(bookname) is not None]
+            while len(apps) > 0 and all(app.alive for app in apps):
+                time.sleep(0.01)
+            raise FakeComError(RPC_S_SERVER_UNAVAILABLE, "The RPC server is unavailable.")
+
+        self.registermacro(bookname, name, hang)
+
+    def registerclass(self, bookname: str, classname: str, factory: Callable[[], object]) -> None:
+        """ブックのクラスモジュールを登録する"""
+        self.__classes.setdefault(bookname.lower(), {})[classname] = factory
+        self.registercomponent(bookname, classname, VBEXT_CT_CLASSMODULE)
+
+    def registercomponent(self, bookname: str, name: str, comptype: int = VBEXT_CT_STDMODULE, code: str = "") -> None:
+        """ブックを開いた時にあるVBComponentを登録する"""
+        components = self.__components.setdefault(bookname.lower(), [])
+        components[:] = [c for c in components if c[0] != name]
+        components.append((name, comptype, code))
+
+    def initialize(self) -> None:
+        return
+
+    def uninitialize(self) -> None:
+        return
+
+    def launch(self, visible: bool) -> Any:
+        if self.launchdelay > 0:
+            time.sleep(self.launchdelay)
+        app = FakeApp(backend=self, pid=self.__nextpid, visible=visible)
+        self.__nextpid += 1
+        app.display_alerts = False
+        self.apps[app.pid] = app
+        self.launchcount += 1
+        return app
+
+    def getpid(self, app: Any) -> int:
+        return app.pid
+
+    def isalive(self, pid: int) -> bool:
+        return pid in self.apps and self.apps[pid].alive
+
+    def openbook(self, app: Any, path: Path, bridge: bool = False) -> Any:
+        self.__checkalive(app)
+        if self.opendelay > 0:
+            time.sleep(self.opendelay)
+        path = Path(path)
+        macros = dict(self.__macros.get(path.name.lower(), {}))
+        modulemacros: dict[str, dict[str, Callable[..., Any]]] = {}
+        if bridge:
+            bridgemacros, modulemacros = self.__bridgemacros(app)
+            macros.update(bridgemacros)
+        book = FakeBook(app, path, macros)
+        book.modulemacros = modulemacros
+        for name, comptype, code in self.__components.get(path.name.lower(), []):
+            book.api.VBProject.VBComponents.append(name, comptype, code)
+        book.saved = True
+        app.books.append(book)
+        self.opencount += 1
+        return book
+
+    def closebook(self, book: Any) -> None:
+        book.close()
+
+    def isdirty(self, book: Any) -> bool:
+        return not book.saved
+
+    def quit(self, app: Any) -> None:
+        for book in list(app.books):
+            book.close()
+        app.alive = False
+
+    def kill(self, pid: int) -> None:
+        if pid in self.apps:
+            self.apps[pid].alive = False
+
+    def processinfo(self, pid: int) -> ProcessInfo | None:
+        if pid not in self.apps or not self.apps[pid].alive:
+            return None
+        return ProcessInfo(created=self.apps[pid].created, memory=self.apps[pid].memory)
+
+    def processcreated(self, pid: int) -> float | None:
+        if pid in self.apps:
+            return self.apps[pid].created if self.apps[pid].alive else None
+        return self.processes.get(pid)
+
+    def run(self, app: Any, macro: str, *args) -> Any:
+        self.__checkalive(app)
+        if "!" in macro:
+            bookname, macroname = macro.split("!", 1)
+            book = app.findbook(bookname.strip("'"))
+            if book is None:
+                raise FakeComError(DISP_E_EXCEPTION, f"Cannot run the macro '{macro}'.")
+            return self.call(book, macroname, list(args))
+        for book in app.books:
+            if book.findmacro(macro) is not None:
+                return self.call(book, macro, list(args))
+        raise FakeComError(DISP_E_EXCEPTION, f"Cannot run the macro '{macro}'.")
+
+    def macro(self, book: Any, name: str) -> Callable[..., Any]:
+        return book.macro(name)
+
+    def vbcomponents(self, book: Any) -> Any:
+        return book.api.VBProject.VBComponents
+
+    def bstr(self, value: str) -> Any:
+        return value
+
+    def comerrors(self) -> tuple[type[BaseException], ...]:
+        return (FakeComError,)
+
+    def rejectcalls(self, count: int, hresult: int = RPC_E_CALL_REJECTED) -> None:
+        """次のcount回のマクロ呼び出しを、実行せずにhresultのCOMのエラーにする。Excelが忙しい時の模擬"""
+        self.__rejects.extend([hresult] * count)
+
+    def call(self, book: FakeBook, name: str, args: list[object]) -> Any:
+        """ブックのマクロを実行する。VBAのエラーはCOMのエラーとして送出する"""
+        self.__checkalive(book.app)
+        if len(self.__rejects) > 0:
+            raise FakeComError(self.__rejects.pop(0), "Call was rejected by callee.")
+        if self.calldelay > 0:
+            time.sleep(self.calldelay)
+        self.callcount += 1
+        func = book.findmacro(name)
+        if func is None:
+            raise FakeComError(DISP_E_EXCEPTION, f"Cannot run the macro '{name}'.")
+        try:
+            if func in self.__byref:
+                return func(args)
+            return func(*args)
+        except FakeVBAError as e:
+            raise FakeComError(DISP_E_EXCEPTION, e.description, (0, "VBAProject", e.description, None, 0, e.number)) from e
+
+    def findfactory(self, book: FakeBook, code: str, macroname: str) -> Callable[..., object] | None:
+        """"Set 関数名 = New クラス名"だけの関数を、登録済みのクラスのインスタンスを返す関数として扱う。
+        引数でクラス名を受け取ってSelect Caseで振り分ける関数は、クラス名からインスタンスを返す関数として扱う
+        """
+        classes = self.__classes.get(book.name.lower(), {})
+        name = re.escape(macroname)
+        matched = re.search(rf"Function\s+{name}\(\).*?Set\s+{name}\s*=\s*New\s+(\w+)", code, re.S)
+        if matched is not None:
+            return classes.get(matched.group(1))
+        matched = re.search(rf"Function\s+{name}\(ByVal\s+\w+\s+As\s+String\)(.*?)End\s+Function", code, re.S)
+        if matched is None:
+            return None
+        cases = dict(re.findall(rf'Case\s+"(\w+)"\s+Set\s+{name}\s*=\s*New\s+(\w+)', matched.group(1)))
+
+        def dispatch(class_name: str) -> object:
+            if class_name not in cases or cases[class_name] not in classes:
+                raise FakeVBAError(429, "ActiveX component can't create object")
+            return classes[cases[class_name]]()
+
+        return dispatch
+
+    def __checkalive(self, app: FakeApp) -> None:
+        if not app.alive:
+            raise FakeComError(RPC_S_SERVER_UNAVAILABLE, "The RPC server is unavailable.")
+
+    def __bridgemacros(self, app: FakeApp) -> tuple[dict[str, Callable[..., Any]], dict[str, dict[str, Callable[..., Any]]]]:
+        """Bridgeブックに最初からあるマクロと、vbaunit_lib/bridgeのモジュールをImportすると使えるようになるマクロ"""
+
+        def callmacro(callobj: object, creation: bool, workbookname: str, macroname: str, params: list[object]) -> tuple[object, ...]:
+            callparams = list(params[:-1])  # 末尾はダミー引数
+            ret = None
+            errnumber = 0
+            errdescription = ""
+            try:
+                if callobj is None:
+                    book = app.findbook(workbookname)
+                    if book is None:
+                        raise FakeVBAError(1004, f"Cannot run the macro '{workbookname}!{macroname}'.")
+                    func = book.findmacro(macroname)
+                    if func is None:
+                        raise FakeVBAError(1004, f"Cannot run the macro '{workbookname}!{macroname}'.")
+                    ret = func(callparams) if func in self.__byref else func(*callparams)
+                else:
+                    ret = getattr(callobj, macroname)(*callparams)
+            except FakeVBAError as e:
+                errnumber = e.number
+                errdescription = e.description
+            except FakeComError:
+                raise  # Excelが落ちたらVBAのエラーにはならない
+            except Exception as e:
+                errnumber = 440
+                errdescription = str(e)
+            return (ret, *callparams, errnumber, errdescription)
+
+        def callmacrobatch(workbookname: str, calls: list[list[Any]]) -> tuple[tuple[object, ...], ...]:
+            return tuple(callmacro(callobj, creation, workbookname, macroname, params) for callobj, creation, macroname, params in calls)
+
+        def dimensionalarray(*bounds: int) -> object:
+            if len(bounds) == 0:
+                return None
+            length = bounds[1] - bounds[0] + 1
+            return tuple(dimensionalarray(*bounds[2:]) for _ in range(length))
+
+        bridgemacros: dict[str, Callable[..., Any]] = {
+            "CallMacro": callmacro,
+            "Free": lambda obj: None,
+            "GetRegexp": FakeRegExp,
+            "GetNewCollection": FakeCollection,
+            "GetNewDictionary": FakeDictionary,
+            "GetOneDimensionalArray": dimensionalarray,
+            "GetTwoDimensionalArray": dimensionalarray,
+            "GetThreeDimensionalArray": dimensionalarray,
+        }
+
+        def exportcollection(coll: FakeCollection) -> tuple[tuple[object], ...] | None:
+            if coll.Count() == 0:
+                return None
+            return tuple((item,) for item in coll)
+
+        def exportcollectionitems(coll: FakeCollection, keys: list[object]) -> tuple[tuple[bool, object], ...]:
+            items = coll.keyeditems()
+            return tuple((str(key) in items, items.get(str(key))) for key in keys)
+
+        def exportdictionary(dic: FakeDictionary) -> tuple[tuple[object, object], ...] | None:
+            if dic.Count == 0:
+                return None
+            return tuple((key, dic.Item(key)) for key in dic.Keys())
+
+        modulemacros: dict[str, dict[str, Callable[..., Any]]] = {
+            "BridgeBatch": {"CallMacroBatch": callmacrobatch},
+            "BridgeRelease": {"FreeObjects": lambda objs: None},
+            "BridgeExport": {
+                "ExportCollection": exportcollection,
+                "ExportCollectionItems": exportcollectionitems,
+                "ExportDictionary": exportdictionary,
+            },
+        }
+        return bridgemacros, modulemacros
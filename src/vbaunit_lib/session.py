@@ -0,0 +1,245 @@
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Callable
+from vbaunit_lib.backend import ExcelBackend
+
+
+PoolStats = namedtuple("PoolStats", ["launched", "reused", "reopened", "closed"])
+
+
+class ExcelSession:
+    """起動済みのExcel1つ分。Bridgeブックを開いたまま、テスト対象ブックを差し替えて使い回す"""
+
+    def __init__(self, backend: ExcelBackend, bridgepath: Path, visible: bool = False) -> None:
+        """Excelを起動してBridgeブックを開く。
+        backend: Excelの操作手段
+        bridgepath: Bridgeブックのパス
+        visible: Excelを表示するかどうか
+        """
+        self.__backend = backend
+        self.__app = backend.launch(visible)
+        self.__pid = backend.getpid(self.__app)
+        self.__bridgebook = None
+        self.__targetbook = None
+        self.__targetpath: Path | None = None
+        self.__dirty = False
+        self.__reusable = False
+        self.__reused = 0
+        self.__reopened = 0
+
+        try:
+            self.__bridgebook = backend.openbook(self.__app, bridgepath, bridge=True)
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def app(self) -> Any:
+        return self.__app
+
+    @property
+    def pid(self) -> int:
+        return self.__pid
+
+    @property
+    def bridgebook(self) -> Any:
+        return self.__bridgebook
+
+    @property
+    def targetbook(self) -> Any:
+        return self.__targetbook
+
+    @property
+    def targetpath(self) -> Path | None:
+        return self.__targetpath
+
+    @property
+    def alive(self) -> bool:
+        return self.__app is not None and self.__backend.isalive(self.__pid)
+
+    @property
+    def reused(self) -> int:
+        """開いたままのテスト対象ブックを使い回した回数"""
+        return self.__reused
+
+    @property
+    def reopened(self) -> int:
+        """起動済みのExcelでテスト対象ブックを開いた回数"""
+        return self.__reopened
+
+    def opentarget(self, excelpath: str | Path, reuse: bool = False) -> Any:
+        """テスト対象ブックを開く。
+        reuse: Trueなら、同じブックが変更されずに開いていればそのまま返す。
+            Savedが変わらないVBAのモジュール変数やStatic変数は前のテストのまま残るので、既定では毎回開き直す
+        """
+        targetpath = Path(excelpath).resolve()
+        if reuse and self.__targetbook is not None and self.__targetpath == targetpath and not self.__dirty:
+            self.__reused += 1
+            return self.__targetbook
+
+        self.closetarget()
+        self.__targetbook = self.__backend.openbook(self.__app, targetpath)
+        self.__targetpath = targetpath
+        self.__reusable = reuse
+        self.__reopened += 1
+        return self.__targetbook
+
+    def closetarget(self) -> None:
+        if self.__targetbook is not None:
+            try:
+                self.__backend.closebook(self.__targetbook)
+            finally:
+                self.__targetbook = None
+                self.__targetpath = None
+                self.__dirty = False
+
+    def markdirty(self) -> None:
+        """コードの注入などブックの状態を変えたので、次のテストでは開き直す"""
+        self.__dirty = True
+
+    def reset(self) -> None:
+        """テストの後始末。使い回さないか変更されたテスト対象ブックは閉じて、次のテストで開き直させる"""
+        if self.__targetbook is None:
+            return
+        if not self.__reusable or self.__dirty or self.__backend.isdirty(self.__targetbook):
+            self.closetarget()
+
+    def close(self) -> None:
+        """ブックを全て閉じてExcelを終了する"""
+        try:
+            self.closetarget()
+        except Exception as e:
+            print(f"close target book error: {e}")
+        if self.__bridgebook is not None:
+            try:
+                self.__backend.closebook(self.__bridgebook)
+            except Exception as e:
+                print(f"close bridge book error: {e}")
+            self.__bridgebook = None
+        if self.__app is not None:
+            try:
+                self.__backend.quit(self.__app)
+            except Exception as e:
+                print(f"quit Excel error: {e}")
+            self.__app = None
+            self.__backend.kill(self.__pid)
+
+
+class ExcelSessionPool:
+    """起動済みのExcelを保持して、テストケースをまたいで使い回す。ワーカー1つにつき1つ作る。"""
+
+    def __init__(
+        self,
+        backend: ExcelBackend,
+        bridgepath: Path,
+        visible: bool = False,
+        maxidle: int = 1,
+        onlaunch: Callable[[int], None] | None = None,
+    ) -> None:
+        """プールを作成する。Excelは最初のacquireで起動する。
+        backend: Excelの操作手段
+        bridgepath: Bridgeブックのパス
+        visible: Excelを表示するかどうか
+        maxidle: 待機させておくExcelの最大数
+        onlaunch: Excelを起動した時にプロセスIDを渡して呼ぶ関数
+        """
+        self.__backend = backend
+        self.__bridgepath = bridgepath
+        self.__visible = visible
+        self.__maxidle = maxidle
+        self.__onlaunch = onlaunch
+        self.__idle: list[ExcelSession] = []
+        self.__busy: list[ExcelSession] = []
+        self.__launched = 0
+        self.__closed = 0
+        self.__reused = 0
+        self.__reopened = 0
+        self.__started = False
+
+    @property
+    def backend(self) -> ExcelBackend:
+        return self.__backend
+
+    @property
+    def bridgepath(self) -> Path:
+        return self.__bridgepath
+
+    @property
+    def stats(self) -> PoolStats:
+        reused = self.__reused + sum(s.reused for s in self.__idle + self.__busy)
+        reopened = self.__reopened + sum(s.reopened for s in self.__idle + self.__busy)
+        return PoolStats(launched=self.__launched, reused=reused, reopened=reopened, closed=self.__closed)
+
+    @property
+    def pids(self) -> list[int]:
+        return [s.pid for s in self.__idle + self.__busy]
+
+    def start(self) -> None:
+        if not self.__started:
+            self.__backend.initialize()
+            self.__started = True
+
+    def acquire(self, excelpath: str | Path, reusebook: bool = False) -> ExcelSession:
+        """テスト対象ブックを開いたセッションを貸し出す。同じブックを開いている待機中のセッションを優先する。
+        reusebook: Trueなら、変更されずに開いたままのテスト対象ブックを開き直さずに使う
+        """
+        self.start()
+        targetpath = Path(excelpath).resolve()
+
+        session = None
+        for candidate in list(self.__idle):
+            if not candidate.alive:
+                self.__idle.remove(candidate)
+                self.__discard(candidate)
+                continue
+            if session is None or (candidate.targetpath == targetpath and session.targetpath != targetpath):
+                session = candidate
+        if session is not None:
+            self.__idle.remove(session)
+        else:
+            session = ExcelSession(self.__backend, self.__bridgepath, self.__visible)
+            self.__launched += 1
+            if self.__onlaunch is not None:
+                self.__onlaunch(session.pid)
+
+        try:
+            session.opentarget(targetpath, reuse=reusebook)
+        except Exception:
+            self.__discard(session)
+            raise
+        self.__busy.append(session)
+        return session
+
+    def release(self, session: ExcelSession, broken: bool = False) -> None:
+        """セッションを返却する。壊れていれば捨て、そうでなければ状態を戻して待機させる"""
+        if session in self.__busy:
+            self.__busy.remove(session)
+        if broken or not session.alive:
+            self.__discard(session)
+            return
+        try:
+            session.reset()
+        except Exception as e:
+            print(f"reset session error: {e}")
+            self.__discard(session)
+            return
+        if len(self.__idle) >= self.__maxidle:
+            self.__discard(session)
+            return
+        self.__idle.append(session)
+
+    def shutdown(self) -> None:
+        """全てのExcelを終了する"""
+        for session in self.__idle + self.__busy:
+            self.__discard(session)
+        self.__idle.clear()
+        self.__busy.clear()
+        if self.__started:
+            self.__backend.uninitialize()
+            self.__started = False
+
+    def __discard(self, session: ExcelSession) -> None:
+        self.__reused += session.reused
+        self.__reopened += session.reopened
+        self.__closed += 1
+        session.close()
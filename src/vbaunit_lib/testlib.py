@@ -1,16 +1,23 @@
+from collections import namedtuple
 from collections.abc import Generator
 import inspect
-from typing import overload
-import psutil
-import gc
+from typing import Any, overload
 from functools import wraps
 from pathlib import Path
 from contextlib import contextmanager
-from win32com.client import VARIANT
-import pythoncom
-import xlwings as xl
+from vbaunit_lib.backend import ExcelBackend, XlwingsBackend
+from vbaunit_lib.comregistry import ComObjectLeak, ComObjectRegistry, formatleaks
+from vbaunit_lib.session import ExcelSession, ExcelSessionPool
 
 __globalbridgepath = Path(__file__).parent
+__globalsessionpool: ExcelSessionPool | None = None
+__globalreusebook = False
+__globalbackend: ExcelBackend = XlwingsBackend()
+__globalactivetestlib = None
+__globalcomleaks: list[ComObjectLeak] = []
+__globalmacrocalls: set[str] = set()
+
+ComponentEntry = namedtuple("ComponentEntry", ["component", "type", "lines"])
 
 
 def expect(requirement: bool, msg: str = "") -> None:
@@ -51,7 +58,7 @@ def expect_equals(expectation: object, actual: object, msg: str = "") -> None:
 
 def expect_collection(expectation: object, collectionobj: object, key: str, msg: str = "") -> None:
     """Collectionオブジェクトのキーに対応する期待値を検証する関数。keyから値を取得してexpectationと比較する。"""
-    variantkey = VARIANT(pythoncom.VT_BSTR, key)
+    variantkey = getglobalbackend().bstr(key)
     valueofkey = collectionobj.Item(variantkey)  # type: ignore
     if valueofkey == expectation:
         return
@@ -80,14 +87,14 @@ def expect_collection_list(expectation: list[object], collectionobj: object, msg
     # その行のソースコードを取得（存在する場合）
     src_line = info.code_context[0].strip() if info.code_context else "<source unavailable>"
 
-    if collectionobj.Count() != len(expectation):  # type: ignore
+    actual = collection_to_list(collectionobj)
+    if len(actual) != len(expectation):
         raise AssertionError(
-            f"Check failed: collection count {collectionobj.Count()} != expectation count {len(expectation)}"  # type: ignore
+            f"Check failed: collection count {len(actual)} != expectation count {len(expectation)}"
             + f" at {info.filename}:{info.lineno}\n  -> {src_line}"
             + (f"\n  msg: {msg}" if msg else "")
         )
-    for i in range(1, collectionobj.Count() + 1):  # type: ignore
-        valueofkey = collectionobj.Item(i)  # type: ignore
+    for i, valueofkey in enumerate(actual, start=1):
         if valueofkey != expectation[i - 1]:
             raise AssertionError(
                 f"Check failed: collection item {i} value {valueofkey} != expectation value {expectation[i - 1]}"  # type: ignore
@@ -108,14 +115,21 @@ def expect_collection_dict(expectation: dict[str, object], collectionobj: object
     # その行のソースコードを取得（存在する場合）
     src_line = info.code_context[0].strip() if info.code_context else "<source unavailable>"
 
-    if collectionobj.Count() != len(expectation):  # type: ignore
+    count = collectionobj.Count()  # type: ignore
+    if count != len(expectation):
         raise AssertionError(
-            f"Check failed: collection count {collectionobj.Count()} != expectation count {len(expectation)}"  # type: ignore
+            f"Check failed: collection count {count} != expectation count {len(expectation)}"
             + f" at {info.filename}:{info.lineno}\n  -> {src_line}"
             + (f"\n  msg: {msg}" if msg else "")
         )
-    for key in expectation.keys():
-        valueofkey = collectionobj.Item(key)  # type: ignore
+    keys = list(expectation.keys())
+    for key, (found, valueofkey) in zip(keys, collection_items(collectionobj, keys)):
+        if not found:
+            raise AssertionError(
+                f"Check failed: collection item {key} not found"
+                + f" at {info.filename}:{info.lineno}\n  -> {src_line}"
+                + (f"\n  msg: {msg}" if msg else "")
+            )
         if valueofkey != expectation[key]:
             raise AssertionError(
                 f"Check failed: collection item {key} value {valueofkey} != expectation value {expectation[key]}"  # type: ignore
@@ -136,14 +150,15 @@ def expect_dictionary(expectation: dict[object, object], dictionaryobj: object,
     # その行のソースコードを取得（存在する場合）
     src_line = info.code_context[0].strip() if info.code_context else "<source unavailable>"
 
-    if dictionaryobj.Count != len(expectation):  # type: ignore
+    actual = dictionary_to_dict(dictionaryobj)
+    if len(actual) != len(expectation):
         raise AssertionError(
-            f"Check failed: dictionary count {dictionaryobj.Count} != expectation count {len(expectation)}"  # type: ignore
+            f"Check failed: dictionary count {len(actual)} != expectation count {len(expectation)}"
             + f" at {info.filename}:{info.lineno}\n  -> {src_line}"
             + (f"\n  msg: {msg}" if msg else "")
         )
     for key in expectation.keys():
-        valueofkey = dictionaryobj.Item(key)  # type: ignore
+        valueofkey = actual.get(key)
         if valueofkey != expectation[key]:
             raise AssertionError(
                 f"Check failed: dictionary item {key} value {valueofkey} != expectation value {expectation[key]}"  # type: ignore
@@ -154,6 +169,43 @@ def expect_dictionary(expectation: dict[object, object], dictionaryobj: object,
     return
 
 
+def collection_to_list(collectionobj: object) -> list[object]:
+    """Collectionオブジェクトの全ての値をリストにする。bridgeが使えれば1回の呼び出しで取り出す。"""
+    testlib = getactivetestlib()
+    if testlib is not None:
+        values = testlib.exportcollection(collectionobj)
+        if values is not None:
+            return values
+    return [collectionobj.Item(i) for i in range(1, collectionobj.Count() + 1)]  # type: ignore
+
+
+def collection_items(collectionobj: object, keys: list[str]) -> list[tuple[bool, object]]:
+    """Collectionオブジェクトからキーの値をまとめて取り出す。キー毎に(見つかったか, 値)を返す。"""
+    testlib = getactivetestlib()
+    if testlib is not None:
+        values = testlib.exportcollectionitems(collectionobj, keys)
+        if values is not None:
+            return values
+    backend = getglobalbackend()
+    items: list[tuple[bool, object]] = []
+    for key in keys:
+        try:
+            items.append((True, collectionobj.Item(backend.bstr(key))))  # type: ignore
+        except backend.comerrors():
+            items.append((False, None))
+    return items
+
+
+def dictionary_to_dict(dictionaryobj: object) -> dict[object, object]:
+    """Dictionaryオブジェクトの全てのキーと値を辞書にする。bridgeが使えれば1回の呼び出しで取り出す。"""
+    testlib = getactivetestlib()
+    if testlib is not None:
+        values = testlib.exportdictionary(dictionaryobj)
+        if values is not None:
+            return values
+    return dict(zip(dictionaryobj.Keys(), dictionaryobj.Items()))  # type: ignore
+
+
 def description(subject: str):
     """テストケースの説明を付与するデコレーター。"""
 
@@ -168,6 +220,20 @@ def description(subject: str):
     return decorator
 
 
+def timeout(seconds: float):
+    """テストケースの制限時間（秒）を付与するデコレーター。全体の既定の制限時間より優先する。"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return func(*args, **kwargs)
+
+        wrapper._timeout = seconds  # type: ignore
+        return wrapper
+
+    return decorator
+
+
 def ignore(func):
     """無視したいテストケースを識別するデコレーター。"""
 
@@ -189,39 +255,143 @@ def getglobalbridgepath() -> Path:
     return __globalbridgepath
 
 
+def setglobalbackend(backend: ExcelBackend) -> None:
+    """Excelの操作手段を設定する。既定はxlwings"""
+    global __globalbackend
+    __globalbackend = backend
+
+
+def getglobalbackend() -> ExcelBackend:
+    global __globalbackend
+    return __globalbackend
+
+
+def setglobalsessionpool(pool: ExcelSessionPool | None) -> None:
+    """runapp()で起動済みのExcelを使い回すためのプールを設定する。Noneなら毎回Excelを起動する。"""
+    global __globalsessionpool
+    __globalsessionpool = pool
+
+
+def getglobalsessionpool() -> ExcelSessionPool | None:
+    global __globalsessionpool
+    return __globalsessionpool
+
+
+def setglobalreusebook(reusebook: bool) -> None:
+    """プールのExcelで、開いたままのテスト対象ブックを使い回すかどうか。ランナーがテストケース毎に設定する"""
+    global __globalreusebook
+    __globalreusebook = reusebook
+
+
+def getglobalreusebook() -> bool:
+    global __globalreusebook
+    return __globalreusebook
+
+
+def setactivetestlib(testlib: "VBAUnitTestLib | None") -> None:
+    """collection_to_listなどが使うbridgeを設定する。openexcelで設定し、closeexcelで外す"""
+    global __globalactivetestlib
+    __globalactivetestlib = testlib
+
+
+def getactivetestlib() -> "VBAUnitTestLib | None":
+    global __globalactivetestlib
+    return __globalactivetestlib
+
+
+def reportcomleaks(leaks: list[ComObjectLeak]) -> None:
+    """freeobjsの時に残っていたオブジェクトを記録する"""
+    global __globalcomleaks
+    __globalcomleaks.extend(leaks)
+    print(f"[WARN]{formatleaks(leaks)}")
+
+
+def takecomleaks() -> list[ComObjectLeak]:
+    """記録されたリークを取り出して空にする。テストケース毎にランナーが呼ぶ"""
+    global __globalcomleaks
+    leaks = list(__globalcomleaks)
+    __globalcomleaks.clear()
+    return leaks
+
+
+def recordmacrocall(bookname: str, macro: str) -> None:
+    """テスト対象のブックで使ったマクロを"ブック名!マクロ名"で記録する。
+    クラスのインスタンス生成は"New クラス名"、バックドアを書き込んだモジュールは"モジュール名.*"
+    """
+    global __globalmacrocalls
+    __globalmacrocalls.add(f"{bookname}!{macro}")
+
+
+def takemacrocalls() -> list[str]:
+    """記録したマクロを取り出して空にする。テストケース毎にランナーが呼ぶ"""
+    global __globalmacrocalls
+    calls = sorted(__globalmacrocalls)
+    __globalmacrocalls.clear()
+    return calls
+
+
 class VBAUnitTestLib:
     __VBEXT_CT_STDMODULE = 1  # 標準モジュール
     __VBEXT_CT_CLASSMODULE = 2  # クラスモジュール
+    __MAX_MACRO_ARGS = 16
+    __BRIDGE_MODULES = Path(__file__).parent.joinpath("bridge")  # 必要になった時にbridgeへImportするモジュール
+    __FACTORY_FUNCTION = "VBAUnitNewInstance"  # create_newinstanceがテスト対象のブックに作る関数
 
-    def __init__(self, __globalbridgepath: Path, withapp: bool = True, visible: bool = False) -> None:
+    def __init__(self, __globalbridgepath: Path, withapp: bool = True, visible: bool = False, backend: ExcelBackend | None = None) -> None:
         self.__bridgepath = __globalbridgepath
         self.__withapp = withapp
         self.__visible = visible
+        self.__backend = backend if backend is not None else getglobalbackend()
 
         if withapp:
-            self.__app = xl.App(visible=visible)
+            self.__app = self.__backend.launch(visible)
         else:
             self.__app = None
         self.__book = None
         self.__internalbook = None
 
-        self.__comobjects: list[object] = []
+        self.__comobjects = ComObjectRegistry()
 
         self.__pid = -1
 
+        self.__pool: ExcelSessionPool | None = None
+        self.__session: ExcelSession | None = None
+
+        self.__bridgemodules: dict[str, bool] = {}
+
+        # create_newinstanceの生成用モジュール。closeexcelで取り除く
+        self.__factorycomponent: Any = None
+        self.__factorymacro: Any = None
+        self.__factoryclasses: list[str] = []
+
+        # テスト対象のブックのVBComponentの索引と、まだ書き込んでいないバックドア。closeexcelで捨てる
+        self.__componentindex: dict[str, ComponentEntry] | None = None
+        self.__pendingbackdoors: dict[str, list[str]] = {}
+
     @property
     def appready(self) -> bool:
         return self.__app is not None
 
+    @property
+    def pid(self) -> int:
+        """使っているExcelのプロセスID。開いていなければ-1"""
+        return self.__pid
+
+    def abort(self) -> None:
+        """止まったExcelのプロセスを落とす。テストの時間切れの時にwatchdogのスレッドから呼ぶ"""
+        if self.__pid > 0:
+            print(f"[WARN]kill Excel process {self.__pid}")
+            self.__backend.kill(self.__pid)
+
     @contextmanager
-    def runapp(self, excelpath: str) -> Generator[xl.Book, None, None]:
+    def runapp(self, excelpath: str) -> Generator[Any, None, None]:
         try:
-            pythoncom.CoInitialize()
+            self.__backend.initialize()
             book = self.openexcel(excelpath)
             yield book
         finally:
             self.exitapp()
-            pythoncom.CoUninitialize()
+            self.__backend.uninitialize()
 
     def exitapp(self) -> None:
         try:
@@ -232,59 +402,88 @@ class VBAUnitTestLib:
 
     def __closeapp(self) -> None:
         if self.__app is not None:
-            self.__app.quit()
+            self.__backend.quit(self.__app)
             self.__app = None
             self.__killserver()
 
     def __killserver(self) -> None:
         if self.__pid > 0:
             try:
-                p = psutil.Process(self.__pid)
-            except psutil.NoSuchProcess:
-                self.__pid = -1
-                return
-            try:
-                p.terminate()
-                p.wait(3)
-            except Exception as e:
-                print(f"Could not kill Excel process {self.__pid}: {e}")
+                self.__backend.kill(self.__pid)
             finally:
                 self.__pid = -1
 
-    def openexcel(self, excelpath: str) -> xl.Book:
+    def openexcel(self, excelpath: str) -> Any:
         # Excelファイルを開く処理を実装
-        if self.__app is None:
-            self.__app = xl.App(visible=self.__visible)
-        self.__pid = self.__app.pid
+        pool = getglobalsessionpool()
+        if pool is not None and self.__app is None:
+            # 起動済みのExcelを借りる
+            self.__pool = pool
+            self.__backend = pool.backend
+            self.__session = pool.acquire(excelpath, reusebook=getglobalreusebook())
+            self.__app = self.__session.app
+            self.__pid = self.__session.pid
+            self.__book = self.__session.bridgebook
+            self.__internalbook = self.__session.targetbook
+            setactivetestlib(self)
+            return self.__internalbook
 
-        self.__app.display_alerts = False
-        # self.__app.screen_updating = False
+        if self.__app is None:
+            self.__app = self.__backend.launch(self.__visible)
+        self.__pid = self.__backend.getpid(self.__app)
 
-        self.__book = self.__app.books.open(self.__bridgepath, update_links=True, ignore_read_only_recommended=True)
+        self.__book = self.__backend.openbook(self.__app, self.__bridgepath, bridge=True)
         # 開けなかったらErrorが出ているはずだから独自にthrowしない。
         if self.__book:
             excelfullpath = Path(excelpath).resolve()
             # self.__book.api.VBProject.References.AddFromFile(excelfullpath)
-            self.__internalbook = self.__app.books.open(excelfullpath)
+            self.__internalbook = self.__backend.openbook(self.__app, excelfullpath)
+            setactivetestlib(self)
 
         return self.__internalbook
 
     def closeexcel(self) -> None:
+        if getactivetestlib() is self:
+            setactivetestlib(None)
+        if len(self.__pendingbackdoors) > 0:
+            print(f"[WARN]backdoors not applied: {', '.join(self.__pendingbackdoors)}")
+        self.__pendingbackdoors.clear()
+        self.__componentindex = None
+        if self.__session is not None:
+            # 借りたExcelは終了せずにプールへ返す
+            self.freeobjs()
+            self.__removefactory()
+            session = self.__session
+            pool = self.__pool
+            self.__session = None
+            self.__pool = None
+            self.__internalbook = None
+            self.__book = None
+            self.__app = None
+            self.__pid = -1
+            self.__bridgemodules.clear()
+            if pool is not None:
+                pool.release(session)
+            return
+
+        # ブックを閉じる前にbridgeのオブジェクトを解放する
+        self.freeobjs()
+        self.__removefactory()
         if self.__internalbook is not None:
-            self.__internalbook.close()
+            self.__backend.closebook(self.__internalbook)
             self.__internalbook = None
         if self.__book is not None:
-            self.__book.close()
+            self.__backend.closebook(self.__book)
             self.__book = None
-            self.freeobjs()
+            self.__bridgemodules.clear()
         if self.__withapp:
             self.__closeapp()
 
     def getregexobj(self) -> object:
         """bridgeからRegexを取得"""
         if self.__book:
-            regexobj = self.__app.api.Run(self.__getbridgemacroname("GetRegexp"))
-            self.__comobjects.append(regexobj)
+            regexobj = self.__backend.run(self.__app, self.__getbridgemacroname("GetRegexp"))
+            self.__comobjects.register(regexobj, "GetRegexp")
             return regexobj
         else:
             return None
@@ -292,8 +491,8 @@ class VBAUnitTestLib:
     def getcollectionobj(self) -> object:
         """bridgeからCollectionを取得"""
         if self.__book:
-            collectionobj = self.__app.api.Run(self.__getbridgemacroname("GetNewCollection"))
-            self.__comobjects.append(collectionobj)
+            collectionobj = self.__backend.run(self.__app, self.__getbridgemacroname("GetNewCollection"))
+            self.__comobjects.register(collectionobj, "GetNewCollection")
             return collectionobj
         else:
             return None
@@ -301,12 +500,40 @@ class VBAUnitTestLib:
     def getdictionaryobj(self) -> object:
         """bridgeからDictionaryを取得"""
         if self.__book:
-            dictionaryobj = self.__app.api.Run(self.__getbridgemacroname("GetNewDictionary"))
-            self.__comobjects.append(dictionaryobj)
+            dictionaryobj = self.__backend.run(self.__app, self.__getbridgemacroname("GetNewDictionary"))
+            self.__comobjects.register(dictionaryobj, "GetNewDictionary")
             return dictionaryobj
         else:
             return None
 
+    def exportcollection(self, collectionobj: object) -> list[object] | None:
+        """bridgeでCollectionの全ての値を1回で取り出す。bridgeが使えなければNone"""
+        if not self.__book or not self.__ensurebridgemodule("BridgeExport"):
+            return None
+        values = self.__backend.run(self.__app, self.__getbridgemacroname("ExportCollection"), collectionobj)
+        if values is None:
+            return []
+        return [row[0] for row in values]
+
+    def exportcollectionitems(self, collectionobj: object, keys: list[str]) -> list[tuple[bool, object]] | None:
+        """bridgeでCollectionのキーの値を1回で取り出す。キー毎に(見つかったか, 値)。bridgeが使えなければNone"""
+        if not self.__book or not self.__ensurebridgemodule("BridgeExport"):
+            return None
+        if len(keys) == 0:
+            return []
+        vbkeys = [str(key) for key in keys]
+        values = self.__backend.run(self.__app, self.__getbridgemacroname("ExportCollectionItems"), collectionobj, vbkeys)
+        return [(bool(row[0]), row[1]) for row in values]
+
+    def exportdictionary(self, dictionaryobj: object) -> dict[object, object] | None:
+        """bridgeでDictionaryの全てのキーと値を1回で取り出す。bridgeが使えなければNone"""
+        if not self.__book or not self.__ensurebridgemodule("BridgeExport"):
+            return None
+        values = self.__backend.run(self.__app, self.__getbridgemacroname("ExportDictionary"), dictionaryobj)
+        if values is None:
+            return {}
+        return {row[0]: row[1] for row in values}
+
     @overload
     def getdynamicarray(self, low1: int, high1: int) -> list[object]: ...
 
@@ -321,11 +548,11 @@ class VBAUnitTestLib:
         if self.__book:
             if low3 == 0 and high3 == 0:
                 if low2 == 0 and high2 == 0:
-                    dynamicarray = self.__app.api.Run(self.__getbridgemacroname("GetOneDimensionalArray"), low1, high1)
+                    dynamicarray = self.__backend.run(self.__app, self.__getbridgemacroname("GetOneDimensionalArray"), low1, high1)
                 else:
-                    dynamicarray = self.__app.api.Run(self.__getbridgemacroname("GetTwoDimensionalArray"), low1, high1, low2, high2)
+                    dynamicarray = self.__backend.run(self.__app, self.__getbridgemacroname("GetTwoDimensionalArray"), low1, high1, low2, high2)
             else:
-                dynamicarray = self.__app.api.Run(self.__getbridgemacroname("GetThreeDimensionalArray"), low1, high1, low2, high2, low3, high3)
+                dynamicarray = self.__backend.run(self.__app, self.__getbridgemacroname("GetThreeDimensionalArray"), low1, high1, low2, high2, low3, high3)
             return dynamicarray
         else:
             return None
@@ -334,16 +561,28 @@ class VBAUnitTestLib:
         """bridgeから取得したオブジェクトを解放"""
         if self.__book:
             if obj:
-                self.__app.api.Run(self.__getbridgemacroname("Free"), obj)
-            if obj in self.__comobjects:
-                self.__comobjects.remove(obj)
+                self.__backend.run(self.__app, self.__getbridgemacroname("Free"), obj)
+            self.__comobjects.unregister(obj)
             obj = None
 
     def freeobjs(self) -> None:
-        """bridgeから取得した全てのオブジェクトを解放"""
+        """bridgeから取得した全てのオブジェクトを解放。残っていたものはリークとして記録する"""
         if self.__book:
-            freemacro = self.__book.macro("Free")
-            for obj in self.__comobjects:
+            if len(self.__comobjects) == 0:
+                return
+            reportcomleaks(self.__comobjects.leaks())
+            objs = self.__comobjects.objects()
+            self.__comobjects.clear()
+            if self.__ensurebridgemodule("BridgeRelease"):
+                # bridgeへの1回の呼び出しでまとめて解放する
+                try:
+                    self.__backend.macro(self.__book, "FreeObjects")(objs)
+                    return
+                except Exception as e:
+                    print(f"freeobjs error: {e}")
+                    print("  free objects one by one")
+            freemacro = self.__backend.macro(self.__book, "Free")
+            for obj in objs:
                 # 全削除の時は既に解放済みかもしれない
                 try:
                     freemacro(obj)
@@ -351,8 +590,6 @@ class VBAUnitTestLib:
                     print(f"freeobjs error: {e}")
                     print("  skip this object")
                 obj = None
-            self.__comobjects.clear()
-            gc.collect()
 
     def callmacro(self, obj: object, macro_name: str, *args) -> list[object]:
         return self.__callmacro(obj, False, macro_name, *args)
@@ -360,18 +597,54 @@ class VBAUnitTestLib:
     def callcreativemacro(self, obj: object, macro_name: str, *args) -> list[object]:
         res = self.__callmacro(obj, True, macro_name, *args)
         if res[0]:
-            self.__comobjects.append(res[0])
+            self.__comobjects.register(res[0], macro_name)
         return res
 
-    def registercomobject(self, obj: object):
+    def callmacro_batch(self, calls: list[tuple[object, str, tuple | list]]) -> list[list[object]]:
+        """複数のマクロ呼び出しをbridgeへの1回の呼び出しでまとめて実行する。
+        calls: (オブジェクト, マクロ名, 引数)のリスト。オブジェクトとマクロ名はcallmacroと同じ
+        戻り値: callmacroと同じ形の結果のリスト。エラー番号と説明は呼び出し毎に入っている
+        """
+        if not self.__book:
+            print("callmacro_batch: no book has opened")
+            return [[None] for _ in calls]
+        for _, macro_name, args in calls:
+            if len(args) > VBAUnitTestLib.__MAX_MACRO_ARGS:
+                print(f"callmacro_batch: too many macro arguments {len(args)} for {macro_name}. Must be <= 16.")
+                return [[None] for _ in calls]
+        if len(calls) == 0:
+            return []
+        for _, macro_name, _ in calls:
+            recordmacrocall(self.__internalbook.name, macro_name)
+        self.apply_backdoors()
+        if not self.__ensurebridgemodule("BridgeBatch"):
+            # bridgeにモジュールを追加できなければ1つずつ呼び出す
+            return [self.callmacro(obj, macro_name, *args) for obj, macro_name, args in calls]
+
+        vbcalls = []
+        for obj, macro_name, args in calls:
+            vbargs = [a for a in args]
+            vbargs.append(0)  # callmacroと同じく末尾にダミー引数を1つ作る
+            vbcalls.append([obj, False, macro_name, vbargs])
+        batchmacro = self.__backend.macro(self.__book, "CallMacroBatch")
+        results = [res for res in batchmacro(self.__internalbook.name, vbcalls)]
+        for res in results:
+            if res[len(res) - 2] != 0:
+                print(f"Internal Error: ({res[len(res) - 2]}) {res[len(res) - 1]}")
+        return results
+
+    def registercomobject(self, obj: object, macro: str = ""):
+        """freeobjsで解放するオブジェクトとして登録する。macroはリークの報告に使う作成元の名前"""
         if obj:
-            self.__comobjects.append(obj)
+            self.__comobjects.register(obj, macro)
 
     def __callmacro(self, obj: object, creation: bool, macro_name: str, *args) -> list[object]:
         """bridgeからマクロを呼び出す。"""
         if self.__book:
-            if len(args) <= 16:
-                vbamacro = self.__book.macro("CallMacro")
+            if len(args) <= VBAUnitTestLib.__MAX_MACRO_ARGS:
+                recordmacrocall(self.__internalbook.name, macro_name)
+                self.apply_backdoors()
+                vbamacro = self.__backend.macro(self.__book, "CallMacro")
                 vbargs = [a for a in args]
                 vbargs.append(0)  # listだけの引数だとインデックスエラーになることへの対策として、末尾にダミー引数を1つ作る
                 res: list[object] = vbamacro(obj, creation, self.__internalbook.name, macro_name, vbargs)
@@ -386,47 +659,124 @@ class VBAUnitTestLib:
             print("callmacro: no book has opened")
             return [None]
 
+    def __ensurebridgemodule(self, modulename: str) -> bool:
+        """vbaunit_lib/bridgeにあるモジュールが開いているbridgeに無ければImportする。使えるならTrue"""
+        if modulename in self.__bridgemodules:
+            return self.__bridgemodules[modulename]
+        ready = False
+        try:
+            components = self.__backend.vbcomponents(self.__book)
+            ready = any(comp.Name == modulename for comp in components)
+            if not ready:
+                components.Import(str(VBAUnitTestLib.__BRIDGE_MODULES.joinpath(f"{modulename}.bas")))
+                ready = True
+        except Exception as e:
+            print(f"could not import bridge module {modulename}: {e}")
+        self.__bridgemodules[modulename] = ready
+        return ready
+
     def __getbridgemacroname(self, macro: str) -> str:
         return "VBAUnitCOMBridge.xlsm!" + macro
 
     def create_newinstance(self, class_name: str) -> object:
-        """bridgeから指定されたClassモジュールのインスタンスを取得"""
+        """bridgeから指定されたClassモジュールのインスタンスを取得。
+        生成用の標準モジュールはセッションに1つだけ作るので、作ったことのあるクラスは1回の呼び出しで済む
+        """
         if self.__book:
-            temp_component = self.__internalbook.api.VBProject.VBComponents.Add(1)  # 1:標準モジュール
-
-            tempcode = (
-                f"Public Function GetInstanceOf__{class_name}() As Variant\n"
-                + f"    Set GetInstanceOf__{class_name} = New {class_name}\n"
-                + "End Function\n"
-            )
-            temp_component.CodeModule.AddFromString(tempcode)
-            create_modulename = f"{temp_component.Name}.GetInstanceOf__{class_name}"
-            createmacro = self.__internalbook.macro(create_modulename)
-            instance = createmacro()
-            self.registercomobject(instance)
-
-            self.__internalbook.api.VBProject.VBComponents.Remove(temp_component)
-
+            recordmacrocall(self.__internalbook.name, f"New {class_name}")
+            self.apply_backdoors()
+            if class_name not in self.__factoryclasses:
+                self.__addfactoryclass(class_name)
+            if self.__factorymacro is None:
+                factoryname = f"{self.__factorycomponent.Name}.{VBAUnitTestLib.__FACTORY_FUNCTION}"
+                self.__factorymacro = self.__backend.macro(self.__internalbook, factoryname)
+            instance = self.__factorymacro(class_name)
+            self.registercomobject(instance, f"New {class_name}")
             return instance
         else:
             return None
 
-    def create_backdoor(self, module_name: str, code: str) -> None:
-        """指定された標準モジュールまたはクラスモジュールに関数を追加する"""
-        if self.__book:
-            target_component = None
-            for comp in self.__internalbook.api.VBProject.VBComponents:
-                if comp.Name == module_name and comp.Type in (VBAUnitTestLib.__VBEXT_CT_STDMODULE, VBAUnitTestLib.__VBEXT_CT_CLASSMODULE):
-                    target_component = comp
-                    break
-            if target_component is None:
-                print(f"create_backdoor: module {module_name} not found")
-                return
+    def __addfactoryclass(self, class_name: str) -> None:
+        """生成用のモジュールのSelect Caseにクラスを足して書き直す。モジュールが無ければ作る"""
+        if self.__factorycomponent is None:
+            self.__factorycomponent = self.__backend.vbcomponents(self.__internalbook).Add(VBAUnitTestLib.__VBEXT_CT_STDMODULE)
+        self.__factoryclasses.append(class_name)
+
+        function = VBAUnitTestLib.__FACTORY_FUNCTION
+        factorycode = f"Public Function {function}(ByVal className As String) As Variant\n    Select Case className\n"
+        for name in self.__factoryclasses:
+            factorycode += f'        Case "{name}"\n            Set {function} = New {name}\n'
+        factorycode += "    End Select\nEnd Function\n"
+
+        code_module = self.__factorycomponent.CodeModule
+        if code_module.CountOfLines > 0:
+            code_module.DeleteLines(1, code_module.CountOfLines)
+        code_module.AddFromString(factorycode)
+        self.__markdirty()
+
+    def __removefactory(self) -> None:
+        """生成用のモジュールをブックから取り除く"""
+        component = self.__factorycomponent
+        self.__factorycomponent = None
+        self.__factorymacro = None
+        self.__factoryclasses.clear()
+        if component is None or self.__internalbook is None:
+            return
+        try:
+            self.__backend.vbcomponents(self.__internalbook).Remove(component)
+        except Exception as e:
+            print(f"[WARN]could not remove factory module: {e}")
 
-            code_module = target_component.CodeModule
-            lastline = code_module.CountOfLines
+    def create_backdoor(self, module_name: str, code: str) -> None:
+        """指定された標準モジュールまたはクラスモジュールに関数を追加する。
+        queue_backdoorで溜めていたものも一緒に書き込む
+        """
+        if self.queue_backdoor(module_name, code):
+            self.apply_backdoors()
+
+    def queue_backdoor(self, module_name: str, code: str) -> bool:
+        """指定された標準モジュールまたはクラスモジュールに追加する関数を溜めておく。
+        溜めたものはモジュール毎にまとめて、次のマクロ呼び出しの前かapply_backdoorsで書き込む。
+        モジュールが無ければFalse
+        """
+        if not self.__book:
+            return False
+        entry = self.__getcomponentindex().get(module_name)
+        if entry is None or entry.type not in (VBAUnitTestLib.__VBEXT_CT_STDMODULE, VBAUnitTestLib.__VBEXT_CT_CLASSMODULE):
+            print(f"create_backdoor: module {module_name} not found")
+            return False
+        self.__pendingbackdoors.setdefault(module_name, []).append(code)
+        recordmacrocall(self.__internalbook.name, f"{module_name}.*")
+        return True
+
+    def apply_backdoors(self) -> None:
+        """溜めておいた関数をモジュール毎に1回で書き込む"""
+        if len(self.__pendingbackdoors) == 0 or not self.__book:
+            return
+        index = self.__getcomponentindex()
+        for module_name, snippets in self.__pendingbackdoors.items():
+            entry = index[module_name]
+            code = "".join(snippet if snippet.endswith("\n") else snippet + "\n" for snippet in snippets)
+            code_module = entry.component.CodeModule
+            lastline = entry.lines if entry.lines is not None else code_module.CountOfLines
             code_module.InsertLines(lastline + 1, code)
+            index[module_name] = entry._replace(lines=lastline + len(code.splitlines()))
+        self.__pendingbackdoors.clear()
+        self.__markdirty()
+
+    def __getcomponentindex(self) -> dict[str, ComponentEntry]:
+        """テスト対象のブックのVBComponentの索引。セッションで1回だけ全体を読む。行数は必要になった時に読む"""
+        if self.__componentindex is None:
+            self.__componentindex = {}
+            for comp in self.__backend.vbcomponents(self.__internalbook):
+                self.__componentindex[comp.Name] = ComponentEntry(component=comp, type=comp.Type, lines=None)
+        return self.__componentindex
+
+    def __markdirty(self) -> None:
+        """VBProjectを書き換えたので、プールに返したブックは次のテストで開き直させる"""
+        if self.__session is not None:
+            self.__session.markdirty()
 
 
 def gettestlib(withapp: bool = False, visible: bool = False) -> VBAUnitTestLib:
-    return VBAUnitTestLib(__globalbridgepath, withapp=withapp, visible=visible)
+    return VBAUnitTestLib(__globalbridgepath, withapp=withapp, visible=visible, backend=__globalbackend)
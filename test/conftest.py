@@ -3,3 +3,29 @@ from pathlib import Path
 
 srcdir = Path(__file__).parent.parent.joinpath("src")
 sys.path.append(str(srcdir))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def makescenario(tmp_path):
+    """シナリオファイルを作る。groupsはシート名と(テストID, 説明, モジュール, 実行)のリスト"""
+    from openpyxl import Workbook
+
+    def make(groups: dict[str, list[tuple[str, str, str, bool]]], name: str = "scenario.xlsx") -> Path:
+        book = Workbook()
+        book.remove(book.active)
+        for groupname, modules in groups.items():
+            sheet = book.create_sheet(groupname)
+            for col, header in enumerate(["テストID", "説明", "モジュール", "実行", "結果"], start=2):
+                sheet.cell(2, col, header)
+            for row, (testid, subject, module, run) in enumerate(modules, start=3):
+                sheet.cell(row, 2, testid)
+                sheet.cell(row, 3, subject)
+                sheet.cell(row, 4, module)
+                sheet.cell(row, 5, "○" if run else "×")
+        scenariopath = tmp_path.joinpath(name)
+        book.save(scenariopath)
+        return scenariopath
+
+    return make
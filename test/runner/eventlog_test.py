@@ -0,0 +1,60 @@
+import json
+import time
+from runner.eventlog import EVENT_COM_RETRY, EVENT_TEST_END, EVENT_TEST_START, EventLog, readevents, renderevent
+
+
+def test_eventlog_writes_in_order(tmp_path):
+    path = tmp_path.joinpath("events.jsonl")
+    events = EventLog(path, "run1", flushinterval=60, echo=False)
+    for i in range(100):
+        events.emit(EVENT_COM_RETRY, attempt=i)
+    events.close()
+
+    records = readevents(path)
+    assert [r["attempt"] for r in records] == list(range(100))
+    assert [r["seq"] for r in records] == list(range(1, 101))
+    assert all(r["run"] == "run1" and r["event"] == EVENT_COM_RETRY for r in records)
+    monos = [r["mono"] for r in records]
+    assert monos == sorted(monos)
+
+
+def test_eventlog_flushes_by_interval(tmp_path):
+    path = tmp_path.joinpath("events.jsonl")
+    events = EventLog(path, "run1", flushinterval=0.05, echo=False)
+    events.emit(EVENT_COM_RETRY, attempt=1)
+    # 閉じる前でも間隔が過ぎればファイルに出ている
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline and len(readevents(path)) == 0:
+        time.sleep(0.01)
+    assert len(readevents(path)) == 1
+    events.close()
+
+
+def test_renderevent_test_lines(capsys, tmp_path):
+    start = {
+        "event": EVENT_TEST_START,
+        "testid": "A-001",
+        "group": "GroupA",
+        "module": "echo_test.py",
+        "function": "test_echo",
+        "at": 5,
+        "start": "2024-01-01 00:00:00.000",
+        "worker": None,
+    }
+    end = {"event": EVENT_TEST_END, "succeeded": False, "runned": "x", "elapsed": 1.23456, "timedout": True, "cached": False}
+    assert json.loads(renderevent(start)[0]) == {
+        "testid": "A-001",
+        "group": "GroupA",
+        "module": "echo_test.py",
+        "function": "test_echo",
+        "at": "5",
+        "start": "2024-01-01 00:00:00.000",
+    }
+    assert json.loads(renderevent(end)[0]) == {"outcome": "False", "runned": "x", "elapsed": "1.235", "timedout": "True"}
+    assert renderevent({"event": EVENT_COM_RETRY}) == []
+
+    events = EventLog(tmp_path.joinpath("events.jsonl"), "run1", flushinterval=60)
+    events.emit(EVENT_TEST_START, **{k: v for k, v in start.items() if k != "event"})
+    # テストケースの出力より前に出るように、書き込みを待たずに表示する
+    assert capsys.readouterr().out.startswith("Running test case:\n{")
+    events.close()
@@ -0,0 +1,95 @@
+from pathlib import Path
+from runner.parallel import shard_testsuite
+from runner.run import run_testsuite
+from util.types import TestScenario, TestSuite
+from vbaunit_lib.fakebackend import FakeBackend
+
+
+SAFEMODULE = """
+from vbaunit_lib.testlib import gettestlib, expect
+
+
+def test_open_{n}_1():
+    testlib = gettestlib()
+    with testlib.runapp("target{n}.xlsm") as book:
+        expect(book.name == "target{n}.xlsm")
+
+
+def test_open_{n}_2():
+    testlib = gettestlib()
+    with testlib.runapp("target{n}.xlsm") as book:
+        expect(book.name == "target{n}.xlsm")
+"""
+
+UNSAFEMODULE = """
+from vbaunit_lib.testlib import expect
+
+VBAUNIT_PARALLEL_SAFE = False
+
+
+def test_shared_file():
+    expect(True)
+"""
+
+
+def makesuite(tmp_path, makescenario) -> tuple[TestSuite, Path]:
+    modules = []
+    for n in range(3):
+        modulepath = tmp_path.joinpath(f"safe{n}_test.py")
+        modulepath.write_text(SAFEMODULE.format(n=n), encoding="utf-8")
+        modules.append((f"A-00{n}", f"safe {n}", str(modulepath), True))
+    unsafepath = tmp_path.joinpath("unsafe_test.py")
+    unsafepath.write_text(UNSAFEMODULE, encoding="utf-8")
+    scenariopath = makescenario({"GroupA": modules, "GroupB": [("B-001", "unsafe", str(unsafepath), True)]})
+    return TestSuite("parallel", "parallel run", TestScenario(scenariopath)), scenariopath
+
+
+def test_shard_by_module(tmp_path, makescenario):
+    suite, _ = makesuite(tmp_path, makescenario)
+    shards, serial = shard_testsuite(suite, jobs=2)
+    assert len(shards) == 2
+    assert [len(s) for s in shards] == [4, 2]
+    assert [tc.testfunction for tc in serial] == ["test_shared_file"]
+    # 同じモジュールのテストケースは同じシャードに入る
+    for shard in shards:
+        for testcase in shard:
+            assert all(tc.module is testcase.module for tc in shard if tc.testid == testcase.testid)
+
+
+def test_shard_by_group(tmp_path, makescenario):
+    suite, _ = makesuite(tmp_path, makescenario)
+    shards, serial = shard_testsuite(suite, jobs=4, unit="group")
+    assert len(shards) == 1
+    assert len(shards[0]) == 6
+    assert len(serial) == 1
+
+
+def test_shard_more_jobs_than_modules(tmp_path, makescenario):
+    suite, _ = makesuite(tmp_path, makescenario)
+    shards, _ = shard_testsuite(suite, jobs=8)
+    assert len(shards) == 3
+
+
+def test_run_parallel(tmp_path, makescenario):
+    suite, scenariopath = makesuite(tmp_path, makescenario)
+    out = tmp_path.joinpath("results")
+    out.mkdir()
+    run_testsuite(suite, scenariopath, Path("VBAUnitCOMBridge.xlsm"), out, backend=FakeBackend(), jobs=2)
+
+    log = out.joinpath("testlog.txt").read_text(encoding="utf-8")
+    assert "0 failed, 7 passed" in log
+    assert log.count('"worker": "0"') == 4
+    assert log.count('"worker": "1"') == 2
+    assert "Excel sessions: 2 launched" in log
+
+
+def test_run_parallel_process_isolation(tmp_path, makescenario):
+    suite, scenariopath = makesuite(tmp_path, makescenario)
+    out = tmp_path.joinpath("results")
+    out.mkdir()
+    run_testsuite(suite, scenariopath, Path("VBAUnitCOMBridge.xlsm"), out, backend=FakeBackend(), jobs=2, isolation="process")
+
+    log = out.joinpath("testlog.txt").read_text(encoding="utf-8")
+    assert "0 failed, 7 passed" in log
+    # シャードの中でもモジュール毎に新しいワーカーで実行するので、モジュールの数だけExcelを起動する
+    assert "Excel sessions: 3 launched" in log
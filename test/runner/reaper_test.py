@@ -0,0 +1,81 @@
+import json
+from runner.reaper import ExcelReaper
+from vbaunit_lib.fakebackend import FakeBackend
+
+
+DEADRUNNER = 999999999  # 動いていないランナーのプロセスID
+RUNNER = 20000  # 動いている別のランナーのプロセスID。FakeBackend.processesで模擬する
+
+
+def __writemanifest(path, entries: list[dict]) -> None:
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in entries), encoding="utf-8")
+
+
+def test_reapstale_kills_crashed_run(tmp_path):
+    backend = FakeBackend()
+    stale = backend.getpid(backend.launch(False))
+    reused = backend.getpid(backend.launch(False))
+    manifest = tmp_path.joinpath("excel-pids.jsonl")
+    __writemanifest(
+        manifest,
+        [
+            {"pid": stale, "created": backend.apps[stale].created, "owner": DEADRUNNER},
+            # プロセスIDが使い回された別のプロセスは落とさない
+            {"pid": reused, "created": backend.apps[reused].created - 60, "owner": DEADRUNNER},
+        ],
+    )
+
+    stats = ExcelReaper(manifest, backend).reapstale()
+
+    assert stats.reaped == 1
+    assert stats.memory == 64 * 1024 * 1024
+    assert not backend.apps[stale].alive
+    assert backend.apps[reused].alive
+    assert not manifest.exists()
+
+
+def test_reapstale_keeps_running_runner(tmp_path):
+    backend = FakeBackend()
+    backend.processes[RUNNER] = 1000.0
+    pid = backend.getpid(backend.launch(False))
+    manifest = tmp_path.joinpath("excel-pids.jsonl")
+    otherrunner = ExcelReaper(manifest, backend, owner=RUNNER, ownercreated=1000.0)
+    otherrunner.record(pid)
+
+    stats = ExcelReaper(manifest, backend).reapstale()
+
+    assert stats.reaped == 0
+    assert backend.apps[pid].alive
+    assert len(manifest.read_text(encoding="utf-8").splitlines()) == 1
+
+
+def test_reapstale_owner_pid_reused(tmp_path):
+    backend = FakeBackend()
+    pid = backend.getpid(backend.launch(False))
+    manifest = tmp_path.joinpath("excel-pids.jsonl")
+    ExcelReaper(manifest, backend, owner=RUNNER, ownercreated=1000.0).record(pid)
+    # 落ちたランナーのプロセスIDを別のプロセスが使っている
+    backend.processes[RUNNER] = 2000.0
+
+    stats = ExcelReaper(manifest, backend).reapstale()
+
+    assert stats.reaped == 1
+    assert not backend.apps[pid].alive
+    assert not manifest.exists()
+
+
+def test_reapown_kills_leftovers(tmp_path):
+    backend = FakeBackend()
+    manifest = tmp_path.joinpath("excel-pids.jsonl")
+    reaper = ExcelReaper(manifest, backend)
+    quitted = backend.launch(False)
+    leftover = backend.getpid(backend.launch(False))
+    reaper.record(backend.getpid(quitted))
+    reaper.record(leftover)
+    backend.quit(quitted)
+
+    stats = reaper.reapown()
+
+    assert stats.reaped == 1
+    assert not backend.apps[leftover].alive
+    assert not manifest.exists()
@@ -0,0 +1,83 @@
+import shutil
+import zipfile
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+import pytest
+from runner.resultbook import patchresultbook, saveresultbook
+
+
+def __makebook(path) -> None:
+    book = Workbook()
+    sheet = book.active
+    sheet.title = "GroupA"
+    for col, header in enumerate(["テストID", "説明", "モジュール", "実行", "結果"], start=2):
+        sheet.cell(2, col, header)
+    for row in range(3, 8):
+        sheet.cell(row, 2, f"A-{row:03}")
+        sheet.cell(row, 4, f"test/a{row}.py")
+    sheet.cell(4, 6, "old").font = Font(bold=True)
+    sheet.cell(5, 7, "after")
+    other = book.create_sheet("Group <B> & \"C\"")
+    other.cell(2, 2, "テストID")
+    book.save(path)
+
+
+def __values(path) -> dict[str, list[tuple]]:
+    book = load_workbook(path)
+    try:
+        return {sheet.title: [tuple(c.value for c in row) for row in sheet.iter_rows()] for sheet in book.worksheets}
+    finally:
+        book.close()
+
+
+MARKS = {"GroupA": {3: "○", 4: "△", 5: "×", 10: "○"}, 'Group <B> & "C"': {1: "×", 2: "○"}}
+ROWS = ['{"testid": "A-003", "function": "test_<a>&b"}', '{"testid": "A-004"}']
+
+
+def test_patchresultbook_matches_openpyxl(tmp_path):
+    source = tmp_path.joinpath("scenario.xlsx")
+    __makebook(source)
+    patched = tmp_path.joinpath("patched.xlsx")
+    saved = tmp_path.joinpath("saved.xlsx")
+    shutil.copy(source, patched)
+    shutil.copy(source, saved)
+
+    patchresultbook(patched, marks=MARKS, sheetname="Results_1", rows=ROWS)
+    saveresultbook(saved, marks=MARKS, sheetname="Results_1", rows=ROWS)
+
+    assert __values(patched) == __values(saved)
+    book = load_workbook(patched)
+    assert book.sheetnames == ["GroupA", 'Group <B> & "C"', "Results_1"]
+    # 元のセルの書式は残す
+    assert book["GroupA"].cell(4, 6).font.bold
+    assert book["GroupA"].cell(5, 7).value == "after"
+    book.close()
+    assert not tmp_path.joinpath("patched.xlsx.tmp").exists()
+
+
+def test_patchresultbook_unknown_sheet(tmp_path):
+    source = tmp_path.joinpath("scenario.xlsx")
+    __makebook(source)
+    with pytest.raises(ValueError):
+        patchresultbook(source, marks={"GroupX": {3: "○"}}, sheetname="Results_1", rows=[])
+
+
+def test_patchresultbook_unexpected_layout(tmp_path):
+    source = tmp_path.joinpath("scenario.xlsx")
+    __makebook(source)
+    moved = tmp_path.joinpath("moved.xlsx")
+    # ブックの部品が別の場所にある
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(moved, mode="w") as dst:
+        for info in src.infolist():
+            name = info.filename.replace("xl/workbook.xml", "xl/book.xml")
+            dst.writestr(name, src.read(info))
+    with pytest.raises(ValueError):
+        patchresultbook(moved, marks={"GroupA": {3: "○"}}, sheetname="Results_1", rows=[])
+    assert not tmp_path.joinpath("moved.xlsx.tmp").exists()
+
+
+def test_patchresultbook_not_a_book(tmp_path):
+    source = tmp_path.joinpath("scenario.xlsx")
+    source.write_bytes(b"not a zip")
+    with pytest.raises(zipfile.BadZipFile):
+        patchresultbook(source, marks={}, sheetname="Results_1", rows=[])
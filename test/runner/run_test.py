@@ -0,0 +1,360 @@
+import json
+import zipfile
+from functools import partial
+from pathlib import Path
+from openpyxl import load_workbook
+import pytest
+from runner.reaper import ExcelReaper
+from runner.run import run_testsuite
+from util.components import exportcomponents
+from util.resultcache import ResultCache
+from util.resulthistory import ResultHistory
+from util.snapshot import SnapshotStore
+from util.types import TestScenario, TestSuite
+from vbaunit_lib.fakebackend import FakeBackend
+
+
+TESTMODULE = """
+from vbaunit_lib.testlib import gettestlib, expect
+
+
+def test_echo_pass():
+    testlib = gettestlib()
+    with testlib.runapp("target.xlsm"):
+        res = testlib.callmacro(None, "Echo", 1)
+        expect(res[0] == 1)
+
+
+def test_echo_fail():
+    testlib = gettestlib()
+    with testlib.runapp("target.xlsm"):
+        res = testlib.callmacro(None, "Echo", 1)
+        expect(res[0] == 2)
+"""
+
+
+def test_run_testsuite_fake_backend(tmp_path, makescenario):
+    modulepath = tmp_path.joinpath("echo_test.py")
+    modulepath.write_text(TESTMODULE, encoding="utf-8")
+    scenariopath = makescenario({"GroupA": [("A-001", "echo", str(modulepath), True)]})
+    out = tmp_path.joinpath("results")
+    out.mkdir()
+
+    backend = FakeBackend()
+    backend.registermacro("target.xlsm", "Echo", lambda v: v)
+
+    suite = TestSuite("fake", "run with fake backend", TestScenario(scenariopath))
+    history = ResultHistory(tmp_path.joinpath(".vbaunit"))
+    run_testsuite(
+        suite,
+        scenariopath,
+        Path("VBAUnitCOMBridge.xlsm"),
+        out,
+        backend=backend,
+        pidmanifest=tmp_path.joinpath("excel-pids.jsonl"),
+        resulthistory=history,
+    )
+
+    assert backend.launchcount == 1
+    log = out.joinpath("testlog.txt").read_text(encoding="utf-8")
+    assert "Backend: fake" in log
+    assert "1 failed, 1 passed" in log
+    assert "COM retries: 0 fast (0.000 s), 0 backoff (0.000 s), 0 not retried, 0 gave up" in log
+    assert "Excel reaper: 0 reaped at start (0 MB), 0 leaked at end (0 MB)" in log
+    assert not tmp_path.joinpath("excel-pids.jsonl").exists()
+    # テストログはイベントから作る
+    events = [json.loads(line) for line in out.joinpath("events.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [e["event"] for e in events] == ["suite_start"] + ["test_start", "test_end"] * 2 + ["suite_end"]
+    assert len({e["run"] for e in events}) == 1 and f"Run: {events[0]['run']}" in log
+    assert (events[-1]["failed"], events[-1]["passed"]) == (1, 1)
+    assert history.lastfailed(scenariopath) == {"A-001": {"test_echo_fail"}}
+    history.close()
+
+    resultbook = load_workbook(out.joinpath(scenariopath.name))
+    assert resultbook["GroupA"].cell(3, 6).value == "△"
+    resultbook.close()
+
+
+COUNTINGMODULE = """
+from pathlib import Path
+from vbaunit_lib.testlib import expect
+{declaration}
+with open(Path(__file__).with_suffix(".loads"), mode="a", encoding="utf-8") as f:
+    f.write("x")
+
+counter = []
+
+
+def test_first():
+    counter.append(1)
+    expect(True)
+
+
+def test_second():
+    counter.append(2)
+    expect(True)
+
+
+def test_third():
+    counter.append(3)
+    expect(len(counter) == {expected})
+"""
+
+
+def __runcounting(tmp_path, makescenario, declaration: str, expected: int, isolation: str = "module") -> tuple[int, str]:
+    modulepath = tmp_path.joinpath("counting_test.py")
+    modulepath.write_text(COUNTINGMODULE.format(declaration=declaration, expected=expected), encoding="utf-8")
+    scenariopath = makescenario({"GroupA": [("A-001", "counting", str(modulepath), True)]})
+    out = tmp_path.joinpath("results")
+    out.mkdir()
+    suite = TestSuite("lifecycle", "module lifecycle", TestScenario(scenariopath))
+    run_testsuite(suite, scenariopath, Path("VBAUnitCOMBridge.xlsm"), out, backend=FakeBackend(), isolation=isolation)
+    loads = len(modulepath.with_suffix(".loads").read_text(encoding="utf-8"))
+    return loads, out.joinpath("testlog.txt").read_text(encoding="utf-8")
+
+
+def test_run_testsuite_loads_module_once(tmp_path, makescenario):
+    loads, log = __runcounting(tmp_path, makescenario, "", 3)
+    assert loads == 1
+    assert "Isolation: module" in log
+    assert "0 failed, 3 passed" in log
+
+
+def test_run_testsuite_module_declares_test_isolation(tmp_path, makescenario):
+    loads, log = __runcounting(tmp_path, makescenario, 'VBAUNIT_ISOLATION = "test"', 1)
+    assert loads == 3
+    assert "0 failed, 3 passed" in log
+
+
+def test_run_testsuite_test_isolation(tmp_path, makescenario):
+    loads, log = __runcounting(tmp_path, makescenario, "", 1, isolation="test")
+    assert loads == 3
+    assert "Isolation: test" in log
+    assert "0 failed, 3 passed" in log
+
+
+LEAKINGMODULE = """
+from vbaunit_lib.testlib import gettestlib, expect
+
+
+def test_leak():
+    testlib = gettestlib()
+    with testlib.runapp("target.xlsm"):
+        testlib.getcollectionobj()
+        expect(True)
+
+
+def test_free():
+    testlib = gettestlib()
+    with testlib.runapp("target.xlsm"):
+        testlib.freeobj(testlib.getcollectionobj())
+        expect(True)
+"""
+
+
+def __runleaking(tmp_path, makescenario, failonleak: bool) -> str:
+    modulepath = tmp_path.joinpath("leaking_test.py")
+    modulepath.write_text(LEAKINGMODULE, encoding="utf-8")
+    scenariopath = makescenario({"GroupA": [("A-001", "leaking", str(modulepath), True)]})
+    out = tmp_path.joinpath("results")
+    out.mkdir()
+
+    suite = TestSuite("fake", "leak check", TestScenario(scenariopath))
+    run_testsuite(suite, scenariopath, Path("VBAUnitCOMBridge.xlsm"), out, backend=FakeBackend(), failonleak=failonleak)
+    return out.joinpath("testlog.txt").read_text(encoding="utf-8")
+
+
+def test_run_testsuite_warns_leak(tmp_path, makescenario, capsys):
+    log = __runleaking(tmp_path, makescenario, failonleak=False)
+    assert "Leak check: warn" in log
+    assert "0 failed, 2 passed" in log
+    assert "[WARN]1 COM objects not freed: 1 by GetNewCollection at leaking_test.py:8" in capsys.readouterr().out
+
+
+def test_run_testsuite_fails_leak(tmp_path, makescenario):
+    log = __runleaking(tmp_path, makescenario, failonleak=True)
+    assert "Leak check: fail" in log
+    assert "1 failed, 1 passed" in log
+
+
+HANGINGMODULE = """
+from vbaunit_lib.testlib import gettestlib, expect, timeout
+
+
+@timeout(0.3)
+def test_hang():
+    testlib = gettestlib()
+    with testlib.runapp("target.xlsm"):
+        testlib.callmacro(None, "Hang")
+
+
+def test_next():
+    testlib = gettestlib()
+    with testlib.runapp("target.xlsm"):
+        res = testlib.callmacro(None, "Echo", 1)
+        expect(res[0] == 1)
+"""
+
+
+BRIDGE = "VBAUnitCOMBridge.xlsm"
+
+
+@pytest.fixture
+def runsuite(tmp_path, makescenario, monkeypatch):
+    """テストモジュールのソースを1つのシナリオにしてrun_testsuiteで実行し、テストログを返す関数。
+    カレントフォルダをtmp_pathにしてbridgeを置き、何回呼んでも同じシナリオと出力先を使う。
+    resultcacheを渡したら実行の後に閉じる
+    """
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath(BRIDGE).write_bytes(b"bridge")
+    out = tmp_path.joinpath("results")
+    out.mkdir()
+    modulepath = tmp_path.joinpath("suite_test.py")
+    scenariopath = makescenario({"GroupA": [("A-001", "suite", str(modulepath), True)]})
+
+    def run(source: str, backend: FakeBackend, **kwargs) -> str:
+        modulepath.write_text(source, encoding="utf-8")
+        suite = TestSuite("fake", "suite", TestScenario(scenariopath))
+        try:
+            run_testsuite(suite, scenariopath, tmp_path.joinpath(BRIDGE), out, backend=backend, **kwargs)
+        finally:
+            if kwargs.get("resultcache") is not None:
+                kwargs["resultcache"].close()
+        return out.joinpath("testlog.txt").read_text(encoding="utf-8")
+
+    return run
+
+
+def __targetbackend(components: dict[str, str] | None = None) -> FakeBackend:
+    """target.xlsmにEchoとOther、指定したVBComponentを持つFakeBackend"""
+    backend = FakeBackend()
+    backend.registermacro("target.xlsm", "Echo", lambda v: v)
+    backend.registermacro("target.xlsm", "Other", lambda v: v + 1)
+    for name, code in (components or {}).items():
+        backend.registercomponent("target.xlsm", name, code=code)
+    return backend
+
+
+def __writebook(path: Path, project: bytes, sheet: bytes = b"<sheet/>") -> None:
+    with zipfile.ZipFile(path, mode="w") as book:
+        book.writestr("xl/worksheets/sheet1.xml", sheet)
+        book.writestr("xl/vbaProject.bin", project)
+
+
+def test_run_testsuite_timeout(runsuite):
+    backend = __targetbackend()
+    backend.registerhang("target.xlsm", "Hang")
+    log = runsuite(HANGINGMODULE, backend, timeout=60)
+    assert "Timeout: 60 s" in log
+    assert '"timedout": "True"' in log
+    assert "1 failed (1 timed out), 1 passed" in log
+    # 落としたExcelは捨てて、次のテストケースは新しいExcelで実行する
+    assert "Excel sessions: 2 launched" in log
+
+
+def test_run_testsuite_incremental(runsuite, tmp_path):
+    tmp_path.joinpath("target.xlsm").write_bytes(b"target")
+    cachedir = tmp_path.joinpath(".vbaunit")
+    log = runsuite(TESTMODULE, __targetbackend(), resultcache=ResultCache(cachedir))
+    assert "1 failed, 1 passed (0 cached, 2 executed)" in log
+    # 成功したものだけ実行しない
+    backend = __targetbackend()
+    log = runsuite(TESTMODULE, backend, resultcache=ResultCache(cachedir))
+    assert "1 failed, 1 passed (1 cached, 1 executed)" in log
+    assert '"cached": "True"' in log
+    assert backend.launchcount == 1
+    # bridgeが変われば実行し直す
+    tmp_path.joinpath(BRIDGE).write_bytes(b"bridge2")
+    log = runsuite(TESTMODULE, __targetbackend(), resultcache=ResultCache(cachedir))
+    assert "1 failed, 1 passed (0 cached, 2 executed)" in log
+
+
+COMPONENTMODULE = """
+from vbaunit_lib.testlib import gettestlib, expect
+
+
+def test_echo():
+    testlib = gettestlib()
+    with testlib.runapp("target.xlsm"):
+        expect(testlib.callmacro(None, "Echo", 1)[0] == 1)
+
+
+def test_other():
+    testlib = gettestlib()
+    with testlib.runapp("target.xlsm"):
+        expect(testlib.callmacro(None, "Module2.Other", 1)[0] == 2)
+"""
+
+
+def test_run_testsuite_component_impact(runsuite, tmp_path):
+    components = {
+        "Module1": "Public Function Echo(v)\n    Echo = Helper(v)\nEnd Function",
+        "Module2": "Public Function Other(v)\nEnd Function",
+        "Module3": "Public Function Helper(v)\n    Helper = v\nEnd Function",
+    }
+
+    def run() -> str:
+        backend = __targetbackend(components)
+        cache = ResultCache(tmp_path.joinpath(".vbaunit"), exporter=partial(exportcomponents, backend))
+        return runsuite(COMPONENTMODULE, backend, resultcache=cache)
+
+    __writebook(tmp_path.joinpath("target.xlsm"), b"v1")
+    log = run()
+    assert "0 failed, 2 passed (0 cached, 2 executed)" in log
+    assert "VBA components: 1 workbooks exported" in log
+    # VBAが変わらなければ読み直さない
+    log = run()
+    assert "0 failed, 2 passed (2 cached, 0 executed)" in log
+    assert "VBA components: 0 workbooks exported" in log
+    # Module2だけ変えると、それを使ったテストケースだけ実行する
+    components["Module2"] += "\n' changed"
+    __writebook(tmp_path.joinpath("target.xlsm"), b"v2")
+    log = run()
+    assert "0 failed, 2 passed (1 cached, 1 executed)" in log
+    assert '"function": "test_echo"' in log.split('"cached": "True"')[0]
+    # Echoから呼ばれるModule3だけ変えても、Echoを使ったテストケースは実行する
+    components["Module3"] += "\n' changed"
+    __writebook(tmp_path.joinpath("target.xlsm"), b"v3")
+    log = run()
+    assert "0 failed, 2 passed (1 cached, 1 executed)" in log
+    assert '"function": "test_other"' in log.split('"cached": "True"')[0]
+    # シートが変わればブックを開くテストケースは全て実行する
+    __writebook(tmp_path.joinpath("target.xlsm"), b"v2", sheet=b"<sheet>changed</sheet>")
+    log = run()
+    assert "0 failed, 2 passed (0 cached, 2 executed)" in log
+
+
+def test_run_testsuite_snapshot(runsuite, tmp_path):
+    __writebook(tmp_path.joinpath("target.xlsm"), b"v1")
+    manifest = tmp_path.joinpath(".vbaunit", "excel-pids.jsonl")
+    manifest.parent.mkdir()
+    stalealive: list[bool] = []
+    recorded: list[int] = []
+
+    def run() -> str:
+        backend = __targetbackend({"Module1": "Public Function Echo(v)\nEnd Function"})
+        # 前の実行が残したExcel
+        stale = backend.getpid(backend.launch(False))
+        manifest.write_text(json.dumps({"pid": stale, "created": backend.apps[stale].created, "owner": 999999999}) + "\n")
+        reaper = ExcelReaper(manifest, backend)
+
+        def onlaunch(pid: int) -> None:
+            reaper.record(pid)
+            recorded.extend(entry["pid"] for entry in map(json.loads, manifest.read_text().splitlines()))
+
+        def exporter(workbookpath: Path):
+            stalealive.append(backend.apps[stale].alive)
+            return exportcomponents(backend, workbookpath, onlaunch=onlaunch)
+
+        snapshots = SnapshotStore(tmp_path.joinpath(".vbaunit"), exporter=exporter)
+        return runsuite(COMPONENTMODULE, backend, pidmanifest=manifest, snapshots=snapshots)
+
+    log = run()
+    assert "Snapshot: 1 workbooks (1 exported), 1 components, 1 new" in log
+    # 前の実行のExcelを落としてからコードを読み、読むために起動したExcelは記録する
+    assert stalealive == [False]
+    assert len(recorded) == 1
+    runid = log.split("Run: ")[1].split("\n")[0]
+    assert tmp_path.joinpath(".vbaunit", "snapshots", "manifests", f"{runid}.json").exists()
+    # ブックが変わらなければ開かずに前の一覧を使う
+    assert "Snapshot: 1 workbooks (0 exported), 1 components, 0 new" in run()
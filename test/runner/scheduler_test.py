@@ -0,0 +1,88 @@
+import json
+from runner.parallel import shard_testsuite
+from runner.scheduler import TestHistory, TestScheduler, historykey, readhistory
+from util.types import TestScenario, TestSuite
+
+
+MODULE = """
+from vbaunit_lib.testlib import gettestlib, expect
+
+
+def test_{n}_a():
+    testlib = gettestlib()
+    with testlib.runapp("{book}") as book:
+        expect(True)
+
+
+def test_{n}_b():
+    testlib = gettestlib()
+    with testlib.runapp("{book}") as book:
+        expect(True)
+"""
+
+
+def __makesuite(tmp_path, makescenario) -> TestSuite:
+    modules = []
+    for n, book in enumerate(["first.xlsm", "second.xlsm", "first.xlsm"]):
+        modulepath = tmp_path.joinpath(f"m{n}_test.py")
+        modulepath.write_text(MODULE.format(n=n, book=book), encoding="utf-8")
+        modules.append((f"A-00{n}", f"module {n}", str(modulepath), True))
+    return TestSuite("schedule", "schedule", TestScenario(makescenario({"GroupA": modules})))
+
+
+def __names(testcases) -> list[str]:
+    return [tc.testfunction for tc in testcases]
+
+
+def test_readhistory(tmp_path):
+    testlog = tmp_path.joinpath("testlog.txt")
+    lines = [
+        "Test log for schedule",
+        json.dumps({"testid": "A-000", "group": "GroupA", "module": "m0_test.py", "function": "test_0_a", "at": "5", "start": ""}),
+        json.dumps({"outcome": "False", "runned": "", "elapsed": "2.500", "timedout": "True"}),
+        json.dumps({"testid": "A-001", "group": "GroupA", "module": "m1_test.py", "function": "test_1_a", "at": "5", "start": ""}),
+        json.dumps({"outcome": "True", "runned": "", "elapsed": "0.100"}),
+        json.dumps({"testid": "A-002", "group": "GroupA", "module": "m2_test.py", "function": "test_2_a", "at": "5", "start": ""}),
+        json.dumps({"outcome": "True", "runned": "", "elapsed": "0.000", "cached": "True"}),
+        "---------- 1 failed, 2 passed (1 cached, 2 executed) ----------",
+    ]
+    testlog.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    history = readhistory(testlog)
+    assert history == {
+        historykey("A-000", "test_0_a"): TestHistory(elapsed=2.5, failed=True),
+        historykey("A-001", "test_1_a"): TestHistory(elapsed=0.1, failed=False),
+    }
+    assert readhistory(tmp_path.joinpath("missing.txt")) == {}
+
+
+def test_schedule_workbook(tmp_path, makescenario):
+    suite = __makesuite(tmp_path, makescenario)
+    assert __names(TestScheduler("scenario").schedule(suite)) == __names(suite)
+    # 同じブックを開くモジュールを続けて実行する。モジュールの中の順は変えない
+    assert __names(TestScheduler("workbook").schedule(suite)) == [
+        "test_0_a", "test_0_b", "test_2_a", "test_2_b", "test_1_a", "test_1_b",
+    ]
+
+
+def test_schedule_failedfirst(tmp_path, makescenario):
+    suite = __makesuite(tmp_path, makescenario)
+    history = {historykey("A-002", "test_2_b"): TestHistory(elapsed=1.0, failed=True)}
+    assert __names(TestScheduler("failedfirst", history).schedule(suite)) == [
+        "test_2_b", "test_2_a", "test_0_a", "test_0_b", "test_1_a", "test_1_b",
+    ]
+
+
+def test_schedule_longest(tmp_path, makescenario):
+    suite = __makesuite(tmp_path, makescenario)
+    history = {
+        historykey("A-001", "test_1_a"): TestHistory(elapsed=9.0, failed=False),
+        historykey("A-001", "test_1_b"): TestHistory(elapsed=1.0, failed=False),
+        historykey("A-000", "test_0_a"): TestHistory(elapsed=0.5, failed=False),
+        historykey("A-000", "test_0_b"): TestHistory(elapsed=0.5, failed=False),
+    }
+    scheduler = TestScheduler("longest", history)
+    # 履歴の無いA-002は平均の2.75秒を2つとみなす
+    assert __names(scheduler.schedule(suite)) == ["test_1_a", "test_1_b", "test_2_a", "test_2_b", "test_0_a", "test_0_b"]
+    # 重さで分けるので、重いA-001は1つのワーカーで、残りをもう1つのワーカーで実行する
+    shards, _ = shard_testsuite(scheduler.schedule(suite), jobs=2, cost=scheduler.cost)
+    assert [__names(shard) for shard in shards] == [["test_1_a", "test_1_b"], ["test_2_a", "test_2_b", "test_0_a", "test_0_b"]]
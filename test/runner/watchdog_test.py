@@ -0,0 +1,38 @@
+import time
+from pathlib import Path
+import pytest
+from runner.watchdog import TestWatchdog
+from vbaunit_lib.fakebackend import FakeBackend, FakeComError
+from vbaunit_lib.testlib import VBAUnitTestLib
+
+
+def test_watchdog_not_fired():
+    with TestWatchdog(5.0) as watchdog:
+        pass
+    assert not watchdog.fired
+
+
+def test_watchdog_disabled():
+    with TestWatchdog(0) as watchdog:
+        time.sleep(0.05)
+    assert not watchdog.fired
+
+
+def test_watchdog_kills_hung_excel():
+    backend = FakeBackend()
+    backend.registerhang("target.xlsm", "Hang")
+    testlib = VBAUnitTestLib(Path("VBAUnitCOMBridge.xlsm"), withapp=False, backend=backend)
+    with pytest.raises(FakeComError):
+        with testlib.runapp("target.xlsm") as testbook:
+            with TestWatchdog(0.2) as watchdog:
+                testbook.macro("Hang")()
+    assert watchdog.fired
+    assert not any(app.alive for app in backend.apps.values())
+
+
+def test_watchdog_interrupts_python():
+    with pytest.raises(KeyboardInterrupt):
+        with TestWatchdog(0.1, grace=0.1) as watchdog:
+            while True:
+                time.sleep(0.01)
+    assert watchdog.fired
@@ -0,0 +1,84 @@
+from pathlib import Path
+from runner.run import run_testsuite
+from runner.workerpool import PrewarmedWorkerPool
+from util.types import TestScenario, TestSuite
+from vbaunit_lib.fakebackend import FakeBackend
+
+
+MODULE = """
+import os
+import sys
+from vbaunit_lib.testlib import expect
+
+
+def test_1_preloaded():
+    expect("openpyxl" in sys.modules)
+
+
+def test_2_pid():
+    print(os.getpid())
+    expect(True)
+
+
+def test_3_pass():
+    expect(True)
+
+
+def test_4_pass():
+    expect(True)
+
+
+def test_5_pass():
+    expect(True)
+"""
+
+CRASHMODULE = """
+import os
+from vbaunit_lib.testlib import expect
+
+
+def test_1_crash():
+    os._exit(3)
+
+
+def test_2_after_crash():
+    expect(True)
+"""
+
+
+def test_workerpool_recycle_after_maxjobs(tmp_path, makescenario):
+    modulepath = tmp_path.joinpath("pool_test.py")
+    modulepath.write_text(MODULE, encoding="utf-8")
+    scenariopath = makescenario({"GroupA": [("A-001", "pool", str(modulepath), True)]})
+    suite = TestSuite("pool", "", TestScenario(scenariopath))
+
+    pool = PrewarmedWorkerPool(Path("VBAUnitCOMBridge.xlsm"), "fake", maxjobs=2)
+    try:
+        outcomes = [pool.execute(testcase) for testcase in suite]
+    finally:
+        pool.shutdown()
+    assert [o.succeeded for o in outcomes] == [True] * 5
+    assert [o.worker for o in outcomes] == [0, 0, 1, 1, 2]
+    stats = pool.stats
+    assert stats.recycled == 2
+    assert stats.crashed == 0
+    assert stats.jobs == 5
+
+
+def test_run_testsuite_process_isolation(tmp_path, makescenario):
+    modulepath = tmp_path.joinpath("pool_test.py")
+    modulepath.write_text(MODULE, encoding="utf-8")
+    crashpath = tmp_path.joinpath("crash_test.py")
+    crashpath.write_text(CRASHMODULE, encoding="utf-8")
+    scenariopath = makescenario({"GroupA": [("A-001", "crash", str(crashpath), True), ("A-002", "pool", str(modulepath), True)]})
+    out = tmp_path.joinpath("results")
+    out.mkdir()
+    suite = TestSuite("process", "process isolation", TestScenario(scenariopath))
+
+    run_testsuite(suite, scenariopath, Path("VBAUnitCOMBridge.xlsm"), out, backend=FakeBackend(), isolation="process")
+
+    log = out.joinpath("testlog.txt").read_text(encoding="utf-8")
+    assert "Isolation: process" in log
+    # 落ちたテストケースだけが失敗し、同じモジュールの続きは次のワーカーで実行する
+    assert "1 failed, 6 passed" in log
+    assert "Workers: 4 started, 1 recycled, 1 crashed, 7 jobs" in log
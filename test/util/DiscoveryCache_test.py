@@ -0,0 +1,99 @@
+from util.discoverycache import DiscoveryCache
+from util.types import TestModule, TestScenario, TestSuite
+
+
+MODULE = """
+from vbaunit_lib.testlib import description
+
+
+@description("first")
+def test_one():
+    pass
+
+
+def test_two():
+    pass
+"""
+
+
+def __pick(cache: DiscoveryCache, testid: str, modulepath) -> TestModule:
+    # TestSuiteと同じく、キャッシュに無ければソースから列挙して入れる
+    m = TestModule(testid, "subject", "GroupA", str(modulepath), True, 3)
+    if not cache.lookup(m):
+        assert m.discoveredby == ""
+        m.pick_testcases()
+        cache.store(m)
+    return m
+
+
+def test_discoverycache_miss_then_hit(tmp_path):
+    modulepath = tmp_path.joinpath("set_test.py")
+    modulepath.write_text(MODULE, encoding="utf-8")
+    cachedir = tmp_path.joinpath(".vbaunit")
+
+    cache = DiscoveryCache(cachedir)
+    m1 = __pick(cache, "A-001", modulepath)
+    cache.save()
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert m1.discoveredby == "ast"
+
+    cache = DiscoveryCache(cachedir)
+    m2 = __pick(cache, "A-001", modulepath)
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert m2.discoveredby == "cache"
+    assert m2.discovered == m1.discovered
+    assert m2["test_one"].subject == "first"
+    assert "1 hit, 0 miss (100%)" in cache.logline
+
+
+def test_discoverycache_store_missing_module(tmp_path):
+    cache = DiscoveryCache(tmp_path.joinpath(".vbaunit"))
+    m = TestModule("A-001", "subject", "GroupA", str(tmp_path.joinpath("missing_test.py")), True, 3)
+    assert not cache.lookup(m)
+    cache.store(m)
+    cache.save()
+    assert cache.misses == 1
+    assert not tmp_path.joinpath(".vbaunit").exists()
+
+
+def test_discoverycache_invalidate_on_change(tmp_path):
+    modulepath = tmp_path.joinpath("set_test.py")
+    modulepath.write_text(MODULE, encoding="utf-8")
+    cachedir = tmp_path.joinpath(".vbaunit")
+    cache = DiscoveryCache(cachedir)
+    __pick(cache, "A-001", modulepath)
+    cache.save()
+
+    modulepath.write_text(MODULE + "\n\ndef test_three():\n    pass\n", encoding="utf-8")
+    cache = DiscoveryCache(cachedir)
+    m = __pick(cache, "A-001", modulepath)
+    assert cache.misses == 1
+    assert [tc.testfunction for tc in m] == ["test_one", "test_three", "test_two"]
+
+
+def test_discoverycache_same_module_several_testids(tmp_path, makescenario):
+    modulepath = tmp_path.joinpath("set_test.py")
+    modulepath.write_text(MODULE, encoding="utf-8")
+    scenariopath = makescenario(
+        {
+            "GroupA": [("A-001", "a", str(modulepath), True), ("A-002", "b", str(modulepath), True)],
+            "GroupB": [("B-001", "c", str(modulepath), True)],
+        }
+    )
+    cachedir = tmp_path.joinpath(".vbaunit")
+    for run in range(2):
+        cache = DiscoveryCache(cachedir)
+        suite = TestSuite("cached", "", TestScenario(scenariopath), discoverycache=cache)
+        assert suite.count == 6
+        assert [(tc.testid, tc.group) for tc in suite] == [
+            ("A-001", "GroupA"),
+            ("A-001", "GroupA"),
+            ("A-002", "GroupA"),
+            ("A-002", "GroupA"),
+            ("B-001", "GroupB"),
+            ("B-001", "GroupB"),
+        ]
+        for tc in suite:
+            assert tc.module.testid == tc.testid
+        # 1回目も2つ目以降のテストIDは同じ列挙結果を使う
+        assert (cache.hits, cache.misses) == ((2, 1) if run == 0 else (3, 0))
@@ -0,0 +1,90 @@
+from util.resultcache import ResultCache
+from util.types import TestModule, TestResult
+
+
+MODULE = """
+from vbaunit_lib.testlib import gettestlib
+
+
+def test_one():
+    with gettestlib().runapp("target.xlsm") as book:
+        pass
+"""
+
+
+def __prepare(tmp_path, monkeypatch, source: str = MODULE):
+    monkeypatch.chdir(tmp_path)
+    modulepath = tmp_path.joinpath("cache_test.py")
+    modulepath.write_text(source, encoding="utf-8")
+    tmp_path.joinpath("target.xlsm").write_bytes(b"target")
+    bridge = tmp_path.joinpath("bridge.xlsm")
+    bridge.write_bytes(b"bridge")
+    module = TestModule("A-001", "subject", "GroupA", str(modulepath), True, 3)
+    module.pick_testcases()
+    return module[0], bridge
+
+
+def __passed(testcase) -> TestResult:
+    return TestResult(testcase.testid, testcase.group, testcase.module, testcase.testfunction, testcase.start_line, True, "")
+
+
+def test_resultcache_hit_until_input_changes(tmp_path, monkeypatch):
+    testcase, bridge = __prepare(tmp_path, monkeypatch)
+    cache = ResultCache(tmp_path.joinpath(".vbaunit"))
+    key = cache.key(testcase, bridge)
+    assert key is not None and not cache.passed(key)
+    cache.record([(key, __passed(testcase))])
+    cache.close()
+
+    cache = ResultCache(tmp_path.joinpath(".vbaunit"))
+    assert cache.key(testcase, bridge) == key and cache.passed(key)
+    # 開くブックが変わればキーも変わる
+    tmp_path.joinpath("target.xlsm").write_bytes(b"changed")
+    assert ResultCache(tmp_path.joinpath(".vbaunit")).key(testcase, bridge) != key
+    cache.clear()
+    assert not cache.passed(key)
+    cache.close()
+
+
+def test_resultcache_unknown_workbook(tmp_path, monkeypatch):
+    testcase, bridge = __prepare(tmp_path, monkeypatch, MODULE.replace('"target.xlsm"', 'BOOK').replace("\n\n\ndef", '\nBOOK = "target.xlsm"\n\n\ndef'))
+    cache = ResultCache(tmp_path.joinpath(".vbaunit"))
+    assert cache.key(testcase, bridge) is None
+    cache.close()
+
+
+HELPERMODULE = """
+from cache_helper import openbook
+
+
+def test_one():
+    with openbook() as book:
+        pass
+"""
+
+
+def test_resultcache_no_workbook(tmp_path, monkeypatch):
+    # ブックを開く所がソースに見つからなければ、どこかで開いているかもしれないのでキャッシュしない
+    testcase, bridge = __prepare(tmp_path, monkeypatch, HELPERMODULE)
+    tmp_path.joinpath("cache_helper.py").write_text("def openbook():\n    return opener()\n", encoding="utf-8")
+    cache = ResultCache(tmp_path.joinpath(".vbaunit"))
+    assert cache.key(testcase, bridge) is None
+    cache.close()
+
+
+def test_resultcache_local_imports(tmp_path, monkeypatch):
+    testcase, bridge = __prepare(tmp_path, monkeypatch, HELPERMODULE)
+    helper = tmp_path.joinpath("cache_helper.py")
+    helper.write_text(
+        'from vbaunit_lib.testlib import gettestlib\n\n\ndef openbook():\n    return gettestlib().runapp("target.xlsm")\n',
+        encoding="utf-8",
+    )
+    key = ResultCache(tmp_path.joinpath(".vbaunit")).key(testcase, bridge)
+    assert key is not None
+    # importしたモジュールが開くブックも入力にする
+    tmp_path.joinpath("target.xlsm").write_bytes(b"changed")
+    changedbook = ResultCache(tmp_path.joinpath(".vbaunit")).key(testcase, bridge)
+    assert changedbook not in (None, key)
+    # importしたモジュールが変わればキーも変わる
+    helper.write_text(helper.read_text(encoding="utf-8") + "\n# changed\n", encoding="utf-8")
+    assert ResultCache(tmp_path.joinpath(".vbaunit")).key(testcase, bridge) not in (None, key, changedbook)
@@ -0,0 +1,69 @@
+from util.resulthistory import ResultHistory
+from util.types import TestResult, TestScenario, TestScope, TestSuite
+
+
+MODULE = """
+def test_one():
+    pass
+
+
+def test_two():
+    pass
+"""
+
+
+def __makescenario(tmp_path, makescenario):
+    modules = []
+    for n in range(3):
+        modulepath = tmp_path.joinpath(f"m{n}_test.py")
+        modulepath.write_text(MODULE, encoding="utf-8")
+        modules.append((f"A-00{n}", f"module {n}", str(modulepath), True))
+    return makescenario({"GroupA": modules})
+
+
+def __runall(history: ResultHistory, scenariopath, failed: set[tuple[str, str]]) -> None:
+    suite = TestSuite("all", "all", TestScenario(scenariopath))
+    for testcase in suite:
+        result = TestResult(
+            testid=testcase.testid,
+            group=testcase.group,
+            module=testcase.module,
+            testfunction=testcase.testfunction,
+            start_line=testcase.start_line,
+            succeeded=(testcase.testid, testcase.testfunction) not in failed,
+            runned_at="",
+        )
+        history.record(scenariopath, [result])
+
+
+def test_resulthistory_lastfailed(tmp_path, makescenario, capsys):
+    scenariopath = __makescenario(tmp_path, makescenario)
+    history = ResultHistory(tmp_path.joinpath(".vbaunit"))
+    assert history.lastfailed(scenariopath) is None
+    __runall(history, scenariopath, {("A-001", "test_two")})
+    history.close()
+
+    history = ResultHistory(tmp_path.joinpath(".vbaunit"))
+    assert history.lastfailed(scenariopath) == {"A-001": {"test_two"}}
+    scenario = TestScenario(scenariopath)
+    suite = TestSuite("rerun", "rerun", scenario, scope=TestScope.LAST_FAILED, resulthistory=history)
+    assert [(tc.testid, tc.testfunction) for tc in suite] == [("A-001", "test_two")]
+    # 失敗の無いモジュールは列挙もしない
+    assert suite.discoverycount["ast"] == 1
+    assert scenario.group("GroupA")["A-000"].discoveredby == ""
+
+    # 直ったら次は何も実行しない
+    __runall(history, scenariopath, set())
+    assert history.lastfailed(scenariopath) == {}
+    capsys.readouterr()
+    assert TestSuite("rerun", "rerun", TestScenario(scenariopath), scope=TestScope.LAST_FAILED, resulthistory=history).count == 0
+    assert "[WARN]no failed test cases in the last run." in capsys.readouterr().out
+    history.close()
+
+
+def test_lastfailed_without_history(tmp_path, makescenario):
+    scenariopath = __makescenario(tmp_path, makescenario)
+    history = ResultHistory(tmp_path.joinpath(".vbaunit"))
+    suite = TestSuite("rerun", "rerun", TestScenario(scenariopath), scope=TestScope.LAST_FAILED, resulthistory=history)
+    assert suite.count == 6
+    history.close()
@@ -0,0 +1,64 @@
+import os
+from util.scenariocache import ScenarioCache
+from util.types import TestScenario
+
+
+GROUPS = {
+    "GroupA": [("A-001", "テストA1", "a1.py", True), ("A-002", "テストA2", "a2.py", False)],
+    "GroupB": [("B-001", "テストB1", "b1.py", True)],
+}
+
+
+def __modules(scenario: TestScenario) -> list[tuple]:
+    return [
+        (g.groupname, m.testid, m.subject, m.modulepath, m.run, m.line)
+        for g in scenario
+        for m in g
+    ]
+
+
+def test_scenariocache_miss_then_hit(tmp_path, makescenario):
+    scenariopath = makescenario(GROUPS)
+    cache = ScenarioCache(tmp_path.joinpath(".vbaunit"))
+    s1 = cache.load(scenariopath)
+    assert not cache.hit
+    assert "miss" in cache.logline
+    s2 = cache.load(scenariopath)
+    assert cache.hit
+    assert "hit" in cache.logline
+    assert s2.valid
+    assert s2.path == scenariopath.resolve()
+    assert __modules(s1) == __modules(s2)
+
+
+def test_scenariocache_invalidate_on_change(tmp_path, makescenario):
+    scenariopath = makescenario(GROUPS)
+    cache = ScenarioCache(tmp_path.joinpath(".vbaunit"))
+    cache.load(scenariopath)
+    makescenario({"GroupC": [("C-001", "テストC1", "c1.py", True)]})
+    s = cache.load(scenariopath)
+    assert not cache.hit
+    assert [g.groupname for g in s] == ["GroupC"]
+
+
+def test_scenariocache_touch_same_content(tmp_path, makescenario):
+    scenariopath = makescenario(GROUPS)
+    cache = ScenarioCache(tmp_path.joinpath(".vbaunit"))
+    cache.load(scenariopath)
+    stat = os.stat(scenariopath)
+    os.utime(scenariopath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache.load(scenariopath)
+    # 更新日時だけ変わっても内容が同じならキャッシュを使う
+    assert cache.hit
+
+
+def test_scenariocache_broken_file(tmp_path, makescenario):
+    scenariopath = makescenario(GROUPS)
+    cachedir = tmp_path.joinpath(".vbaunit")
+    cache = ScenarioCache(cachedir)
+    cache.load(scenariopath)
+    for f in cachedir.iterdir():
+        f.write_text("{broken", encoding="utf-8")
+    s = cache.load(scenariopath)
+    assert not cache.hit
+    assert s.count == 2
@@ -0,0 +1,85 @@
+from pathlib import Path
+from util.components import ComponentSource
+from util.snapshot import SnapshotStore, snapshotlogline, suiteworkbooks
+from util.types import TestModule
+
+
+MODULE = """
+from vbaunit_lib.testlib import gettestlib
+
+
+def test_one():
+    with gettestlib().runapp("target.xlsm") as book:
+        pass
+
+
+def test_two():
+    with gettestlib().openexcel("other.xlsm") as book:
+        pass
+"""
+
+
+class __Exporter:
+    def __init__(self) -> None:
+        self.calls: list[Path] = []
+        self.sources = [ComponentSource("Module1", 1, "Sub Foo()\nEnd Sub"), ComponentSource("Class1", 2, "")]
+
+    def __call__(self, workbookpath: Path) -> list[ComponentSource]:
+        self.calls.append(workbookpath)
+        return self.sources
+
+
+def test_snapshot_skips_unchanged_workbook(tmp_path):
+    workbook = tmp_path.joinpath("target.xlsm")
+    workbook.write_bytes(b"target")
+    exporter = __Exporter()
+    store = SnapshotStore(tmp_path.joinpath(".vbaunit"), exporter)
+
+    stats = store.snapshot("run1", [workbook])
+    assert (stats.workbooks, stats.exported, stats.components, stats.stored) == (1, 1, 2, 2)
+    assert stats.storedbytes > 0
+    manifest = store.manifest("run1")
+    assert manifest is not None
+    components = manifest[str(workbook.resolve())]["components"]
+    assert store.readcode(components["Module1"]["sha256"]) == "Sub Foo()\nEnd Sub"
+    assert components["Class1"]["type"] == 2
+
+    # ファイルが同じならブックを開かない
+    stats = SnapshotStore(tmp_path.joinpath(".vbaunit"), exporter).snapshot("run2", [workbook])
+    assert (stats.exported, stats.components, stats.stored, stats.storedbytes) == (0, 2, 0, 0)
+    assert len(exporter.calls) == 1
+    assert store.manifest("run2") == manifest
+
+
+def test_snapshot_stores_changed_components_once(tmp_path):
+    workbook = tmp_path.joinpath("target.xlsm")
+    workbook.write_bytes(b"target")
+    exporter = __Exporter()
+    store = SnapshotStore(tmp_path.joinpath(".vbaunit"), exporter)
+    store.snapshot("run1", [workbook])
+
+    workbook.write_bytes(b"changed")
+    exporter.sources = [exporter.sources[0], ComponentSource("Class1", 2, "Private m_value")]
+    stats = store.snapshot("run2", [workbook])
+    # 変わっていないModule1は書き直さない
+    assert (stats.exported, stats.components, stats.stored) == (1, 2, 1)
+    assert len(list(tmp_path.joinpath(".vbaunit", "snapshots", "objects").glob("*/*"))) == 3
+    assert store.manifest("run1") != store.manifest("run2")
+    assert store.manifest("run3") is None
+    assert snapshotlogline(stats).startswith("Snapshot: 1 workbooks (1 exported), 2 components, 1 new")
+
+
+def test_snapshot_missing_workbook(tmp_path):
+    store = SnapshotStore(tmp_path.joinpath(".vbaunit"), __Exporter())
+    stats = store.snapshot("run1", [tmp_path.joinpath("missing.xlsm")])
+    assert (stats.workbooks, stats.exported) == (0, 0)
+    assert store.manifest("run1") == {}
+
+
+def test_suiteworkbooks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    modulepath = tmp_path.joinpath("snapshot_test.py")
+    modulepath.write_text(MODULE, encoding="utf-8")
+    module = TestModule("A-001", "subject", "GroupA", str(modulepath), True, 3)
+    module.pick_testcases()
+    assert suiteworkbooks(module) == [tmp_path.joinpath("target.xlsm").resolve(), tmp_path.joinpath("other.xlsm").resolve()]
@@ -138,3 +138,28 @@ def test_scenario_multigroup_multimodule_moduleinfo():
 
 def test_scenario_loading_testcase():
     s = utypes.TestScenario(Path("test\\util\\scenario_single_single.xlsx").resolve())
+
+
+def test_scenario_many_rows(makescenario):
+    modules = [(f"A-{i:04}", f"subject {i}", f"set{i:04}.py", i % 2 == 0) for i in range(2000)]
+    s = utypes.TestScenario(makescenario({"GroupA": modules}))
+    assert s.valid
+    g = s[0]
+    assert g.count == 2000
+    assert g[1999].testid == "A-1999"
+    assert g[1999].line == 2002
+    assert g[0].run
+    assert not g[1].run
+
+
+def test_scenario_invalid_header_sheet_skipped(makescenario):
+    from openpyxl import load_workbook
+
+    path = makescenario({"GroupA": [("A-001", "s", "set001.py", True)], "Memo": []})
+    book = load_workbook(path)
+    book["Memo"].cell(2, 4, "メモ")
+    book.save(path)
+    s = utypes.TestScenario(path)
+    assert s.valid
+    assert s.count == 1
+    assert s[0].groupname == "GroupA"
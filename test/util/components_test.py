@@ -0,0 +1,77 @@
+from pathlib import Path
+from util.components import callgraph, exportcomponents, procedures, resolvecomponents
+from vbaunit_lib.fakebackend import VBEXT_CT_CLASSMODULE, FakeBackend
+
+
+CODE = """Option Explicit
+
+Public Function Echo(ByVal v As Variant) As Variant
+    Echo = v
+End Function
+
+Private Sub Helper()
+End Sub
+
+Property Get Name() As String
+End Property
+"""
+
+
+def test_procedures():
+    assert procedures(CODE) == ["Echo", "Helper", "Name"]
+
+
+def test_resolvecomponents():
+    components = {"Module1": ["Echo", "Helper"], "Module2": ["Run"], "Class1": ["Name"], "Class2": ["Name"]}
+    callees = {name: [] for name in components}
+    calls = ["target.xlsm!Echo", "other.xlsm!Run"]
+    assert resolvecomponents(calls, "target.xlsm", components, callees) == {"Module1"}
+    assert resolvecomponents(["TARGET.xlsm!Module2.Run", "target.xlsm!New Class1"], "target.xlsm", components, callees) == {
+        "Module2",
+        "Class1",
+    }
+    # オブジェクトのメソッドは同じ名前を持つものを全て使ったとみなす
+    assert resolvecomponents(["target.xlsm!Name"], "target.xlsm", components, callees) == {"Class1", "Class2"}
+    assert resolvecomponents(["target.xlsm!Module3.*"], "target.xlsm", components, callees) is None
+    assert resolvecomponents(["target.xlsm!Unknown"], "target.xlsm", components, callees) is None
+
+
+def test_resolvecomponents_callees():
+    components = {"Module1": ["Echo"], "Module2": ["Run"], "Module3": ["Helper"], "Module4": []}
+    # 呼んだものから呼ばれるものも辿る
+    callees = {"Module1": ["Module2"], "Module2": ["Module3"], "Module3": ["Module1"], "Module4": []}
+    assert resolvecomponents(["target.xlsm!Echo"], "target.xlsm", components, callees) == {"Module1", "Module2", "Module3"}
+    # 呼び先が分からなければ決められない
+    del callees["Module3"]
+    assert resolvecomponents(["target.xlsm!Echo"], "target.xlsm", components, callees) is None
+
+
+def test_callgraph():
+    codes = {
+        "Module1": CODE.replace("Echo = v", "Echo = Module2.Twice(v)\n    Dim c As New Class1"),
+        "Module2": "Function Twice(v)\n    Twice = 計算(v) ' Helper\nEnd Function",
+        "Module3": 'Sub Main()\n    Application.Run "Twice"\nEnd Sub',
+        "Module4": "Function 計算(v)\n    計算 = v * 2\nEnd Function",
+        "Class1": "Private m_name As String",
+    }
+    assert callgraph(codes) == {
+        "Module1": ["Class1", "Module2"],
+        # コメントのHelperも呼ぶとみなす
+        "Module2": ["Module1", "Module4"],
+        "Module3": ["Module2"],
+        "Module4": [],
+        "Class1": [],
+    }
+
+
+def test_exportcomponents():
+    backend = FakeBackend()
+    backend.registercomponent("target.xlsm", "Module1", code=CODE)
+    backend.registercomponent("target.xlsm", "Class1", VBEXT_CT_CLASSMODULE)
+    launched: list[int] = []
+    sources = exportcomponents(backend, Path("target.xlsm"), onlaunch=launched.append)
+    assert [(s.name, s.type) for s in sources] == [("Module1", 1), ("Class1", 2)]
+    assert launched == list(backend.apps)
+    assert sources[0].code == CODE.rstrip("\n")
+    assert sources[1].code == ""
+    assert not any(app.alive for app in backend.apps.values())
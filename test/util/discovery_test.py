@@ -0,0 +1,124 @@
+from pathlib import Path
+from util.discovery import discover_localimports, discover_source, discover_workbooks
+from util.types import TestModule
+
+
+DECORATED = """
+from vbaunit_lib.testlib import description, ignore, timeout
+import vbaunit_lib.testlib as testlib
+
+VBAUNIT_PARALLEL_SAFE = False
+
+
+def helper():
+    pass
+
+
+@description("first test")
+def test_b():
+    pass
+
+
+@ignore
+@description("ignored test")
+def test_a():
+    pass
+
+
+@testlib.description("outer")
+@testlib.description("inner")
+def test_c():
+    pass
+
+
+def test_d():
+    pass
+
+
+@timeout(30)
+@description("limited")
+def test_e():
+    pass
+"""
+
+
+def __picked(modulepath: Path, discovery: str) -> tuple[list[tuple], bool, str]:
+    m = TestModule("testidA", "subjectA", "groupA", str(modulepath), True, 2)
+    m.pick_testcases(discovery=discovery)
+    return [(tc.testfunction, tc.subject, tc.start_line, tc.ignore) for tc in m], m.parallelsafe, m.discoveredby
+
+
+def test_discover_same_as_exec(tmp_path):
+    modulepath = tmp_path.joinpath("decorated_test.py")
+    modulepath.write_text(DECORATED, encoding="utf-8")
+    bysource = __picked(modulepath, "ast")
+    byexec = __picked(modulepath, "exec")
+    assert bysource[2] == "ast"
+    assert byexec[2] == "exec"
+    assert bysource[0] == byexec[0]
+    assert bysource[1] is False
+    assert byexec[1] is False
+    assert [name for name, _, _, _ in bysource[0]] == ["test_a", "test_b", "test_c", "test_d", "test_e"]
+
+
+def test_discover_loadee():
+    m = TestModule("testidA", "subjectA", "groupA", str(Path(__file__).parent.joinpath("loadee.py")), True, 2)
+    m.pick_testcases()
+    assert m.discoveredby == "ast"
+    assert m["test_function_run"].subject == "This is a test function that runs."
+    assert m["test_function_ignore"].ignore is True
+    assert m.testmodule is None
+
+
+def test_discover_fallback_dynamic(tmp_path):
+    sources = [
+        "def make():\n    def f():\n        pass\n    return f\n\ntest_made = make()\n",
+        "import functools\n\n@functools.lru_cache\ndef test_cached():\n    pass\n",
+        "from os.path import *\n\ndef test_x():\n    pass\n",
+        "import sys\n\nif sys.platform:\n    def test_x():\n        pass\n",
+        "globals()['test_x'] = lambda: None\n",
+        "VBAUNIT_PARALLEL_SAFE: bool\n\ndef test_x():\n    pass\n",
+        "DESC = 'x'\nfrom vbaunit_lib.testlib import description\n\n@description(DESC)\ndef test_x():\n    pass\n",
+    ]
+    for index, source in enumerate(sources):
+        modulepath = tmp_path.joinpath(f"dynamic{index}_test.py")
+        modulepath.write_text(source, encoding="utf-8")
+        assert discover_source(modulepath) is None, source
+        _, _, discoveredby = __picked(modulepath, "ast")
+        assert discoveredby == "exec"
+
+
+def test_discover_missing_module(tmp_path):
+    m = TestModule("testidA", "subjectA", "groupA", str(tmp_path.joinpath("none.py")), True, 2)
+    m.pick_testcases()
+    assert m.count == 0
+
+
+def test_discover_workbooks(tmp_path):
+    modulepath = tmp_path.joinpath("books_test.py")
+    modulepath.write_text(
+        "def helper(lib):\n    return lib.openexcel('common.xlsm')\n\n\n"
+        "def test_x(lib):\n    with lib.runapp('b.xlsm'):\n        pass\n    with lib.runapp('a.xlsm'):\n        pass\n",
+        encoding="utf-8",
+    )
+    assert discover_workbooks(modulepath) == {"": ["common.xlsm"], "test_x": ["b.xlsm", "a.xlsm"]}
+    modulepath.write_text("def test_x(lib, name):\n    with lib.runapp(name):\n        pass\n", encoding="utf-8")
+    assert discover_workbooks(modulepath) is None
+
+
+def test_discover_localimports(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath("helpers").mkdir()
+    tmp_path.joinpath("helpers", "__init__.py").write_text("", encoding="utf-8")
+    tmp_path.joinpath("helpers", "books.py").write_text("from . import sheets\n", encoding="utf-8")
+    tmp_path.joinpath("helpers", "sheets.py").write_text("import os\n", encoding="utf-8")
+    tmp_path.joinpath("common.py").write_text("import imports_test\n", encoding="utf-8")
+    modulepath = tmp_path.joinpath("imports_test.py")
+    modulepath.write_text("import json\nimport common\nfrom helpers import books\n", encoding="utf-8")
+    # importしたものがさらにimportするものも辿り、自分自身と見つからないものは含めない
+    assert discover_localimports(modulepath) == [
+        tmp_path.joinpath("common.py").resolve(),
+        tmp_path.joinpath("helpers", "__init__.py").resolve(),
+        tmp_path.joinpath("helpers", "books.py").resolve(),
+        tmp_path.joinpath("helpers", "sheets.py").resolve(),
+    ]
@@ -0,0 +1,50 @@
+from util.discoverypool import discover_modules
+from util.types import TestScenario, TestSuite
+
+
+DYNAMIC = """
+def make(index):
+    def f():
+        pass
+    return f
+
+
+VBAUNIT_PARALLEL_SAFE = {safe}
+
+for index in range({count}):
+    globals()[f"test_{prefix}{{index}}"] = make(index)
+"""
+
+
+def __write(tmp_path, name: str, prefix: str, count: int, safe: bool = True):
+    modulepath = tmp_path.joinpath(name)
+    modulepath.write_text(DYNAMIC.format(prefix=prefix, count=count, safe=safe), encoding="utf-8")
+    return modulepath
+
+
+def test_discover_modules_parallel_same_as_serial(tmp_path):
+    paths = [str(__write(tmp_path, f"dyn{i}_test.py", f"m{i}_", i + 1, i % 2 == 0)) for i in range(4)]
+    serial = discover_modules(paths, 1)
+    parallel = discover_modules(paths + paths[:1], 2)
+    assert list(parallel) == paths
+    assert parallel == serial
+    assert [len(serial[p].tests) for p in paths] == [1, 2, 3, 4]
+    assert [serial[p].parallelsafe for p in paths] == [True, False, True, False]
+
+
+def test_suite_parallel_discovery_keeps_scenario_order(tmp_path, makescenario):
+    a = __write(tmp_path, "a_test.py", "a", 2)
+    b = __write(tmp_path, "b_test.py", "b", 3)
+    scenariopath = makescenario(
+        {
+            "GroupA": [("A-001", "a", str(b), True), ("A-002", "b", str(a), True)],
+            "GroupB": [("B-001", "c", str(b), True)],
+        }
+    )
+    serial = TestSuite("serial", "", TestScenario(scenariopath), discoveryjobs=1)
+    parallel = TestSuite("parallel", "", TestScenario(scenariopath), discoveryjobs=3)
+    expected = [("A-001", "test_b0"), ("A-001", "test_b1"), ("A-001", "test_b2"), ("A-002", "test_a0"), ("A-002", "test_a1")]
+    expected += [("B-001", "test_b0"), ("B-001", "test_b1"), ("B-001", "test_b2")]
+    assert [(tc.testid, tc.testfunction) for tc in serial] == expected
+    assert [(tc.testid, tc.testfunction) for tc in parallel] == expected
+    assert parallel.discoverycount["exec"] == 3
@@ -0,0 +1,94 @@
+from pathlib import Path
+import pytest
+from vbaunit_lib.comretry import RETRY_BACKOFF, RETRY_FAIL, RETRY_FAST, ComRetryPolicy, RetryingBackend, classify
+from vbaunit_lib.fakebackend import DISP_E_EXCEPTION, RPC_E_CALL_REJECTED, FakeBackend, FakeComError, FakeVBAError
+
+
+BRIDGE = Path("VBAUnitCOMBridge.xlsm")
+
+
+def test_classify():
+    assert classify(FakeComError(RPC_E_CALL_REJECTED, "")) == RETRY_BACKOFF
+    assert classify(FakeComError(-2147417847, "")) == RETRY_FAST
+    assert classify(FakeComError(-2147023174, "")) == RETRY_FAIL
+    assert classify(FakeComError(DISP_E_EXCEPTION, "", (0, "VBAProject", "", None, 0, 11))) == RETRY_FAIL
+    # DISP_E_EXCEPTIONに包まれていても中身で分ける
+    assert classify(FakeComError(DISP_E_EXCEPTION, "", (0, "Excel", "", None, 0, -2146777998))) == RETRY_BACKOFF
+    assert classify(FakeComError(0, "")) == RETRY_FAIL
+
+
+def __openbackend(sleeps: list[float], **kwargs) -> tuple[FakeBackend, RetryingBackend, object]:
+    fake = FakeBackend()
+    fake.registermacro("target.xlsm", "Echo", lambda v: v)
+
+    def raiseerror():
+        raise FakeVBAError(11, "Division by zero")
+
+    fake.registermacro("target.xlsm", "RaiseError", raiseerror)
+    backend = RetryingBackend(fake, ComRetryPolicy(fake.comerrors(), sleep=sleeps.append, **kwargs))
+    app = backend.launch(False)
+    book = backend.openbook(app, Path("target.xlsm"))
+    return fake, backend, book
+
+
+def test_backoff_retries_each_call():
+    sleeps: list[float] = []
+    fake, backend, book = __openbackend(sleeps, backoffdelay=0.1, maxdelay=0.3)
+    fake.rejectcalls(4)
+    assert backend.macro(book, "Echo")(1) == 1
+    assert fake.callcount == 1
+    # 間隔は倍々で延びて、上限で止まる。揺らぎは半分まで
+    assert 0.05 <= sleeps[0] <= 0.1
+    assert 0.1 <= sleeps[1] <= 0.2
+    assert all(0.15 <= s <= 0.3 for s in sleeps[2:])
+    stats = backend.policy.stats
+    assert (stats.fast, stats.backoff, stats.failed, stats.exhausted) == (0, 4, 0, 0)
+
+
+def test_fast_retries():
+    sleeps: list[float] = []
+    fake, backend, book = __openbackend(sleeps, fastdelay=0.01)
+    fake.rejectcalls(2, hresult=-2147417847)
+    assert backend.macro(book, "Echo")(2) == 2
+    assert sleeps == [0.01, 0.01]
+    assert backend.policy.stats.fast == 2
+
+
+def test_fail_immediately():
+    sleeps: list[float] = []
+    _, backend, book = __openbackend(sleeps)
+    with pytest.raises(FakeComError):
+        backend.macro(book, "RaiseError")()
+    assert sleeps == []
+    assert backend.policy.stats.failed == 1
+
+
+def test_give_up_after_limit():
+    sleeps: list[float] = []
+    fake, backend, book = __openbackend(sleeps, backoffretries=2)
+    fake.rejectcalls(5)
+    with pytest.raises(FakeComError):
+        backend.macro(book, "Echo")(1)
+    assert len(sleeps) == 2
+    assert backend.policy.stats.exhausted == 1
+
+
+def test_onretry():
+    sleeps: list[float] = []
+    notified: list[tuple] = []
+    fake, backend, book = __openbackend(sleeps, backoffretries=2, onretry=lambda *args: notified.append(args))
+    fake.rejectcalls(5)
+    with pytest.raises(FakeComError):
+        backend.macro(book, "Echo")(1)
+    assert [(n[0], n[1], n[2], n[3]) for n in notified] == [
+        ("retry", RETRY_BACKOFF, RPC_E_CALL_REJECTED, 1),
+        ("retry", RETRY_BACKOFF, RPC_E_CALL_REJECTED, 2),
+        ("exhausted", RETRY_BACKOFF, RPC_E_CALL_REJECTED, 3),
+    ]
+    assert [n[4] for n in notified[:2]] == sleeps
+    # やり直さないエラーも知らせる
+    notified.clear()
+    _, backend, book = __openbackend(sleeps, onretry=lambda *args: notified.append(args))
+    with pytest.raises(FakeComError):
+        backend.macro(book, "RaiseError")()
+    assert [(n[0], n[1], n[3], n[4]) for n in notified] == [("failed", RETRY_FAIL, 1, 0.0)]
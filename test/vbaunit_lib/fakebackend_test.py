@@ -0,0 +1,310 @@
+from pathlib import Path
+import pytest
+from vbaunit_lib.fakebackend import FakeBackend, FakeCollection, FakeComError, FakeVBAError
+from vbaunit_lib.testlib import (
+    VBAUnitTestLib,
+    collection_to_list,
+    dictionary_to_dict,
+    expect_collection_dict,
+    expect_collection_list,
+    expect_dictionary,
+    takecomleaks,
+)
+
+
+BRIDGE = Path("VBAUnitCOMBridge.xlsm")
+
+
+class Class1:
+    def __init__(self) -> None:
+        self.message = ""
+
+    def SetMessage(self, message: str) -> None:  # noqa: N802
+        self.message = message
+
+    def GetMessage(self) -> str:  # noqa: N802
+        return self.message
+
+
+@pytest.fixture
+def backend():
+    fake = FakeBackend()
+    fake.registermacro("CallMacro.xlsm", "BackReturn", lambda p: f"Value is {p}")
+
+    def backrefint(args):
+        args[0] = 100
+
+    fake.registermacro("CallMacro.xlsm", "BackRefInt", backrefint, byref=True)
+
+    def raiseerror():
+        raise FakeVBAError(11, "Division by zero")
+
+    fake.registermacro("CallMacro.xlsm", "RaiseError", raiseerror)
+    fake.registermacro("CallMacro.xlsm", "GetSimpleMessage", lambda: "Simple Module Message")
+    fake.registerclass("CallMacro.xlsm", "Class1", Class1)
+    fake.registercomponent("CallMacro.xlsm", "Module1")
+    return fake
+
+
+def test_book_macro(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm") as testbook:
+        assert testbook.macro("GetSimpleMessage")() == "Simple Module Message"
+        assert testbook.macro("Module1.GetSimpleMessage")() == "Simple Module Message"
+    assert backend.launchcount == 1
+    assert not any(app.alive for app in backend.apps.values())
+
+
+def test_callmacro_return(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm"):
+        res = testlib.callmacro(None, "BackReturn", 123)
+        assert len(res) == 4
+        assert res[0] == "Value is 123"
+        assert res[1] == 123
+        assert res[2] == 0
+
+
+def test_callmacro_byref(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm"):
+        res = testlib.callmacro(None, "BackRefInt", 0)
+        assert res[0] is None
+        assert res[1] == 100
+
+
+def test_callmacro_error(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm"):
+        res = testlib.callmacro(None, "RaiseError")
+        assert res[1] == 11
+        assert res[2] == "Division by zero"
+        res = testlib.callmacro(None, "NoSuchMacro")
+        assert res[1] == 1004
+
+
+def test_book_macro_error(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm") as testbook:
+        with pytest.raises(FakeComError):
+            testbook.macro("RaiseError")()
+
+
+def test_newinstance_and_object_macro(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm") as testbook:
+        obj = testlib.create_newinstance("Class1")
+        assert isinstance(obj, Class1)
+        testlib.callmacro(obj, "SetMessage", "dynamic object")
+        res = testlib.callmacro(obj, "GetMessage")
+        assert res[0] == "dynamic object"
+    # 生成用のモジュールは終了時に削除されている
+    assert [c.Name for c in testbook.api.VBProject.VBComponents] == ["Class1", "Module1"]
+
+
+def test_newinstance_reuses_factory_module(backend):
+    backend.registerclass("CallMacro.xlsm", "Class2", Class1)
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm") as testbook:
+        components = testbook.api.VBProject.VBComponents
+        first = testlib.create_newinstance("Class1")
+        assert components.Count == 4
+        before = backend.callcount
+        second = testlib.create_newinstance("Class1")
+        # 2回目は生成用の関数を呼ぶだけ
+        assert backend.callcount - before == 1
+        assert components.Count == 4
+        assert first is not second
+        # 別のクラスは同じモジュールに足す
+        assert isinstance(testlib.create_newinstance("Class2"), Class1)
+        assert components.Count == 4
+        assert isinstance(testlib.create_newinstance("Class1"), Class1)
+    assert [c.Name for c in testbook.api.VBProject.VBComponents] == ["Class1", "Module1", "Class2"]
+
+
+def test_backdoor(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm") as testbook:
+        testlib.create_backdoor("Module1", "Public Function Backdoor() As String\nEnd Function\n")
+        module1 = testbook.api.VBProject.VBComponents.Item("Module1")
+        assert module1.CodeModule.CountOfLines == 2
+        assert not testbook.api.Saved
+
+
+def test_queued_backdoors(backend, monkeypatch):
+    backend.registercomponent("CallMacro.xlsm", "Module2", code="Option Explicit")
+    lookups = []
+    vbcomponents = backend.vbcomponents
+    monkeypatch.setattr(backend, "vbcomponents", lambda book: lookups.append(book) or vbcomponents(book))
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm") as testbook:
+        components = testbook.api.VBProject.VBComponents
+        inserts = []
+        for name in ("Module1", "Module2"):
+            code_module = components.Item(name).CodeModule
+            insertlines = code_module.InsertLines
+            monkeypatch.setattr(code_module, "InsertLines", lambda line, code, f=insertlines, n=name: inserts.append(n) or f(line, code))
+
+        assert testlib.queue_backdoor("Module1", "Public Function A() As Long\nEnd Function")
+        assert testlib.queue_backdoor("Module2", "Public Function B() As Long\nEnd Function\n")
+        assert testlib.queue_backdoor("Module1", "Public Function C() As Long\nEnd Function\n")
+        assert not testlib.queue_backdoor("NoSuchModule", "")
+        assert inserts == []
+        # マクロを呼ぶ前にモジュール毎に1回で書き込む
+        testlib.callmacro(None, "GetSimpleMessage")
+        assert sorted(inserts) == ["Module1", "Module2"]
+        assert components.Item("Module1").CodeModule.CountOfLines == 4
+        assert components.Item("Module2").CodeModule.Lines(1, 3) == "Option Explicit\r\nPublic Function B() As Long\r\nEnd Function"
+        testlib.create_backdoor("Module1", "Public Function D() As Long\nEnd Function\n")
+        assert components.Item("Module1").CodeModule.Lines(5, 1) == "Public Function D() As Long"
+        # VBComponentsを調べるのは1回だけ
+        assert len(lookups) == 1
+
+
+def test_bridge_objects(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm"):
+        coll = testlib.getcollectionobj()
+        coll.Add("a")
+        coll.Add("b")
+        expect_collection_list(["a", "b"], coll)
+        dic = testlib.getdictionaryobj()
+        dic.Add(1, "x")
+        expect_dictionary({1: "x"}, dic)
+        arr = testlib.getdynamicarray(1, 3, 0, 1)
+        assert len(arr) == 3
+        assert len(arr[0]) == 2
+
+
+def test_comobject_registry(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    takecomleaks()
+    with testlib.runapp("CallMacro.xlsm"):
+        kept = [testlib.getcollectionobj() for _ in range(300)]
+        freed = testlib.getdictionaryobj()
+        testlib.freeobj(freed)
+        testlib.create_newinstance("Class1")
+        before = backend.callcount
+        testlib.freeobjs()
+        # 残っていたものはbridgeへの1回の呼び出しでまとめて解放する
+        assert backend.callcount - before == 1
+        assert len(kept) == 300
+    leaks = takecomleaks()
+    assert [(leak.count, leak.macro) for leak in leaks] == [(300, "GetNewCollection"), (1, "New Class1")]
+    assert leaks[0].callsite.startswith("fakebackend_test.py:")
+    assert takecomleaks() == []
+
+
+def test_closeexcel_frees_objects(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    takecomleaks()
+    testbook = testlib.openexcel("CallMacro.xlsm")
+    testlib.getcollectionobj()
+    before = backend.callcount
+    testlib.closeexcel()
+    # ブックを閉じる前にbridgeへの1回の呼び出しで解放している
+    assert backend.callcount - before == 1
+    assert testbook.closed
+    assert [(leak.count, leak.macro) for leak in takecomleaks()] == [(1, "GetNewCollection")]
+    testlib.exitapp()
+
+
+def test_dead_app_raises_comerror(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with pytest.raises(FakeComError):
+        with testlib.runapp("CallMacro.xlsm") as testbook:
+            backend.kill(testbook.app.pid)
+            testbook.macro("GetSimpleMessage")()
+
+
+def test_callmacro_batch(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm"):
+        obj = testlib.create_newinstance("Class1")
+        before = backend.callcount
+        res = testlib.callmacro_batch(
+            [
+                (None, "BackReturn", (1,)),
+                (None, "BackRefInt", [0]),
+                (obj, "SetMessage", ("batched",)),
+                (obj, "GetMessage", ()),
+                (None, "RaiseError", ()),
+            ]
+        )
+        # bridgeへの呼び出しは1回だけ
+        assert backend.callcount - before == 1
+        assert res[0][0] == "Value is 1"
+        assert res[1][1] == 100
+        assert res[3][0] == "batched"
+        assert res[3][1] == 0
+        assert res[4][1] == 11
+        assert res[4][2] == "Division by zero"
+
+
+def test_callmacro_batch_imports_bridge_module(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm"):
+        testlib.callmacro_batch([(None, "GetSimpleMessage", ())])
+        testlib.callmacro_batch([(None, "GetSimpleMessage", ())])
+        bridgebook = backend.apps[10000].findbook("VBAUnitCOMBridge.xlsm")
+        assert [c.Name for c in bridgebook.api.VBProject.VBComponents] == ["BridgeBatch"]
+        assert testlib.callmacro_batch([]) == []
+
+
+class CountingCollection(FakeCollection):
+    """Itemの呼び出し回数を数えるCollection"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.itemcalls = 0
+
+    def Item(self, index):  # noqa: N802
+        self.itemcalls += 1
+        return super().Item(index)
+
+
+def test_export_collection_and_dictionary(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm"):
+        coll = CountingCollection()
+        for i in range(1000):
+            coll.Add(i * 2, f"k{i}")
+        before = backend.callcount
+        assert collection_to_list(coll) == [i * 2 for i in range(1000)]
+        expect_collection_list([i * 2 for i in range(1000)], coll)
+        expect_collection_dict({"k1": 2, "k999": 1998} | {f"k{i}": i * 2 for i in range(1000)}, coll)
+        # bridgeでまとめて取り出すので、要素毎のItemは呼ばれない
+        assert coll.itemcalls == 0
+        assert backend.callcount - before == 3
+        with pytest.raises(AssertionError, match="item 2 value 2 != expectation value 3"):
+            expect_collection_list([0, 3] + [i * 2 for i in range(2, 1000)], coll)
+
+        dic = testlib.getdictionaryobj()
+        dic.Add("a", 1)
+        dic.Add(2, "b")
+        assert dictionary_to_dict(dic) == {"a": 1, 2: "b"}
+        expect_dictionary({"a": 1, 2: "b"}, dic)
+        with pytest.raises(AssertionError, match="dictionary count 2 != expectation count 1"):
+            expect_dictionary({"a": 1}, dic)
+
+        empty = testlib.getcollectionobj()
+        assert collection_to_list(empty) == []
+        assert dictionary_to_dict(testlib.getdictionaryobj()) == {}
+
+
+def test_export_collection_missing_key(backend):
+    testlib = VBAUnitTestLib(BRIDGE, withapp=False, backend=backend)
+    with testlib.runapp("CallMacro.xlsm"):
+        coll = testlib.getcollectionobj()
+        coll.Add(1, "a")
+        with pytest.raises(AssertionError, match="collection item b not found"):
+            expect_collection_dict({"b": 1}, coll)
+
+
+def test_export_without_bridge():
+    coll = CountingCollection()
+    coll.Add("x")
+    coll.Add("y")
+    # 開いているbridgeが無ければ1つずつ取り出す
+    assert collection_to_list(coll) == ["x", "y"]
+    assert coll.itemcalls == 2
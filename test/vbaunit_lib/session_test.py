@@ -0,0 +1,152 @@
+from pathlib import Path
+from vbaunit_lib.fakebackend import FakeBackend
+from vbaunit_lib.session import ExcelSession, ExcelSessionPool
+
+
+BRIDGE = Path("VBAUnitCOMBridge.xlsm")
+
+
+def test_session_opens_bridge():
+    backend = FakeBackend()
+    session = ExcelSession(backend, BRIDGE)
+    assert session.alive
+    assert session.bridgebook.name == "VBAUnitCOMBridge.xlsm"
+    assert session.targetbook is None
+    session.close()
+    assert not session.alive
+
+
+def test_session_reopen_same_target():
+    backend = FakeBackend()
+    session = ExcelSession(backend, BRIDGE)
+    book1 = session.opentarget("target.xlsm")
+    book2 = session.opentarget("target.xlsm")
+    # VBAのモジュール変数を持ち越さないように、既定では開き直す
+    assert book1 is not book2
+    assert book1.closed
+    assert session.reused == 0
+    assert session.reopened == 2
+    session.close()
+
+
+def test_session_reuse_same_target():
+    backend = FakeBackend()
+    session = ExcelSession(backend, BRIDGE)
+    book1 = session.opentarget("target.xlsm", reuse=True)
+    book2 = session.opentarget("target.xlsm", reuse=True)
+    assert book1 is book2
+    assert session.reused == 1
+    assert session.reopened == 1
+    session.close()
+
+
+def test_session_switch_target():
+    backend = FakeBackend()
+    session = ExcelSession(backend, BRIDGE)
+    book1 = session.opentarget("target1.xlsm")
+    book2 = session.opentarget("target2.xlsm")
+    assert book1 is not book2
+    assert book1.closed
+    assert session.targetpath == Path("target2.xlsm").resolve()
+    session.close()
+
+
+def test_session_reset_dirty_book():
+    backend = FakeBackend()
+    session = ExcelSession(backend, BRIDGE)
+    book1 = session.opentarget("target.xlsm", reuse=True)
+    book1.touch()
+    session.reset()
+    assert book1.closed
+    book2 = session.opentarget("target.xlsm", reuse=True)
+    assert book1 is not book2
+    session.close()
+
+
+def test_session_reset_marked_dirty():
+    backend = FakeBackend()
+    session = ExcelSession(backend, BRIDGE)
+    book1 = session.opentarget("target.xlsm", reuse=True)
+    session.markdirty()
+    session.reset()
+    assert book1.closed
+    session.close()
+
+
+def test_pool_launch_once():
+    backend = FakeBackend()
+    pool = ExcelSessionPool(backend, BRIDGE)
+    for _ in range(5):
+        session = pool.acquire("target.xlsm")
+        pool.release(session)
+    # Excelは使い回し、ブックはrunapp毎に開き直す
+    assert backend.launchcount == 1
+    assert pool.stats.launched == 1
+    assert pool.stats.reused == 0
+    assert pool.stats.reopened == 5
+    pool.shutdown()
+    assert pool.stats.closed == 1
+    assert not any(app.alive for app in backend.apps.values())
+
+
+def test_pool_reuse_book():
+    backend = FakeBackend()
+    pool = ExcelSessionPool(backend, BRIDGE)
+    for _ in range(5):
+        session = pool.acquire("target.xlsm", reusebook=True)
+        pool.release(session)
+    assert backend.launchcount == 1
+    assert pool.stats.reused == 4
+    assert pool.stats.reopened == 1
+    pool.shutdown()
+    assert pool.stats.closed == 1
+    assert not any(app.alive for app in backend.apps.values())
+
+
+def test_pool_switch_workbook_keeps_app():
+    backend = FakeBackend()
+    pool = ExcelSessionPool(backend, BRIDGE)
+    for target in ["a.xlsm", "a.xlsm", "b.xlsm", "b.xlsm", "a.xlsm"]:
+        session = pool.acquire(target, reusebook=True)
+        pool.release(session)
+    assert backend.launchcount == 1
+    assert pool.stats.reopened == 3
+    assert pool.stats.reused == 2
+    pool.shutdown()
+
+
+def test_pool_replace_dead_session():
+    backend = FakeBackend()
+    pool = ExcelSessionPool(backend, BRIDGE)
+    session = pool.acquire("target.xlsm")
+    pool.release(session)
+    backend.kill(session.pid)
+    session2 = pool.acquire("target.xlsm")
+    assert session2 is not session
+    assert session2.alive
+    assert backend.launchcount == 2
+    pool.release(session2)
+    pool.shutdown()
+
+
+def test_pool_release_broken():
+    backend = FakeBackend()
+    pool = ExcelSessionPool(backend, BRIDGE)
+    session = pool.acquire("target.xlsm")
+    pool.release(session, broken=True)
+    assert not session.alive
+    assert pool.pids == []
+    pool.shutdown()
+
+
+def test_pool_nested_acquire():
+    backend = FakeBackend()
+    pool = ExcelSessionPool(backend, BRIDGE, maxidle=1)
+    session1 = pool.acquire("a.xlsm")
+    session2 = pool.acquire("b.xlsm")
+    assert session1 is not session2
+    pool.release(session2)
+    pool.release(session1)
+    # 待機は1つまでなので後から返した方は終了する
+    assert len(pool.pids) == 1
+    pool.shutdown()
@@ -164,6 +164,18 @@ def test_callmacro_return():
         assert res[1] == 123
 
 
+def test_callmacro_batch():
+    setglobalbridgepath(Path("C:/Dev/VBAUnit/src/VBAUnitCOMBridge.xlsm"))
+    testlib = gettestlib()  # withapp=False, visible=False
+    with testlib.runapp("C:/Dev/VBAUnit/test/vbaunit_lib/CallMacro.xlsm"):
+        res = testlib.callmacro_batch([(None, "BackReturn", (1,)), (None, "BackReturn", (2,))])
+        assert len(res) == 2
+        assert res[0][0] == "Value is 1"
+        assert res[0][2] == 0
+        assert res[1][0] == "Value is 2"
+        assert res[1][2] == 0
+
+
 def test_callmacro_createobject():
     setglobalbridgepath(Path("C:/Dev/VBAUnit/src/VBAUnitCOMBridge.xlsm"))
     testlib = gettestlib()  # withapp=False, visible=False